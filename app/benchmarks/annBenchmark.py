@@ -0,0 +1,124 @@
+"""
+Recall and latency of the HNSW index on images.embedding versus exact (sequential) search.
+
+    python -m app.benchmarks.annBenchmark --sizes 100000 1000000 --queries 100 --k 10
+
+Needs a pgvector database at POSTGRES_URL. Each size is loaded into a scratch table
+`ann_bench_<size>` holding clustered unit vectors (closer to real prompt embeddings than
+uniform noise), indexed exactly like db-init/migration_001_embedding_hnsw.sql, and dropped
+afterwards unless --keep is given.
+"""
+import argparse
+import time
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+from app.utils.database import POSTGRES_URL
+
+DIM = 768
+LOAD_CHUNK = 50_000
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def clustered_vectors(rng: np.random.Generator, centers: np.ndarray, n: int) -> np.ndarray:
+    labels = rng.integers(len(centers), size=n)
+    noise = rng.normal(scale=0.5 / np.sqrt(DIM), size=(n, DIM))
+    return unit(centers[labels] + noise)
+
+
+def load_table(conn: psycopg.Connection, table: str, size: int, rng, centers):
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(f"CREATE TABLE {table} (id INT PRIMARY KEY, embedding VECTOR({DIM}))")
+    start = time.perf_counter()
+    with conn.cursor().copy(f"COPY {table} (id, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+        copy.set_types(["int4", "vector"])
+        for offset in range(0, size, LOAD_CHUNK):
+            chunk = clustered_vectors(rng, centers, min(LOAD_CHUNK, size - offset))
+            for i, vector in enumerate(chunk, start=offset):
+                copy.write_row((i, vector))
+    conn.execute(f"ANALYZE {table}")
+    conn.commit()
+    print(f"  loaded {size:,} rows in {time.perf_counter() - start:.1f}s")
+
+
+def run_queries(conn: psycopg.Connection, table: str, queries: np.ndarray, k: int):
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows = conn.execute(
+            f"SELECT id FROM {table} ORDER BY embedding <=> %s LIMIT %s", (query, k)
+        ).fetchall()
+        latencies.append(time.perf_counter() - start)
+        ids.append({row[0] for row in rows})
+    return ids, np.array(latencies) * 1000
+
+
+def report(label: str, latencies_ms: np.ndarray, recall: float):
+    print(
+        f"  {label:<22} recall@k {recall:6.3f}   p50 {np.percentile(latencies_ms, 50):8.2f} ms"
+        f"   p95 {np.percentile(latencies_ms, 95):8.2f} ms"
+    )
+
+
+def benchmark_size(conn, size: int, args, rng):
+    table = f"ann_bench_{size}"
+    print(f"\n== {size:,} rows ==")
+    centers = unit(rng.normal(size=(args.clusters, DIM)))
+    load_table(conn, table, size, rng, centers)
+    queries = clustered_vectors(rng, centers, args.queries)
+
+    # Exact search: forbid the index so the planner does a full scan + sort
+    conn.execute("SET enable_indexscan = off")
+    exact_ids, exact_ms = run_queries(conn, table, queries, args.k)
+    conn.execute("RESET enable_indexscan")
+    report("exact (seq scan)", exact_ms, 1.0)
+
+    start = time.perf_counter()
+    conn.execute(f"SET maintenance_work_mem = '{args.maintenance_work_mem}'")
+    conn.execute(
+        f"CREATE INDEX ON {table} USING hnsw (embedding vector_cosine_ops) "
+        f"WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+    )
+    conn.commit()
+    build_s = time.perf_counter() - start
+    index_size = conn.execute(f"SELECT pg_size_pretty(pg_indexes_size('{table}'::regclass))").fetchone()[0]
+    print(f"  hnsw build (m={args.m}, ef_construction={args.ef_construction}): {build_s:.1f}s, indexes {index_size}")
+
+    for ef_search in args.ef_search:
+        conn.execute(f"SET hnsw.ef_search = {max(ef_search, args.k)}")
+        ann_ids, ann_ms = run_queries(conn, table, queries, args.k)
+        recall = np.mean([len(a & e) / args.k for a, e in zip(ann_ids, exact_ids)])
+        report(f"hnsw ef_search={ef_search}", ann_ms, recall)
+
+    if not args.keep:
+        conn.execute(f"DROP TABLE {table}")
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[20, 40, 100, 200])
+    parser.add_argument("--maintenance-work-mem", default="2GB")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch tables")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    with psycopg.connect(POSTGRES_URL) as conn:
+        register_vector(conn)
+        for size in args.sizes:
+            benchmark_size(conn, size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Prompt encoder throughput, in prompts per second per core, across batch sizes.
+
+    python -m app.benchmarks.encoderBenchmark --prompts 20000 --batch-sizes 1 8 32 128 512
+
+Runs single-threaded and measures CPU time, so the numbers are per core. Pass
+--encoder path/to/model.npz to benchmark a projection model instead of the hashing encoder.
+"""
+import argparse
+import random
+import time
+
+from app.utils.promptEncoder import EMBEDDING_ENCODER, load_encoder
+
+DISHES = ["Vegan Pancakes", "Beef Stew", "Chicken Curry", "Caesar Salad", "Mushroom Risotto", "Fish Tacos"]
+INGREDIENTS = [
+    "flour", "almond milk", "banana", "beef", "carrots", "potatoes", "chicken", "coconut milk",
+    "romaine", "parmesan", "arborio rice", "mushrooms", "cod", "tortillas", "lime", "cilantro",
+]
+
+
+def synthetic_prompts(count: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        "highly detailed, 4k, sharp lighting, A professional food photography shot of "
+        f"{rng.choice(DISHES)}, made with {', '.join(rng.sample(INGREDIENTS, rng.randint(3, 8)))}. "
+        "Served in a beautiful setting. High resolution."
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=20_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    parser.add_argument("--encoder", default=EMBEDDING_ENCODER)
+    args = parser.parse_args()
+
+    encoder = load_encoder(args.encoder)
+    prompts = synthetic_prompts(args.prompts)
+    encoder.encode(prompts[:64])  # warm up
+
+    print(f"{type(encoder).__name__}, {args.prompts} prompts, dim {encoder.dim}")
+    for batch_size in args.batch_sizes:
+        start = time.process_time()
+        for offset in range(0, len(prompts), batch_size):
+            encoder.encode(prompts[offset:offset + batch_size])
+        cpu_seconds = time.process_time() - start
+        print(f"  batch {batch_size:>5}: {len(prompts) / cpu_seconds:>10,.0f} prompts/sec/core")
+
+
+if __name__ == "__main__":
+    main()
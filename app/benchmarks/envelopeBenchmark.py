@@ -0,0 +1,90 @@
+"""
+Encode/decode cost and size of broker envelopes per wire encoding.
+
+    python -m app.benchmarks.envelopeBenchmark --messages 20000
+
+"pydantic .json()" is the path before app.utils.envelopeCodec: `message.json()` on publish and
+`json.loads` of the whole body in every consumer. "json" and "msgpack" are the codec's
+encodings (publish: encode_envelope, consume: decode_envelope into the dict consumers use).
+Each is measured on the envelopes the services actually send: generation jobs, embedding
+requests and job status events.
+"""
+import argparse
+import json
+import time
+import uuid
+import warnings
+from types import SimpleNamespace
+
+from app.utils.envelopeCodec import decode_envelope, encode_envelope
+from app.utils.jobEvents import job_event_message
+from app.utils.mcpUtils import Context, MCPMessageWrapper, generation_message
+
+PROMPT = (
+    "A professional food photography shot of Vegan Pancakes, made with flour, almond milk, banana. "
+    "Served in a beautiful setting. High resolution."
+)
+
+
+def sample_messages() -> dict[str, MCPMessageWrapper]:
+    context = Context(model_type="recipe", user_id="tenant-a")
+    image_url = f"store://ab/{uuid.uuid4().hex * 2}.webp"
+    return {
+        "generate": generation_message(PROMPT, "recipe", user_id="tenant-a", metadata={"coalesce_key": "ab" * 32}),
+        "embed": MCPMessageWrapper(
+            task="embed.vector", input={"prompt": PROMPT, "image_url": image_url},
+            input_type="text", output_type="embedding", context=context
+        ),
+        "job event": job_event_message(context, "completed", image_id=str(uuid.uuid4())),
+    }
+
+
+def legacy_encode(message: MCPMessageWrapper):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # .json() is deprecated in Pydantic 2, which is the point
+        return message.json().encode(), None
+
+
+def legacy_decode(body: bytes, properties):
+    return json.loads(body)
+
+
+def codec(encoding: str):
+    def encode(message: MCPMessageWrapper):
+        body, content_type, headers = encode_envelope(message, encoding)
+        return body, SimpleNamespace(content_type=content_type, headers=headers)
+    return encode, decode_envelope
+
+
+def timed(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="encodes/decodes timed per case")
+    args = parser.parse_args()
+
+    paths = {
+        "pydantic .json()": (legacy_encode, legacy_decode),
+        "json": codec("json"),
+        "msgpack": codec("msgpack"),
+    }
+    for kind, message in sample_messages().items():
+        print(f"{kind}:")
+        baseline = None
+        for name, (encode, decode) in paths.items():
+            body, properties = encode(message)
+            assert decode(body, properties)["context"]["trace_id"] == message.context.trace_id
+            encode_us = timed(lambda: encode(message), args.messages)
+            decode_us = timed(lambda: decode(body, properties), args.messages)
+            baseline = baseline or encode_us + decode_us
+            print(f"  {name:>16}: {len(body):5d} bytes, encode {encode_us:6.2f} µs, decode {decode_us:6.2f} µs "
+                  f"({baseline / (encode_us + decode_us):.2f}x round trip)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+In-memory stand-ins for RabbitMQ and Postgres, for running the real service code in one
+process (see pipelineBenchmark). Each takes a latency so the round trips cost roughly
+what they would over the network; everything else is as cheap as a dict.
+"""
+import asyncio
+import itertools
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from aio_pika.abc import AbstractMessage
+
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
+
+
+def _topic_pattern(binding_key: str) -> re.Pattern:
+    words = []
+    for word in binding_key.split("."):
+        words.append({"*": r"[^.]+", "#": r".*"}.get(word, re.escape(word)))
+    return re.compile(r"\.".join(words).replace(r"\..*", r"(\..*)?") + "$")
+
+
+class FakeExchange:
+    """What AsyncRabbitMQPublisher.publish_message awaits: a confirmed publish to a topic exchange."""
+
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+
+    async def publish(self, message: AbstractMessage, routing_key: str, timeout: float | None = None):
+        await asyncio.sleep(self.broker.latency)  # publish + confirm round trip
+        self.broker.route(message, routing_key)
+
+
+class FakeBroker:
+    """
+    A topic exchange with in-memory queues. Deliveries carry the aio-pika Message the
+    publisher built, so consumers see the real body, content type and headers.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.bindings: list[tuple[re.Pattern, asyncio.Queue]] = []
+        self.published = 0
+
+    def bind(self, binding_key: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.bindings.append((_topic_pattern(binding_key), queue))
+        return queue
+
+    def route(self, message: AbstractMessage, routing_key: str):
+        self.published += 1
+        for pattern, queue in self.bindings:
+            if pattern.match(routing_key):
+                queue.put_nowait((message, time.perf_counter()))
+
+    def attach(self, publisher: AsyncRabbitMQPublisher):
+        """Point a publisher at this broker instead of connecting it to RabbitMQ."""
+        publisher.exchanges = [FakeExchange(self)]
+        publisher._next_exchange = itertools.cycle(publisher.exchanges)
+
+    async def consume(
+            self,
+            queue: asyncio.Queue,
+            handler: Callable[[Any, bytes], Awaitable[None]],
+            concurrency: int,
+            on_delivery: Callable[[float], None] | None = None
+    ):
+        """Like RabbitMQConsumer.start_consuming_async: up to `concurrency` handlers in flight."""
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run(message):
+            try:
+                await handler(message, message.body)
+            except Exception as e:
+                print(f"❌ Handler failed: {e}")
+            finally:
+                slots.release()
+
+        while True:
+            await slots.acquire()
+            message, published_at = await queue.get()
+            if on_delivery:
+                on_delivery(time.perf_counter() - published_at)
+            asyncio.create_task(run(message))
+
+
+class FakeCursor:
+    def __init__(self, rows: list[tuple] = (), rowcount: int = 0):
+        self.rows = list(rows)
+        self.rowcount = rowcount or len(self.rows)
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    """Answers the statements the generation path issues, matched by their leading words."""
+
+    def __init__(self, db: "FakeDatabase"):
+        self.db = db
+
+    async def execute(self, sql: str, params: Any = None) -> FakeCursor:
+        await asyncio.sleep(self.db.latency)
+        self.db.statements += 1
+        statement = " ".join(sql.split())
+        if statement.startswith("INSERT INTO inflight_jobs"):
+            return self.db.claim(params["key"], params["job_id"], params["ttl"])
+        if statement.startswith("SELECT job_id FROM inflight_jobs"):
+            job = self.db.inflight_jobs.get(params[0])
+            return FakeCursor([(job[0],)] if job else [])
+        if statement.startswith("DELETE FROM inflight_jobs"):
+            key, job_id = params
+            job = self.db.inflight_jobs.get(key)
+            if job and str(job[0]) == job_id:
+                del self.db.inflight_jobs[key]
+                return FakeCursor(rowcount=1)
+            return FakeCursor()
+        if statement.startswith("INSERT INTO images"):
+            self.db.images.append(params)
+            return FakeCursor(rowcount=1)
+        raise ValueError(f"FakeDatabase has no answer for this statement: {statement}")
+
+
+class FakeDatabase:
+    """Stands in for an AsyncConnectionPool (connection(), open(), close()) over in-memory tables."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.min_size = self.max_size = 0
+        self.inflight_jobs: dict[str, tuple[uuid.UUID, float]] = {}
+        self.images: list[tuple] = []
+        self.statements = 0
+
+    def claim(self, key: str, job_id: uuid.UUID, ttl: float) -> FakeCursor:
+        job = self.inflight_jobs.get(key)
+        if job and job[1] > time.monotonic():
+            return FakeCursor()
+        self.inflight_jobs[key] = (job_id, time.monotonic() + ttl)
+        return FakeCursor([(job_id,)])
+
+    @asynccontextmanager
+    async def connection(self):
+        yield FakeConnection(self)
+
+    async def open(self, wait: bool = False):
+        pass
+
+    async def close(self):
+        pass
@@ -0,0 +1,110 @@
+"""
+Latency of indexed message log queries (app.utils.logIndex) over many segments.
+
+    python -m app.benchmarks.logQueryBenchmark --segments 300 --entries 20000 --queries 200
+
+Writes `--segments` segments of `--entries` entries each through RotatingLogSink, into a
+temporary directory, with about five messages per trace id spread over several routing
+keys. Then times query_logs for trace id lookups, the same within the hour around the
+trace, and one-minute time windows. With
+--compress every closed segment but the newest is gzipped first, as LOG_COMPRESS would.
+Timings are warm: the index files stay in the page cache between queries.
+"""
+import argparse
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.utils.logIndex import list_segments, query_logs
+from app.utils.logSink import RotatingLogSink
+
+ROUTING_KEYS = ("ai-tools.recipe", "ai-tools.embedding", "ai-tools.job.started", "ai-tools.job.completed")
+MESSAGES_PER_TRACE = 5
+START = datetime(2025, 5, 9, tzinfo=timezone.utc)
+
+
+def write_log(directory: str, segments: int, entries: int, compress: bool, rng) -> list[tuple[str, datetime]]:
+    """Write the segments, 1000 entries per minute of log time; return (trace id, segment start) pairs."""
+    sink = RotatingLogSink(directory, compress=False)
+    step = 60.0 / 1000
+    now = START.timestamp()
+    trace_ids = []
+    for segment in range(segments):
+        traces = [str(uuid.UUID(int=int(value))) for value in rng.integers(0, 2 ** 63, entries // MESSAGES_PER_TRACE)]
+        started = datetime.fromtimestamp(now, timezone.utc)
+        trace_ids.extend((trace_id, started) for trace_id in traces)
+        for i in range(entries):
+            trace_id = traces[rng.integers(len(traces))]
+            routing_key = ROUTING_KEYS[i % len(ROUTING_KEYS)]
+            timestamp = datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None).isoformat()
+            sink.append(
+                f'{{"timestamp": "{timestamp}", "routing_key": "{routing_key}", '
+                f'"body": {{"prompt": "entry {i}", "context": {{"trace_id": "{trace_id}"}}}}}}\n'.encode(),
+                timestamp=now,
+                routing_key=routing_key,
+                trace_id=trace_id
+            )
+            now += step
+        sink.flush()
+        closed = sink.segment_path
+        if segment < segments - 1:
+            sink.rotate()
+            if compress:
+                RotatingLogSink._compress(closed)
+    sink.close()
+    return trace_ids
+
+
+def measure(name: str, queries) -> None:
+    latencies, matched = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        matched += len(query())
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    print(f"{name:>22} {p50:9.2f} {p95:9.2f} {p99:9.2f}   {matched / len(latencies):8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--entries", type=int, default=20_000, help="entries per segment")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--compress", action="store_true", help="gzip the closed segments")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        trace_ids = write_log(directory, args.segments, args.entries, args.compress, rng)
+        print(f"Wrote {len(list_segments(directory))} segments x {args.entries} entries "
+              f"in {time.perf_counter() - start:.1f}s")
+        print(f"{'query':>22} {'p50':>9} {'p95':>9} {'p99':>9}   {'entries':>8}   (ms)")
+
+        span = timedelta(minutes=args.segments * args.entries / 1000)
+
+        def moment() -> datetime:
+            return START + span * float(rng.random())
+
+        picks = [trace_ids[i] for i in rng.integers(len(trace_ids), size=args.queries)]
+        measure("trace id", (lambda t=t: query_logs(directory, trace_id=t) for t, _ in picks))
+        measure("trace id, 1 h window", (
+            lambda t=t, m=m: query_logs(directory, trace_id=t, since=m - timedelta(minutes=30),
+                                        until=m + timedelta(minutes=30))
+            for t, m in picks
+        ))
+        moments = [moment() for _ in range(args.queries)]
+        measure("1 min window, 100", (
+            lambda m=m: query_logs(directory, since=m, until=m + timedelta(minutes=1), limit=100) for m in moments
+        ))
+        measure("routing key, 1 min", (
+            lambda m=m: query_logs(directory, routing_key=ROUTING_KEYS[0], since=m, until=m + timedelta(minutes=1))
+            for m in moments
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Latency per stage and throughput of the whole generation path, in one process.
+
+    python -m app.benchmarks.pipelineBenchmark --requests 500 --concurrency 32 --backend-latency 0.05
+
+Runs the real code: POST /generate (app.fastApi, through ASGI), AsyncRabbitMQPublisher,
+imageGenWorker.message_callback and the MCP store_image_metadata / release_inflight_job
+tools (app.mcpServer, over FastMCP's in-memory transport). RabbitMQ and Postgres are the
+in-memory fakes in app.benchmarks.fakes and the image API is app.tests.stubApi, each with
+its own latency, so no docker-compose is needed. Images are written to a temporary directory.
+
+Stages reported (ms): api = /generate as seen by the client, queue = publish to delivery,
+generate = backend call and image save, store = metadata via MCP, worker = whole
+message_callback, end-to-end = /generate sent to "completed" job event received.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import wraps
+
+import httpx
+import numpy as np
+
+from app import fastApi, mcpServer
+from app.benchmarks.fakes import FakeBroker, FakeDatabase
+from app.tests.stubApi import create_stub_app, run_stub_server
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
+from app.utils.fairScheduler import FairScheduler
+from app.utils.mcpClient import MCPClientSession
+from app.workers import imageGenWorker as worker
+
+STAGES = ("api", "queue", "generate", "store", "worker", "end-to-end")
+
+
+class Recorder:
+    """Samples (seconds) per stage, plus when each job was sent and completed."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.sent: dict[str, float] = {}
+        self.completed: dict[str, float] = {}
+        self.failed = 0
+        self.all_completed = asyncio.Event()
+        self.expected = 0
+
+    def timed(self, stage: str, fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - start)
+        return wrapper
+
+    def on_status(self, status):
+        fastApi.job_board.update(status)
+        if status.done and status.job_id not in self.completed:
+            self.completed[status.job_id] = time.perf_counter()
+            self.failed += status.state == "failed"
+            if len(self.completed) >= self.expected:
+                self.all_completed.set()
+
+    def end_to_end(self) -> list[float]:
+        return [self.completed[job] - sent for job, sent in self.sent.items() if job in self.completed]
+
+    def missing(self) -> list[str]:
+        """Jobs accepted by /generate that never reported completed or failed."""
+        return [job for job in self.sent if job not in self.completed]
+
+
+def payload(i: int, run: str) -> dict:
+    # Unique titles, so no request is coalesced into another's job
+    return {
+        "title": f"Dish {run}-{i}",
+        "ingredients": ["flour", "almond milk", "banana"],
+        "steps": ["Mix ingredients", "Cook", "Serve hot"]
+    }
+
+
+async def run_batch(
+        client: httpx.AsyncClient,
+        recorder: Recorder,
+        count: int,
+        concurrency: int,
+        run: str,
+        timeout: float
+) -> float:
+    recorder.expected = count
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with slots:
+            start = time.perf_counter()
+            response = await client.post("/generate", params={"model_type": "recipe"}, json=payload(i, run))
+            recorder.samples["api"].append(time.perf_counter() - start)
+            response.raise_for_status()
+            recorder.sent[response.json()["job_id"]] = start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(count)))
+    try:
+        await asyncio.wait_for(recorder.all_completed.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass  # the stragglers are reported as missing
+    return time.perf_counter() - start
+
+
+def report(recorder: Recorder, elapsed: float, published: int):
+    recorder.samples["end-to-end"] = recorder.end_to_end()
+    print(f"{'stage':>10} {'p50':>9} {'p95':>9} {'p99':>9}   (ms)")
+    for stage in STAGES:
+        samples = np.asarray(recorder.samples[stage]) * 1000
+        if samples.size:
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            print(f"{stage:>10} {p50:9.2f} {p95:9.2f} {p99:9.2f}")
+    jobs = len(recorder.end_to_end())
+    print(f"{jobs} jobs ({recorder.failed} failed) in {elapsed:.2f}s: {jobs / elapsed:,.1f} jobs/s, "
+          f"{published / elapsed:,.1f} broker messages/s")
+    missing = recorder.missing()
+    if missing:
+        print(f"⚠️ {len(missing)} jobs never finished, e.g. {', '.join(missing[:5])}")
+
+
+async def run_pipeline(args: argparse.Namespace, stub_url: str):
+    broker = FakeBroker(args.broker_latency)
+    db = FakeDatabase(args.db_latency)
+
+    api_publisher = AsyncRabbitMQPublisher()
+    worker_publisher = AsyncRabbitMQPublisher(pool_size=1)
+    broker.attach(api_publisher)
+    broker.attach(worker_publisher)
+    fastApi.app.state.publisher = api_publisher
+    fastApi.db_pool = db
+    mcpServer.db_pool = db
+
+    worker.API_TO_USE = "sdxl"
+    worker.STABILITY_BASE_URL = stub_url
+    worker.EMBEDDING_STAGE_ENABLED = False
+    worker.IMAGE_VARIANTS_ENABLED = False
+    worker.generation_cache = None
+    worker.semantic_reuse = None
+    worker.limiters = {"sdxl": None}
+    worker.publisher = worker_publisher
+    worker.scheduler = FairScheduler(args.worker_concurrency)
+    worker.mcp_session = MCPClientSession(mcpServer.mcp)
+    await worker.mcp_session.connect()
+
+    recorder = Recorder()
+    worker.generate = recorder.timed("generate", worker.generate)
+    worker.insert_image_metadata_via_mcp = recorder.timed("store", worker.insert_image_metadata_via_mcp)
+    fastApi.job_listener.on_status = recorder.on_status
+
+    consumers = [
+        asyncio.create_task(broker.consume(
+            broker.bind(worker.ROUTING_KEY),
+            recorder.timed("worker", worker.message_callback),
+            concurrency=args.worker_prefetch or args.worker_concurrency * 4,
+            on_delivery=lambda waited: recorder.samples["queue"].append(waited)
+        )),
+        asyncio.create_task(broker.consume(
+            broker.bind("ai-tools.job.*"),
+            lambda message, body: fastApi.job_listener._on_message(message),
+            concurrency=1
+        )),
+    ]
+    transport = httpx.ASGITransport(app=fastApi.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            if args.warmup:
+                await run_batch(client, recorder, args.warmup, args.concurrency, "warmup", args.timeout)
+                recorder.reset()
+            published_before = broker.published
+            elapsed = await run_batch(client, recorder, args.requests, args.concurrency, "run", args.timeout)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        await worker.mcp_session.close()
+
+    return recorder, elapsed, broker.published - published_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20, help="requests run first and left out of the results")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent /generate clients")
+    parser.add_argument("--worker-concurrency", type=int, default=worker.WORKER_CONCURRENCY,
+                        help="generation slots (WORKER_CONCURRENCY)")
+    parser.add_argument("--worker-prefetch", type=int, default=None,
+                        help="jobs held by the worker (WORKER_PREFETCH); default 4x the slots")
+    parser.add_argument("--broker-latency", type=float, default=0.001, help="seconds per publish confirm")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="seconds per statement")
+    parser.add_argument("--backend-latency", type=float, default=0.05, help="seconds per image generation")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds to wait for jobs after the last request; later ones are reported missing")
+    parser.add_argument("--verbose", action="store_true", help="keep the services' per-message logging")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            run_stub_server(create_stub_app(latency=args.backend_latency)) as stub_url:
+        os.chdir(workdir)  # the image store writes under ./output
+        # The services print per message; writing that to a terminal would dominate the timings
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            recorder, elapsed, published = asyncio.run(run_pipeline(args, stub_url))
+
+    print(f"{args.requests} requests, {args.concurrency} clients, {args.worker_concurrency} generation slots; "
+          f"latency: broker {args.broker_latency * 1000:g} ms, db {args.db_latency * 1000:g} ms, "
+          f"backend {args.backend_latency * 1000:g} ms")
+    report(recorder, elapsed, published)
+
+
+if __name__ == "__main__":
+    main()
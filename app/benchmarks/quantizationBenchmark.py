@@ -0,0 +1,117 @@
+"""
+Index size, memory and recall of the EMBEDDING_STORAGE modes against the plain VECTOR(768) column.
+
+    python -m app.benchmarks.quantizationBenchmark --size 100000 --queries 100 --k 10
+
+Needs a pgvector >= 0.7 database at POSTGRES_URL. Loads a scratch table with the same
+columns and indexes as images after db-init/migration_002 and both db-migrations/ scripts, then
+runs every search mode through app.utils.embeddingStorage.nearest_query. Recall is measured
+against exact float32 search; "memory" is the index size that has to stay cached in
+shared_buffers/page cache for index-only latency.
+"""
+import argparse
+import time
+
+import numpy as np
+import psycopg
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector
+
+from app.benchmarks.annBenchmark import DIM, LOAD_CHUNK, clustered_vectors, report, unit
+from app.utils.database import POSTGRES_URL
+from app.utils.embeddingStorage import STORAGE_MODES, nearest_query, shortlist_size
+
+TABLE = "quant_bench_images"
+INDEXES = {
+    "full": "USING hnsw (embedding vector_cosine_ops)",
+    "half": "USING hnsw (embedding_half halfvec_cosine_ops)",
+    "binary": "USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops)",
+}
+
+
+def load_table(conn: psycopg.Connection, size: int, rng, centers):
+    conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.execute(f"""
+        CREATE TABLE {TABLE} (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            prompt TEXT NOT NULL,
+            image_url TEXT NOT NULL,
+            embedding VECTOR({DIM}),
+            embedding_half HALFVEC({DIM}),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    with conn.cursor().copy(
+            f"COPY {TABLE} (prompt, image_url, embedding, embedding_half) FROM STDIN WITH (FORMAT BINARY)"
+    ) as copy:
+        copy.set_types(["text", "text", "vector", "halfvec"])
+        for offset in range(0, size, LOAD_CHUNK):
+            for i, vector in enumerate(clustered_vectors(rng, centers, min(LOAD_CHUNK, size - offset)), offset):
+                copy.write_row((f"prompt {i}", f"mock://{i}.webp", vector, HalfVector(vector)))
+    conn.execute(f"ANALYZE {TABLE}")
+    conn.commit()
+
+
+def column_bytes(conn, column: str) -> float:
+    return conn.execute(f"SELECT avg(pg_column_size({column})) FROM {TABLE}").fetchone()[0]
+
+
+def run_mode(conn, mode: str, queries: np.ndarray, k: int, ef_search: int):
+    conn.execute(f"SET hnsw.ef_search = {max(ef_search, shortlist_size(k, mode))}")
+    ids, latencies = [], []
+    for query in queries:
+        sql, params = nearest_query(query, k, mode=mode)
+        sql = sql.replace("FROM images", f"FROM {TABLE}")
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        latencies.append(time.perf_counter() - start)
+        ids.append({row[0] for row in rows})
+    return ids, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    centers = unit(rng.normal(size=(args.clusters, DIM)))
+    queries = clustered_vectors(rng, centers, args.queries)
+
+    with psycopg.connect(POSTGRES_URL) as conn:
+        register_vector(conn)
+        print(f"Loading {args.size:,} rows...")
+        load_table(conn, args.size, rng, centers)
+
+        print(f"\nStorage per row: vector {column_bytes(conn, 'embedding'):.0f} B, "
+              f"halfvec {column_bytes(conn, 'embedding_half'):.0f} B, bit {DIM // 8} B")
+        conn.execute("SET maintenance_work_mem = '2GB'")
+        for name, definition in INDEXES.items():
+            start = time.perf_counter()
+            conn.execute(f"CREATE INDEX {TABLE}_{name}_idx ON {TABLE} {definition} WITH (m = 16, ef_construction = 64)")
+            conn.commit()
+            size = conn.execute(f"SELECT pg_size_pretty(pg_relation_size('{TABLE}_{name}_idx'))").fetchone()[0]
+            print(f"  {name:<7} index: {size:>10}, built in {time.perf_counter() - start:.1f}s")
+
+        conn.execute("SET enable_indexscan = off")
+        exact_ids, exact_ms = run_mode(conn, "full", queries, args.k, args.ef_search)
+        conn.execute("RESET enable_indexscan")
+        print(f"\nrecall@{args.k} vs exact float32 search (ef_search={args.ef_search}):")
+        report("exact (seq scan)", exact_ms, 1.0)
+        for mode in STORAGE_MODES:
+            mode_ids, mode_ms = run_mode(conn, mode, queries, args.k, args.ef_search)
+            recall = np.mean([len(a & e) / args.k for a, e in zip(mode_ids, exact_ids)])
+            report(mode, mode_ms, recall)
+
+        if not args.keep:
+            conn.execute(f"DROP TABLE {TABLE}")
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Per-request cost of turning a /generate payload into a prompt: validation plus rendering.
+
+    python -m app.benchmarks.templateBenchmark --requests 200000
+
+Compares the registry (app.interfaces.registry: bound validator + template parsed at registration)
+against the previous per-request path, `model_class(**payload)` followed by an if/elif
+create_prompt, kept here as the baseline. Both must render the same prompts.
+"""
+import argparse
+import random
+import time
+from typing import Any
+
+from app.interfaces.models import PROMPT_TEMPLATES, Profile, Recipe
+
+DISHES = ["Vegan Pancakes", "Beef Stew", "Chicken Curry", "Caesar Salad", "Mushroom Risotto", "Fish Tacos"]
+INGREDIENTS = ["flour", "almond milk", "banana", "beef", "carrots", "potatoes", "chicken", "coconut milk", "lime"]
+HOBBIES = ["climbing", "chess", "baking", "cycling", "painting", "surfing"]
+
+
+def synthetic_payloads(count: int, seed: int = 7) -> list[tuple[str, dict[str, Any]]]:
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        if i % 2:
+            payloads.append(("profile", {
+                "name": f"User {i}", "hobbies": rng.sample(HOBBIES, 2), "bio": "Loves the outdoors."
+            }))
+        else:
+            payloads.append(("recipe", {
+                "title": rng.choice(DISHES),
+                "ingredients": rng.sample(INGREDIENTS, rng.randint(3, 6)),
+                "steps": ["Mix ingredients", "Cook", "Serve hot"],
+            }))
+    return payloads
+
+
+BASELINE_MODELS = {"recipe": Recipe, "profile": Profile}
+
+
+def baseline_prompt(dto_type: str, payload: dict[str, Any]) -> str:
+    obj = BASELINE_MODELS[dto_type](**payload)
+    if dto_type == "recipe":
+        return (
+            f"A professional food photography shot of {obj.title}, "
+            f"made with {', '.join(obj.ingredients)}. "
+            "Served in a beautiful setting. High resolution."
+        )
+    elif dto_type == "profile":
+        return (
+            f"Portrait of {obj.name}, who enjoys {', '.join(obj.hobbies)}. "
+            f"Bio: {obj.bio}"
+        )
+    return f"Prompt data: {obj.model_dump()}"
+
+
+def registry_prompt(dto_type: str, payload: dict[str, Any]) -> str:
+    return PROMPT_TEMPLATES.get(dto_type).build_prompt(payload)
+
+
+def run(build, payloads) -> float:
+    start = time.perf_counter()
+    for dto_type, payload in payloads:
+        build(dto_type, payload)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    payloads = synthetic_payloads(args.requests)
+    mismatches = sum(baseline_prompt(*p) != registry_prompt(*p) for p in payloads[:1000])
+    if mismatches:
+        parser.exit(1, f"Registry renders {mismatches} of 1000 prompts differently from the baseline\n")
+
+    print(f"{len(payloads)} payloads (recipe/profile), best of {args.repeat}")
+    baseline = None
+    for name, build in (("baseline", baseline_prompt), ("registry", registry_prompt)):
+        elapsed = min(run(build, payloads) for _ in range(args.repeat))
+        per_request = elapsed / len(payloads) * 1e6
+        baseline = baseline or per_request
+        print(f"  {name:>8}: {per_request:6.2f} µs/request, {len(payloads) / elapsed:10,.0f} requests/s "
+              f"({baseline / per_request:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Thumbnail/format-variant throughput of app.utils.imageVariants.render_variants across process counts.
+
+    python -m app.benchmarks.variantBenchmark --corpus worker_output/images --processes 1 2 4
+    python -m app.benchmarks.variantBenchmark --synthetic 64 --formats webp jpeg avif
+
+Uses the images under --corpus (searched recursively; existing variants are skipped) or
+--synthetic generated 1024x1024 images. Every run renders into a fresh scratch store, so
+nothing is skipped as already rendered and the corpus itself is never written to.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.utils.imageVariants import IMAGE_VARIANT_FORMATS, IMAGE_VARIANT_SIZES, render_variants
+
+IMAGE_EXTENSIONS = (".webp", ".png", ".jpg", ".jpeg", ".avif")
+
+
+def load_corpus(directory: str) -> list[str]:
+    paths = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            # Content-addressed variants are <sha>.<size>.<format>; originals have a single dot
+            if name.lower().endswith(IMAGE_EXTENSIONS) and name.count(".") == 1:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def synthetic_corpus(directory: str, count: int, seed: int = 42) -> list[str]:
+    """Blurred noise: compresses and resizes roughly like a photo, unlike flat colour."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        pixels = (rng.random((1024, 1024, 3)) * 255).astype(np.uint8)
+        path = os.path.join(directory, f"synthetic_{i}.webp")
+        Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(3)).save(path, "WEBP")
+        paths.append(path)
+    return paths
+
+
+def run(paths: list[str], processes: int, sizes: list[int], formats: list[str]) -> float:
+    with tempfile.TemporaryDirectory() as store, ProcessPoolExecutor(max_workers=processes) as pool:
+        list(pool.map(int, range(processes)))  # spawn before timing
+        render = partial(render_variants, sizes=sizes, formats=formats, directory=store)
+        start = time.perf_counter()
+        list(pool.map(render, paths))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus = parser.add_mutually_exclusive_group()
+    corpus.add_argument("--corpus", help="directory of source images")
+    corpus.add_argument("--synthetic", type=int, default=32, help="number of generated 1024x1024 images")
+    parser.add_argument("--processes", type=int, nargs="+", default=sorted({1, len(os.sched_getaffinity(0))}))
+    parser.add_argument("--sizes", type=int, nargs="+", default=IMAGE_VARIANT_SIZES)
+    parser.add_argument("--formats", nargs="+", default=IMAGE_VARIANT_FORMATS)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    try:
+        paths = load_corpus(args.corpus) if args.corpus else synthetic_corpus(scratch, args.synthetic)
+        if not paths:
+            parser.error(f"No images found under {args.corpus}")
+        variants = len(args.sizes) * len(args.formats)
+        print(f"{len(paths)} images -> {variants} variants each ({args.sizes} x {args.formats})")
+        baseline = None
+        for processes in args.processes:
+            elapsed = run(paths, processes, args.sizes, args.formats)
+            rate = len(paths) / elapsed
+            baseline = baseline or rate
+            print(f"  {processes:>3} processes: {rate:8.1f} images/s, {rate * variants:8.1f} variants/s "
+                  f"({rate / baseline:.2f}x)")
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,216 @@
-from fastapi import FastAPI, Request, HTTPException
-from typing import Dict, Any
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from fastapi import FastAPI, Header, Request, HTTPException, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from typing import Dict, Any, Optional, Tuple
 from contextlib import asynccontextmanager
-from app.interfaces.models import MODEL_MAP, create_prompt
-from app.utils.rabbitMQPublisher import RabbitMQPublisher
+from pydantic import ValidationError
+from app.interfaces.models import PROMPT_TEMPLATES
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
+from app.utils.database import create_pool
+from app.utils.imageStore import content_hash, resolve_image_url
+from app.utils.jobEvents import JobEventListener, JobStatus, JobStatusBoard, publish_job_event
+from app.utils.logIndex import query_logs
+from app.utils.logSink import LOG_DIR
+from app.utils.lruCache import LRUCache
+from app.utils.mcpUtils import Context, Priority
+from app.utils.metrics import METRICS_ENABLED, render_metrics, timed, trace_id_var
+from app.utils.singleFlight import claim_job, coalesce_key, release_job
+
+IMAGE_PATH_CACHE_SIZE = int(os.getenv("IMAGE_PATH_CACHE_SIZE", "100000"))
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600  # content-addressed files never change
+JOB_STREAM_KEEPALIVE = 15.0  # seconds between SSE comments, so idle proxies keep the stream open
 
 
 @asynccontextmanager
 async def lifespan(fast_app: FastAPI):
-    publisher.connect()
+    await publisher.connect()
     fast_app.state.publisher = publisher  # type: ignore[attr-defined]
     print("✅ RabbitMQ connection established.")
+    await job_listener.start()
+    await db_pool.open()
     yield
-    publisher.close()
+    await job_listener.close()
+    await publisher.close()
     print("❌ RabbitMQ connection closed.")
+    await db_pool.close()
 
 
 app = FastAPI(lifespan=lifespan)
-publisher = RabbitMQPublisher()
+publisher = AsyncRabbitMQPublisher()
+db_pool = create_pool(min_size=1)
+# image id -> (local path, variant paths); a row's image never changes, so entries need no TTL
+image_paths = LRUCache(maxsize=IMAGE_PATH_CACHE_SIZE)
+# job id -> latest JobStatus, fed by the ai-tools.job.* events of every worker and replica
+job_board = JobStatusBoard()
+job_listener = JobEventListener(job_board.update)
 
 
 @app.post("/generate")
-async def generate_image(model_type: str, payload: Dict[str, Any], request: Request):
-    if model_type not in MODEL_MAP:
+@timed("api.generate")
+async def generate_image(
+        model_type: str,
+        payload: Dict[str, Any],
+        request: Request,
+        priority: Priority = "interactive",
+        user_id: Optional[str] = Header(None, alias="X-User-Id")
+):
+    template = PROMPT_TEMPLATES.get(model_type)
+    if template is None:
         raise HTTPException(status_code=400, detail=f"Unsupported type '{model_type}'")
-    model_class = MODEL_MAP[model_type]
+    try:
+        prompt = template.build_prompt(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
+    key = coalesce_key(model_type, prompt)
     try:
-        model_instance = model_class(**payload)
+        # Identical requests, on this replica or another, join the job already in flight
+        async with db_pool.connection() as conn:
+            job_id, claimed = await claim_job(conn, key)
     except Exception as e:
-        raise HTTPException(status_code=422, detail=str(e))
+        raise HTTPException(status_code=503, detail=f"Job registry unavailable: {e}")
+    if not claimed:
+        status = job_board.get(job_id)
+        return {"status": status.state if status else "queued", "job_id": job_id, "coalesced": True}
 
+    trace_id_var.set(job_id)
+    # Announced before the job itself, so no replica sees "queued" after a worker's "started"
+    context = Context(trace_id=job_id, model_type=model_type, user_id=user_id, priority=priority)
+    job_board.update(JobStatus(job_id=job_id, state="queued"))
+    await publish_job_event(request.app.state.publisher, context, "queued")
     try:
-        prompt = create_prompt(model_type, model_instance)
-        request.app.state.publisher.publish(prompt, model_type)
-    except RuntimeError:
+        await request.app.state.publisher.publish(
+            prompt, model_type, user_id=user_id, priority=priority,
+            trace_id=job_id, metadata={"coalesce_key": key}
+        )
+    except RuntimeError as e:
+        job_board.update(JobStatus(job_id=job_id, state="failed", error=str(e)))
+        async with db_pool.connection() as conn:
+            await release_job(conn, key, job_id)
         raise HTTPException(status_code=503, detail="Message queue unavailable")
-    return {"status": "queued"}
+    return {"status": "queued", "job_id": job_id, "coalesced": False}
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body, content_type = render_metrics(request.headers.get("accept"))
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobStatus:
+    status = job_board.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return status
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """Server-Sent Events: the current status, then every transition until the job is done."""
+    if job_board.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    updates = job_board.subscribe(job_id)
+
+    async def events():
+        try:
+            status = job_board.get(job_id)  # read after subscribing, so no transition slips between
+            while True:
+                if status is not None:
+                    yield f"event: {status.state}\ndata: {status.model_dump_json()}\n\n"
+                    if status.done:
+                        return
+                try:
+                    status = await asyncio.wait_for(updates.get(), JOB_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    status = None
+                    yield ": keepalive\n\n"
+        finally:
+            job_board.unsubscribe(job_id, updates)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/logs")
+async def get_logs(
+        trace_id: Optional[str] = None,
+        routing_key: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = Query(100, ge=1, le=10000)
+):
+    try:
+        entries = await asyncio.to_thread(query_logs, LOG_DIR, trace_id, routing_key, since, until, limit)
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Message log unavailable")
+    return {"entries": entries}
+
+
+async def lookup_image_paths(image_id: uuid.UUID, refresh: bool = False) -> Optional[Tuple[str, Dict[str, str]]]:
+    """Local paths of an image and of its variants ({"256.webp": path, ...})."""
+    paths = None if refresh else image_paths.get(image_id)
+    if paths is None:
+        async with db_pool.connection() as conn:
+            cur = await conn.execute("SELECT image_url, variants FROM images WHERE id = %s", (image_id,))
+            row = await cur.fetchone()
+        path = resolve_image_url(row[0]) if row else None
+        if path is None:
+            return None
+        variants = {name: resolve_image_url(url) for name, url in (row[1] or {}).items()}
+        paths = (path, {name: variant for name, variant in variants.items() if variant})
+        image_paths.set(image_id, paths)
+    return paths
+
+
+def _not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence; weak comparison, as for GET
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@app.get("/images/{image_id}")
+@timed("api.get_image")
+async def get_image(image_id: uuid.UUID, request: Request, variant: Optional[str] = None):
+    paths = await lookup_image_paths(image_id)
+    if paths and variant and variant not in paths[1]:
+        # Variants are added after the row is first read; look again before giving up
+        paths = await lookup_image_paths(image_id, refresh=True)
+    path = (paths[1].get(variant) if variant else paths[0]) if paths else None
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path) if path else None
+    except FileNotFoundError:
+        image_paths.pop(image_id)
+        stat_result = None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    digest = content_hash(path)
+    headers = {"cache-control": f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable" if digest else "no-cache"}
+    if digest:
+        headers["etag"] = f'"{digest}.{variant}"' if variant else f'"{digest}"'
+    # Range and If-Range are handled by FileResponse; it fills in the stat-based headers we didn't set
+    response = FileResponse(path, headers=headers, stat_result=stat_result)
+
+    last_modified = datetime.fromtimestamp(int(stat_result.st_mtime), timezone.utc)
+    if _not_modified(request, response.headers["etag"], last_modified):
+        return Response(status_code=304, headers={
+            name: response.headers[name] for name in ("etag", "last-modified", "cache-control")
+        })
+    return response
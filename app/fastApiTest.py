@@ -0,0 +1,281 @@
+import hashlib
+import json
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import fastApi
+from app.utils.imageStore import image_path
+from app.utils.jobEvents import JobStatus, JobStatusBoard
+from app.utils.logIndex import to_epoch
+from app.utils.logSink import RotatingLogSink
+
+IMAGE_BYTES = b"RIFF\x00\x00\x00\x00WEBPVP8 " + bytes(range(256)) * 8
+
+
+@pytest.fixture
+def client():
+    # No lifespan: the image path cache is seeded directly, so neither RabbitMQ nor Postgres is needed
+    return TestClient(fastApi.app)
+
+
+@pytest.fixture
+def stored_image(tmp_path):
+    digest = hashlib.sha256(IMAGE_BYTES).hexdigest()
+    path = image_path(digest, "webp", str(tmp_path))
+    (tmp_path / digest[:2]).mkdir()
+    with open(path, "wb") as f:
+        f.write(IMAGE_BYTES)
+    image_id = uuid.uuid4()
+    fastApi.image_paths.set(image_id, (path, {}))
+    yield image_id, digest
+    fastApi.image_paths.pop(image_id)
+
+
+def test_serves_image_with_cache_headers(client, stored_image):
+    image_id, digest = stored_image
+    response = client.get(f"/images/{image_id}")
+
+    assert response.status_code == 200
+    assert response.content == IMAGE_BYTES
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["etag"] == f'"{digest}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert "last-modified" in response.headers
+
+
+def test_conditional_requests_return_304(client, stored_image):
+    image_id, digest = stored_image
+    first = client.get(f"/images/{image_id}")
+
+    by_etag = client.get(f"/images/{image_id}", headers={"If-None-Match": f'"other", "{digest}"'})
+    assert by_etag.status_code == 304
+    assert by_etag.content == b""
+    assert by_etag.headers["etag"] == f'"{digest}"'
+
+    by_date = client.get(f"/images/{image_id}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert by_date.status_code == 304
+
+    changed = client.get(f"/images/{image_id}", headers={"If-None-Match": '"other"'})
+    assert changed.status_code == 200
+
+
+def test_range_requests(client, stored_image):
+    image_id, digest = stored_image
+    response = client.get(f"/images/{image_id}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == IMAGE_BYTES[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(IMAGE_BYTES)}"
+
+    stale = client.get(f"/images/{image_id}", headers={"Range": "bytes=10-19", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert stale.content == IMAGE_BYTES
+
+
+def test_missing_file_is_404(client, stored_image, tmp_path):
+    image_id, digest = stored_image
+    (tmp_path / digest[:2] / f"{digest}.webp").unlink()
+    assert client.get(f"/images/{image_id}").status_code == 404
+    assert fastApi.image_paths.get(image_id) is None
+
+
+def test_serves_variants(client, stored_image, tmp_path):
+    image_id, digest = stored_image
+    variant_path = image_path(digest, "256.jpeg", str(tmp_path))
+    with open(variant_path, "wb") as f:
+        f.write(b"thumbnail")
+    fastApi.image_paths.set(image_id, (fastApi.image_paths.get(image_id)[0], {"256.jpeg": variant_path}))
+
+    response = client.get(f"/images/{image_id}", params={"variant": "256.jpeg"})
+    assert response.status_code == 200
+    assert response.content == b"thumbnail"
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{digest}.256.jpeg"'
+
+
+class FakeJobRegistry:
+    """inflight_jobs in memory: one registry stands in for every API replica's Postgres."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    @asynccontextmanager
+    async def connection(self):
+        yield None
+
+    async def claim(self, conn, key):
+        if key in self.jobs:
+            return self.jobs[key], False
+        self.jobs[key] = str(uuid.uuid4())
+        return self.jobs[key], True
+
+
+class FakePublisher:
+    def __init__(self):
+        self.published = []
+        self.events = []
+
+    async def publish(self, prompt, model_type, **kwargs):
+        self.published.append((prompt, kwargs))
+        return kwargs["trace_id"]
+
+    async def publish_message(self, message, routing_key):
+        self.events.append(routing_key)
+
+
+@pytest.fixture
+def queue_jobs(monkeypatch):
+    registry, publisher = FakeJobRegistry(), FakePublisher()
+    monkeypatch.setattr(fastApi, "db_pool", registry)
+    monkeypatch.setattr(fastApi, "claim_job", registry.claim)
+    monkeypatch.setattr(fastApi.app.state, "publisher", publisher, raising=False)
+    return publisher
+
+
+RECIPE = {"title": "Vegan Pancakes", "ingredients": ["flour", "banana"], "steps": ["Cook"]}
+
+
+def test_identical_requests_join_one_job(client, queue_jobs):
+    first = client.post("/generate", params={"model_type": "recipe"}, json=RECIPE).json()
+    second = client.post("/generate", params={"model_type": "recipe"}, json=RECIPE).json()
+    other = client.post("/generate", params={"model_type": "recipe"}, json={**RECIPE, "title": "Waffles"}).json()
+
+    assert first["job_id"] == second["job_id"] != other["job_id"]
+    assert (first["coalesced"], second["coalesced"], other["coalesced"]) == (False, True, False)
+    assert len(queue_jobs.published) == 2
+    assert queue_jobs.published[0][1]["trace_id"] == first["job_id"]
+
+
+def test_job_status_and_event_stream(client, queue_jobs):
+    job_id = client.post("/generate", params={"model_type": "recipe"}, json=RECIPE).json()["job_id"]
+    assert queue_jobs.events == ["ai-tools.job.queued"]
+    assert client.get(f"/jobs/{job_id}").json()["state"] == "queued"
+
+    image_id = str(uuid.uuid4())
+    fastApi.job_board.update(
+        JobStatus(job_id=job_id, state="completed", image_id=image_id, image_url=f"/images/{image_id}")
+    )
+    assert client.get(f"/jobs/{job_id}").json()["image_url"] == f"/images/{image_id}"
+
+    # A finished job's stream delivers the final state and closes
+    with client.stream("GET", f"/jobs/{job_id}/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        lines = [line for line in response.iter_lines() if line]
+    assert lines[0] == "event: completed"
+    assert image_id in lines[1]
+
+    assert client.get(f"/jobs/{uuid.uuid4()}").status_code == 404
+    assert client.get(f"/jobs/{uuid.uuid4()}/events").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_job_board_pushes_transitions_to_subscribers():
+    board = JobStatusBoard()
+    updates = board.subscribe("job")
+    board.update(JobStatus(job_id="job", state="started"))
+    board.update(JobStatus(job_id="job", state="completed", image_id="id"))
+
+    assert (await updates.get()).state == "started"
+    assert (await updates.get()).done
+    board.unsubscribe("job", updates)
+    assert not board._subscribers
+
+
+def test_generate_renders_registered_templates(client, queue_jobs):
+    assert client.post("/generate", params={"model_type": "poem"}, json=RECIPE).status_code == 400
+    assert client.post("/generate", params={"model_type": "recipe"}, json={"title": "Soup"}).status_code == 422
+
+    client.post("/generate", params={"model_type": "recipe"}, json=RECIPE)
+    client.post("/generate", params={"model_type": "profile"}, json={
+        "name": "Ada", "hobbies": ["chess", "climbing"], "bio": "Engineer."
+    })
+    assert [prompt for prompt, _ in queue_jobs.published] == [
+        "A professional food photography shot of Vegan Pancakes, made with flour, banana. "
+        "Served in a beautiful setting. High resolution.",
+        "Portrait of Ada, who enjoys chess, climbing. Bio: Engineer.",
+    ]
+
+
+def test_metrics_endpoint_times_generate(client, queue_jobs):
+    client.post("/generate", params={"model_type": "recipe"}, json=RECIPE)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'ai_tools_stage_seconds_count{stage="api.generate"}' in response.text
+
+
+LOG_START = datetime(2025, 5, 9, 18, 0)
+
+
+def log_entry(moment: datetime, routing_key: str, trace_id: str) -> bytes:
+    body = {"context": {"trace_id": trace_id}, "minute": int((moment - LOG_START).total_seconds() // 60)}
+    return json.dumps({"timestamp": moment.isoformat(), "routing_key": routing_key, "body": body}).encode() + b"\n"
+
+
+@pytest.fixture
+def message_log(tmp_path, monkeypatch):
+    """Three 10-minute segments, one entry a minute: gzipped, rotated, and still open."""
+    sink = RotatingLogSink(str(tmp_path), compress=False)
+    for segment in range(3):
+        for minute in range(segment * 10, segment * 10 + 10):
+            moment = LOG_START + timedelta(minutes=minute)
+            routing_key = "ai-tools.recipe" if minute % 2 else "ai-tools.job.completed"
+            trace_id = f"job-{minute % 3}"
+            sink.append(log_entry(moment, routing_key, trace_id), to_epoch(moment), routing_key, trace_id)
+        sink.flush()
+        if segment < 2:
+            closed = sink.segment_path
+            sink.rotate()
+            if segment == 0:
+                RotatingLogSink._compress(closed)
+    monkeypatch.setattr(fastApi, "LOG_DIR", str(tmp_path))
+    yield tmp_path
+    sink.close()
+
+
+def logged_minutes(response) -> list:
+    assert response.status_code == 200
+    return [entry["body"]["minute"] for entry in response.json()["entries"]]
+
+
+def test_logs_select_time_range_across_segments(client, message_log):
+    assert len(list(message_log.glob("*.jsonl"))) == 2 and len(list(message_log.glob("*.jsonl.gz"))) == 1
+    since, until = LOG_START + timedelta(minutes=5), LOG_START + timedelta(minutes=24)
+
+    response = client.get("/logs", params={"since": since.isoformat(), "until": until.isoformat(), "limit": 1000})
+    assert logged_minutes(response) == list(range(5, 25))
+
+    response = client.get("/logs", params={"since": since.isoformat(), "limit": 3})
+    assert logged_minutes(response) == [5, 6, 7]
+
+    response = client.get("/logs", params={"until": (LOG_START - timedelta(minutes=1)).isoformat()})
+    assert logged_minutes(response) == []
+
+
+def test_logs_look_up_trace_id(client, message_log):
+    # Sorted trace tables in the closed segments, an index scan in the open one
+    response = client.get("/logs", params={"trace_id": "job-1"})
+    assert logged_minutes(response) == [minute for minute in range(30) if minute % 3 == 1]
+
+    response = client.get("/logs", params={"trace_id": "job-1", "routing_key": "ai-tools.recipe"})
+    assert logged_minutes(response) == [minute for minute in range(30) if minute % 3 == 1 and minute % 2]
+
+    response = client.get("/logs", params={
+        "trace_id": "job-2", "since": (LOG_START + timedelta(minutes=12)).isoformat(), "limit": 2
+    })
+    assert logged_minutes(response) == [14, 17]
+
+    assert logged_minutes(client.get("/logs", params={"trace_id": "job-unknown"})) == []
+    assert logged_minutes(client.get("/logs", params={"routing_key": "ai-tools.unknown"})) == []
+
+
+def test_logs_with_empty_or_missing_log_dir(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(fastApi, "LOG_DIR", str(tmp_path))
+    assert client.get("/logs", params={"trace_id": "job-1"}).json() == {"entries": []}
+
+    monkeypatch.setattr(fastApi, "LOG_DIR", str(tmp_path / "missing"))
+    assert client.get("/logs").status_code == 503
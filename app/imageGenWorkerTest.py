@@ -0,0 +1,636 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from fastmcp import FastMCP
+import numpy as np
+import pytest
+import pytest_asyncio
+from PIL import Image
+
+from app.tests.stubApi import STUB_IMAGE, StubQuota, create_stub_app, run_stub_server
+from app.utils import generationCache, imageStore, rateLimiter
+from app.utils.envelopeCodec import UnsupportedEnvelope, decode_envelope, encode_envelope
+from app.utils.fairScheduler import FairScheduler
+from app.utils.generationCache import GenerationCache
+from app.utils.httpClients import close_clients
+from app.utils.imageStore import IMAGE_STORE_DIR, resolve_image_url, save_image_bytes
+from app.utils.imageVariants import render_variants
+from app.utils.mcpClient import MCPClientSession
+from app.utils.mcpUtils import Context, generation_message, message_context
+from app.utils.metrics import ToolMetricsMiddleware, render_metrics, trace_headers, trace_id_var
+from app.utils.microBatcher import MicroBatcher
+from app.utils.promptEncoder import EMBEDDING_DIM, HashedNgramFeatures, HashingNgramEncoder, load_encoder
+from app.utils.rabbitMQConsumer import REQUEUE_MIN_DELAY, RabbitMQConsumer, RequeueMessage
+from app.utils.rateLimiter import (
+    AdaptiveConcurrencyLimiter, BackendLimiter, LocalTokenBucket, UpstreamRateLimited, UpstreamUnavailable
+)
+from app.utils.vectorCodec import EncodedEmbedding, decode_embedding, encode_embedding
+from app.workers import embeddingWorker, imageGenWorker
+
+STUB_LATENCY = 0.2
+
+
+@pytest.fixture(scope="module")
+def stub():
+    stub_app = create_stub_app(latency=STUB_LATENCY)
+    with run_stub_server(stub_app) as base_url:
+        stub_app.state.base_url = base_url
+        yield stub_app
+
+
+@pytest_asyncio.fixture
+async def worker(stub, tmp_path, monkeypatch):
+    (tmp_path / "output").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(imageGenWorker, "STABILITY_BASE_URL", stub.state.base_url)
+    monkeypatch.setattr(imageGenWorker, "OPENAI_BASE_URL", f"{stub.state.base_url}/v1")
+    monkeypatch.setattr(imageGenWorker, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(imageGenWorker, "_openai_client", None)
+    monkeypatch.setattr(imageGenWorker, "limiters", {})
+    stub.state.client_ports.clear()
+    stub.state.rejected = 0
+    yield imageGenWorker
+    stub.state.quota = None
+    stub.state.failures = 0
+    await close_clients()
+
+
+def limit_backend(worker, backend: str, rate: float, burst: float, concurrency: int = 4, max_retries: int = 3):
+    limiter = BackendLimiter(
+        backend, LocalTokenBucket(rate, burst), AdaptiveConcurrencyLimiter(initial=concurrency), max_retries
+    )
+    worker.limiters[backend] = limiter
+    return limiter
+
+
+@pytest.mark.asyncio
+async def test_sdxl_reuses_one_connection(worker, stub):
+    for i in range(5):
+        path = await worker.run_sdxl_via_api(f"prompt {i}")
+        assert path is not None
+        with open(path, "rb") as f:
+            assert f.read() == STUB_IMAGE
+
+    assert len(stub.state.client_ports) == 5
+    assert len(set(stub.state.client_ports)) == 1, "Expected keep-alive reuse of a single connection"
+
+
+@pytest.mark.asyncio
+async def test_openai_generation_and_download_share_connection(worker, stub):
+    for i in range(3):
+        path = await worker.run_openai_dalle_image(f"prompt {i}")
+        assert path is not None
+
+    # one generation call plus one download per image, all over the same pooled connection
+    assert len(stub.state.client_ports) == 6
+    assert len(set(stub.state.client_ports)) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_sdxl_calls_overlap(worker, stub):
+    start = time.perf_counter()
+    paths = await asyncio.gather(*[worker.run_sdxl_via_api(f"prompt {i}") for i in range(10)])
+    elapsed = time.perf_counter() - start
+
+    assert all(paths)
+    assert elapsed < STUB_LATENCY * 5, f"Calls were serialized: {elapsed:.2f}s for 10 calls"
+
+
+@pytest.mark.asyncio
+async def test_images_are_content_addressed_and_deduplicated(worker, stub):
+    paths = await asyncio.gather(*[worker.run_sdxl_via_api(f"prompt {i}") for i in range(10)])
+
+    digest = hashlib.sha256(STUB_IMAGE).hexdigest()
+    assert set(paths) == {os.path.join(IMAGE_STORE_DIR, digest[:2], f"{digest}.webp")}
+    assert os.listdir(os.path.join(IMAGE_STORE_DIR, ".tmp")) == [], "Temp files left behind"
+
+
+@pytest.mark.asyncio
+async def test_image_writes_leave_the_event_loop_free(tmp_path, monkeypatch):
+    def slow_write(f, digest, chunk):
+        time.sleep(0.05)  # a slow volume
+        digest.update(chunk)
+        f.write(chunk)
+    monkeypatch.setattr(imageStore, "_write_chunk", slow_write)
+
+    async def chunks():
+        for _ in range(4):
+            yield b"x" * 1024
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticking = asyncio.create_task(ticker())
+    path = await imageStore.save_image_stream(chunks(), "webp", str(tmp_path))
+    ticking.cancel()
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 4096
+    assert ticks >= 10, "the loop was blocked while chunks were written"
+
+
+@pytest.mark.asyncio
+async def test_mock_images_get_their_own_content_address(worker):
+    paths = {await worker.run_mock("same prompt") for _ in range(3)}
+    assert len(paths) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_generation_leaves_no_file(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "STABILITY_BASE_URL", f"{stub.state.base_url}/missing")
+    assert await worker.run_sdxl_via_api("prompt") is None
+    assert not os.path.exists(IMAGE_STORE_DIR) or os.listdir(os.path.join(IMAGE_STORE_DIR, ".tmp")) == []
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_keeps_calls_within_quota(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "API_TO_USE", "sdxl")
+    stub.state.quota = StubQuota(rate=10, burst=2)
+    limit_backend(worker, "sdxl", rate=8, burst=1)  # configured a little under the real quota
+
+    paths = await asyncio.gather(*[worker.generate(f"prompt {i}") for i in range(10)])
+
+    assert all(paths)
+    assert stub.state.rejected == 0
+
+
+@pytest.mark.asyncio
+async def test_429s_back_off_and_retry(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "API_TO_USE", "sdxl")
+    stub.state.quota = StubQuota(rate=10, burst=1)
+    # No pacing from the bucket: only the 429s and AIMD keep the calls in check
+    limiter = limit_backend(worker, "sdxl", rate=1000, burst=1000, concurrency=8, max_retries=20)
+
+    paths = await asyncio.gather(*[worker.generate(f"prompt {i}") for i in range(10)])
+
+    assert all(paths)
+    assert stub.state.rejected > 0
+    assert limiter.concurrency.limit < 8, "Expected the concurrency limit to back off after 429s"
+
+
+@pytest.mark.asyncio
+async def test_openai_429_is_reported_with_retry_after(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "API_TO_USE", "openai")
+    stub.state.quota = StubQuota(rate=0.5, burst=1)
+    limit_backend(worker, "openai", rate=1000, burst=1000, max_retries=0)
+
+    assert await worker.generate("first") is not None
+    with pytest.raises(UpstreamRateLimited) as rejected:
+        await worker.generate("second")
+    assert 1.5 < rejected.value.retry_after <= 2.0
+
+
+@pytest.mark.parametrize("backend", ["sdxl", "openai"])
+@pytest.mark.asyncio
+async def test_server_errors_are_retried(worker, stub, monkeypatch, backend):
+    monkeypatch.setattr(worker, "API_TO_USE", backend)
+    monkeypatch.setattr(rateLimiter, "UPSTREAM_RETRY_DELAY", 0.01)
+    limit_backend(worker, backend, rate=1000, burst=1000)
+
+    stub.state.failures = 1
+    requests_before = stub.state.requests
+    assert await worker.generate("prompt") is not None
+    # a 500, then the retried generation call (and, for OpenAI, the image download)
+    assert stub.state.requests - requests_before == (2 if backend == "sdxl" else 3)
+
+    stub.state.failures = 3
+    with pytest.raises(UpstreamUnavailable):
+        await worker.generate("prompt")  # two retries, like the OpenAI SDK's default, then the job fails
+
+
+@pytest.mark.asyncio
+async def test_unlimited_backend_still_retries_server_errors(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "API_TO_USE", "sdxl")
+    monkeypatch.setattr(rateLimiter, "UPSTREAM_RETRY_DELAY", 0.01)
+    worker.limiters["sdxl"] = None
+
+    stub.state.failures = 2
+    assert await worker.generate("prompt") is not None
+
+
+@pytest.mark.asyncio
+async def test_job_over_quota_is_requeued(worker, stub, monkeypatch):
+    monkeypatch.setattr(worker, "API_TO_USE", "sdxl")
+    monkeypatch.setattr(worker, "generation_cache", None)
+    stub.state.quota = StubQuota(rate=0.01, burst=1)
+    stub.state.quota.tokens = 0
+    limit_backend(worker, "sdxl", rate=1000, burst=1000, max_retries=0)
+
+    body = b'{"input": {"prompt": "Vegan Pancakes"}, "context": {"model_type": "recipe"}}'
+    with pytest.raises(RequeueMessage) as requeued:
+        await worker.message_callback(None, body)
+    # Held for the stub's Retry-After (~100s at 0.01/s) rather than redelivered straight away
+    assert requeued.value.delay > 50
+
+
+
+@pytest.mark.parametrize("encoding", ["msgpack", "json"])
+@pytest.mark.asyncio
+async def test_worker_reads_each_envelope_encoding(worker, stub, monkeypatch, encoding):
+    monkeypatch.setattr(worker, "API_TO_USE", "sdxl")
+    monkeypatch.setattr(worker, "generation_cache", None)
+    stub.state.quota = StubQuota(rate=0.01, burst=1)
+    stub.state.quota.tokens = 0
+    limit_backend(worker, "sdxl", rate=1000, burst=1000, max_retries=0)
+
+    body, content_type, headers = encode_envelope(generation_message("Vegan Pancakes", "recipe"), encoding)
+    # Reaching the (exhausted) backend means the prompt was decoded
+    with pytest.raises(RequeueMessage):
+        await worker.message_callback(SimpleNamespace(content_type=content_type, headers=headers), body)
+
+
+def test_envelope_versions_and_content_types():
+    message = generation_message("Vegan Pancakes", "recipe", user_id="tenant-a")
+    body, content_type, headers = encode_envelope(message, "msgpack")
+    decoded = decode_envelope(body, SimpleNamespace(content_type=content_type, headers=headers))
+    assert decoded["context"]["trace_id"] == message.context.trace_id
+    assert decoded["input"] == {"prompt": "Vegan Pancakes"}
+
+    # Pre-codec messages carry no content type and are JSON
+    assert decode_envelope(message.model_dump_json().encode())["context"]["user_id"] == "tenant-a"
+    with pytest.raises(UnsupportedEnvelope):
+        decode_envelope(body, SimpleNamespace(content_type=content_type, headers={"x-envelope-version": 99}))
+    with pytest.raises(UnsupportedEnvelope):
+        decode_envelope(body, SimpleNamespace(content_type="application/xml", headers=None))
+
+@pytest.mark.asyncio
+async def test_interactive_jobs_overtake_batch_backlog():
+    scheduler = FairScheduler(concurrency=2, weights={})
+    finished = []
+
+    async def job(name):
+        await asyncio.sleep(0.05)
+        finished.append(name)
+
+    backlog = [asyncio.create_task(scheduler.run("batch", "bulk", lambda i=i: job(f"batch {i}"))) for i in range(20)]
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await scheduler.run("interactive", "someone", lambda: job("interactive"))
+    waited = time.perf_counter() - start
+    await asyncio.gather(*backlog)
+
+    # Waits only for a slot to free up, not for the 18 queued batch jobs
+    assert waited < 0.15
+    assert finished.index("interactive") <= 4
+
+
+@pytest.mark.asyncio
+async def test_tenants_share_slots_by_weight():
+    scheduler = FairScheduler(concurrency=1, weights={"heavy": 3})
+    started = []
+    hold = asyncio.Event()
+
+    async def job(tenant):
+        started.append(tenant)
+
+    blocker = asyncio.create_task(scheduler.run("batch", "blocker", hold.wait))
+    await asyncio.sleep(0)
+    # "light" queues everything first, yet gets one slot per three of "heavy"'s
+    jobs = [asyncio.create_task(scheduler.run("batch", "light", lambda: job("light"))) for _ in range(12)]
+    jobs += [asyncio.create_task(scheduler.run("batch", "heavy", lambda: job("heavy"))) for _ in range(12)]
+    await asyncio.sleep(0)
+    hold.set()
+    await asyncio.gather(blocker, *jobs)
+
+    assert started[:8].count("heavy") == 6
+    assert started[:8].count("light") == 2
+    assert scheduler.in_flight == 0 and scheduler.waiting() == 0
+
+
+@pytest.mark.asyncio
+async def test_job_trace_reaches_mcp_tools_and_metrics(worker, monkeypatch):
+    server = FastMCP("traced")
+    server.add_middleware(ToolMetricsMiddleware())
+    seen = {}
+
+    @server.tool()
+    async def store_image_metadata(prompt: str, image_url: str, embedding: dict, image_id: str) -> str:
+        seen["store"] = trace_id_var.get()
+        return "stored"
+
+    @server.tool()
+    async def release_inflight_job(job_key: str, job_id: str) -> dict:
+        seen["release"] = trace_id_var.get()
+        return {"released": True}
+
+    monkeypatch.setattr(worker, "mcp_session", MCPClientSession(server))
+    monkeypatch.setattr(worker, "API_TO_USE", "mock")
+    monkeypatch.setattr(worker, "generation_cache", None)
+    monkeypatch.setattr(worker, "EMBEDDING_STAGE_ENABLED", False)
+    monkeypatch.setattr(worker, "IMAGE_VARIANTS_ENABLED", False)
+
+    message = generation_message("Vegan Pancakes", "recipe", metadata={"coalesce_key": "ab" * 32})
+    body, content_type, headers = encode_envelope(message)
+    headers.update(trace_headers(message.context.trace_id))
+    await worker.message_callback(SimpleNamespace(content_type=content_type, headers=headers), body)
+    await worker.mcp_session.close()
+
+    assert seen == {"store": message.context.trace_id, "release": message.context.trace_id}
+    exposition = render_metrics("application/openmetrics-text")[0].decode()
+    for stage in ("queue_wait", "job", "mcp.store_image_metadata"):
+        assert f'ai_tools_stage_seconds_count{{stage="{stage}"}}' in exposition
+    assert f'trace_id="{message.context.trace_id}"' in exposition
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_embedding_round_trip(dtype):
+    vector = np.random.default_rng(5).standard_normal(768).astype(np.float32)
+    encoded = encode_embedding(vector, dtype)
+    assert (encoded.dtype, encoded.dim) == (dtype, 768)
+
+    decoded = decode_embedding(EncodedEmbedding.model_validate(encoded.model_dump()))
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vector, rtol=0 if dtype == "float32" else 1e-3, atol=1e-3)
+
+
+def test_embedding_decode_rejects_mismatches_and_bad_base64():
+    encoded = encode_embedding(np.ones(8, dtype=np.float32), "float16")
+    with pytest.raises(ValueError, match="declares 8 x float32"):
+        decode_embedding(encoded.model_copy(update={"dtype": "float32"}))
+    with pytest.raises(ValueError, match="declares 16 x float16"):
+        decode_embedding(encoded.model_copy(update={"dim": 16}))
+    with pytest.raises(ValueError):  # binascii.Error
+        decode_embedding(encoded.model_copy(update={"data": "not base64!"}))
+
+
+def test_embedding_plain_list_fallback():
+    decoded = decode_embedding([0.5, -1.0, 2.0])
+    assert decoded.dtype == np.float32
+    assert decoded.tolist() == [0.5, -1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_render_variants_writes_each_size_and_format(tmp_path):
+    source = tmp_path / "source.png"
+    Image.new("RGBA", (400, 200), (200, 80, 40, 128)).save(source)
+    original = await save_image_bytes(source.read_bytes(), "png", str(tmp_path))
+
+    sizes, formats = [1024, 128, 64], ["webp", "jpeg", "png"]
+    variants = render_variants(original, sizes=sizes, formats=formats, directory=str(tmp_path))
+
+    assert set(variants) == {f"{size}.{fmt}" for size in sizes for fmt in formats}
+    for name, url in variants.items():
+        size, image_format = name.split(".")
+        with Image.open(resolve_image_url(url, str(tmp_path))) as variant:
+            assert variant.format == image_format.upper()
+            # Longest side fits the size, never upscaled past the 400px original; aspect ratio kept
+            assert variant.size == (min(int(size), 400), min(int(size), 400) // 2)
+            assert variant.mode == ("RGB" if image_format == "jpeg" else "RGBA")
+
+    # Already rendered: the same URLs come back without touching the files
+    mtimes = {url: os.stat(resolve_image_url(url, str(tmp_path))).st_mtime_ns for url in variants.values()}
+    assert render_variants(original, sizes=sizes, formats=formats, directory=str(tmp_path)) == variants
+    assert mtimes == {url: os.stat(resolve_image_url(url, str(tmp_path))).st_mtime_ns for url in variants.values()}
+
+
+def test_message_context_defaults_for_envelopes_without_one():
+    assert message_context(None, "embedding").model_type == "embedding"
+    assert message_context({"model_type": "recipe", "trace_id": "job-1"}, "embedding").trace_id == "job-1"
+
+
+def test_image_urls_never_resolve_outside_their_directory(tmp_path):
+    store, legacy = str(tmp_path / "store"), str(tmp_path / "legacy")
+    assert resolve_image_url("store://ab/abcd.webp", store) == os.path.join(store, "ab", "abcd.webp")
+    assert resolve_image_url("mock://output/a.webp", store, legacy) == os.path.join(legacy, "output", "a.webp")
+    for url in ("store://../../etc/passwd", "store:///etc/passwd", "mock:///etc/passwd",
+                "mock://../../../etc/passwd", "mock://output/../../etc/passwd", "file:///etc/passwd"):
+        assert resolve_image_url(url, store, legacy) is None, url
+    # Without a legacy directory, mock:// rows aren't served at all
+    assert resolve_image_url("mock://output/a.webp", store, None) is None
+
+
+class RecordingPublisher:
+    def __init__(self, log: list | None = None):
+        self.routing_keys = []
+        self.messages = []
+        self.log = log if log is not None else []
+
+    async def publish_message(self, message, routing_key):
+        self.routing_keys.append(routing_key)
+        self.messages.append(message)
+        self.log.append(routing_key)
+
+
+@pytest.mark.parametrize("last_attempt, events, released", [
+    (False, ["ai-tools.job.queued"], False),  # redelivered: the job may still complete
+    (True, ["ai-tools.job.failed"], True),  # dropped: the job is over
+])
+@pytest.mark.asyncio
+async def test_failed_job_is_terminal_only_on_its_last_attempt(worker, monkeypatch, last_attempt, events, released):
+    publisher, releases = RecordingPublisher(), []
+
+    async def crash(data, job_context):
+        raise RuntimeError("unexpected")
+
+    async def release_job(data):
+        releases.append(data["context"]["trace_id"])
+
+    monkeypatch.setattr(worker, "publisher", publisher)
+    monkeypatch.setattr(worker, "handle_job", crash)
+    monkeypatch.setattr(worker, "release_job", release_job)
+
+    body, content_type, headers = encode_envelope(generation_message("Vegan Pancakes", "recipe"))
+    with pytest.raises(RuntimeError):
+        await worker.message_callback(SimpleNamespace(content_type=content_type, headers=headers), body, last_attempt)
+    assert publisher.routing_keys == events
+    assert bool(releases) is released
+
+
+class RecordingChannel:
+    def __init__(self):
+        self.settled = []
+
+    def basic_ack(self, delivery_tag):
+        self.settled.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.settled.append(("requeue" if requeue else "drop", delivery_tag))
+
+
+def settled_future(error=None) -> Future:
+    future = Future()
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
+    return future
+
+
+def test_requeued_messages_wait_before_going_back():
+    consumer, channel = RabbitMQConsumer("jobs"), RecordingChannel()
+    timers = []
+    consumer.connection = SimpleNamespace(call_later=lambda delay, callback: timers.append((delay, callback)))
+
+    consumer._settle_when_due(channel, SimpleNamespace(delivery_tag=1, redelivered=False), settled_future())
+    consumer._settle_when_due(channel, SimpleNamespace(delivery_tag=2, redelivered=False),
+                              settled_future(RequeueMessage("over quota", delay=12.5)))
+    consumer._settle_when_due(channel, SimpleNamespace(delivery_tag=3, redelivered=False),
+                              settled_future(RequeueMessage("over quota", delay=0)))
+    assert channel.settled == [("ack", 1)]
+    assert [delay for delay, _ in timers] == [12.5, REQUEUE_MIN_DELAY]
+
+    for _, callback in timers:
+        callback()
+    assert channel.settled == [("ack", 1), ("requeue", 2), ("requeue", 3)]
+
+
+@pytest.mark.asyncio
+async def test_generation_cache_round_trips_and_sweeps_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(generationCache, "GENERATION_CACHE_SWEEP_EVERY", 3)
+    image = tmp_path / "image.webp"
+    image.write_bytes(b"webp")
+    embedding = np.linspace(-1, 1, 768, dtype=np.float32)
+    cache = GenerationCache(str(tmp_path / "cache"), memory_size=4, max_entries=2)
+
+    await cache.put("aa01", str(image), embedding)
+    # A fresh replica only has the disk layer
+    replica = GenerationCache(str(tmp_path / "cache"), memory_size=4, max_entries=2)
+    image_path, cached_embedding = await replica.get("aa01")
+    assert image_path == str(image)
+    np.testing.assert_array_equal(cached_embedding, embedding)
+    assert await replica.get("bb02") is None
+
+    await cache.put("bb02", str(image))
+    await cache.put("cc03", str(image))
+    assert cache.sweeping  # the third write started a sweep without waiting for it
+    await cache._sweep_task
+    assert len(list((tmp_path / "cache").rglob("*.json"))) == 2
+
+    image.unlink()
+    assert await cache.get("cc03") is None  # image removed underneath the cache
+
+
+class RecordingBatchFn:
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        if self.error:
+            raise self.error
+        return [item * 10 for item in items]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_flushes_full_batches_at_once():
+    process = RecordingBatchFn()
+    batcher = MicroBatcher(process, max_batch_size=3, max_delay=10)
+
+    results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(6))), 1)
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert process.batches == [[0, 1, 2], [3, 4, 5]]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_flushes_partial_batch_at_deadline():
+    process = RecordingBatchFn()
+    batcher = MicroBatcher(process, max_batch_size=100, max_delay=0.05)
+
+    start = time.perf_counter()
+    assert await asyncio.gather(batcher.submit(1), batcher.submit(2)) == [10, 20]
+    assert time.perf_counter() - start >= 0.05
+    assert process.batches == [[1, 2]]
+    assert await batcher.submit(3) == 30  # the next item starts a new deadline
+    assert process.batches == [[1, 2], [3]]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_fails_every_waiter_of_a_failed_batch():
+    batcher = MicroBatcher(RecordingBatchFn(error=ValueError("encoder down")), max_batch_size=2, max_delay=0.01)
+
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+    assert [str(result) for result in results] == ["encoder down"] * 3
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+PROMPTS = ["A bowl of vegan ramen", "vegan RAMEN, a bowl of", "A bowl of vegan ramens", "Portrait of a climber", ""]
+
+
+def test_hashing_encoder_vectors():
+    vectors = HashingNgramEncoder().encode(PROMPTS)
+
+    assert vectors.shape == (len(PROMPTS), EMBEDDING_DIM) and vectors.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(vectors[:-1], axis=1), 1, rtol=1e-5)
+    assert not vectors[-1].any()  # nothing to hash
+    np.testing.assert_allclose(vectors[0], vectors[1], rtol=1e-5)  # order and case don't matter
+    assert vectors[0] @ vectors[2] > 0.8 > vectors[0] @ vectors[3]
+    # Stable across instances (crc32, not Python's salted hash) and batch sizes
+    np.testing.assert_array_equal(load_encoder("hashing").encode(PROMPTS[:1])[0], vectors[0])
+
+
+def test_projection_encoder_sums_feature_rows(tmp_path):
+    projection = np.random.default_rng(0).standard_normal((4096, 32)).astype(np.float32)
+    np.savez(tmp_path / "model.npz", projection=projection, char_ngrams=np.array([3]))
+    encoder = load_encoder(str(tmp_path / "model.npz"))
+
+    vectors = encoder.encode(PROMPTS)
+    assert vectors.shape == (len(PROMPTS), 32) and vectors.dtype == np.float32
+    assert not vectors[-1].any()
+    features = HashedNgramFeatures((3,))
+    _, hashed = features.hash_batch(PROMPTS[3:4])
+    expected = projection[hashed % 4096].sum(axis=0)
+    np.testing.assert_allclose(vectors[3], expected / np.linalg.norm(expected), rtol=1e-4, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        load_encoder("bert-base")
+
+
+class RecordingMCPSession:
+    def __init__(self, log: list):
+        self.log = log
+
+    async def call_tool(self, name, arguments):
+        self.log.append((name, arguments.get("job_key")))
+
+
+@pytest.mark.asyncio
+async def test_job_handed_to_embedding_stage_keeps_its_claim(worker, monkeypatch):
+    publisher, releases = RecordingPublisher(), []
+
+    async def release_job(data):
+        releases.append(data["context"]["trace_id"])
+
+    monkeypatch.setattr(worker, "API_TO_USE", "mock")
+    monkeypatch.setattr(worker, "EMBEDDING_STAGE_ENABLED", True)
+    monkeypatch.setattr(worker, "generation_cache", None)
+    monkeypatch.setattr(worker, "semantic_reuse", None)
+    monkeypatch.setattr(worker, "publisher", publisher)
+    monkeypatch.setattr(worker, "release_job", release_job)
+
+    body, content_type, headers = encode_envelope(
+        generation_message("Vegan Pancakes", "recipe", metadata={"coalesce_key": "pancakes"})
+    )
+    await worker.message_callback(SimpleNamespace(content_type=content_type, headers=headers), body)
+
+    # Not finished until embeddingWorker stores it, so identical requests must keep joining it
+    assert releases == []
+    assert publisher.routing_keys[-1] == worker.EMBED_ROUTING_KEY
+    assert publisher.messages[-1].metadata == {"coalesce_key": "pancakes"}
+
+
+@pytest.mark.asyncio
+async def test_embedding_stage_releases_claims_after_completing_jobs(monkeypatch):
+    log = []
+    monkeypatch.setattr(embeddingWorker, "publisher", RecordingPublisher(log))
+    monkeypatch.setattr(embeddingWorker, "mcp_session", RecordingMCPSession(log))
+    coalesced, plain = Context(model_type="recipe"), Context(model_type="recipe")
+
+    await embeddingWorker.embed_and_store([
+        ("Vegan Pancakes", "store://ab/cd.webp", coalesced, "pancakes"),
+        ("Waffles", "store://ef/gh.webp", plain, None),
+    ])
+    assert log == [
+        ("store_image_metadata_batch", None),
+        "ai-tools.job.completed",
+        "ai-tools.job.completed",
+        ("release_inflight_job", "pancakes"),
+    ]
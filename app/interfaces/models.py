@@ -1,38 +1,24 @@
 from pydantic import BaseModel
-from typing import List, Any
+from typing import List
 
+from app.interfaces.registry import PROMPT_TEMPLATES
 
-# Add more prompt models here as needed
+
+# Add more prompt models here as needed: the decorator registers the model and its prompt
+# template ("{field}" placeholders; list fields are joined with ", ") under the DTO type name
+@PROMPT_TEMPLATES.template(
+    "recipe",
+    "A professional food photography shot of {title}, made with {ingredients}. "
+    "Served in a beautiful setting. High resolution."
+)
 class Recipe(BaseModel):
     title: str
     ingredients: List[str]
     steps: List[str]
 
 
+@PROMPT_TEMPLATES.template("profile", "Portrait of {name}, who enjoys {hobbies}. Bio: {bio}")
 class Profile(BaseModel):
     name: str
     hobbies: List[str]
     bio: str
-
-
-# Define the mapping of model types to Pydantic models
-def create_prompt(dto_type: str, obj: Any) -> str:
-    if dto_type == "recipe":
-        return (
-            f"A professional food photography shot of {obj.title}, "
-            f"made with {', '.join(obj.ingredients)}. "
-            "Served in a beautiful setting. High resolution."
-        )
-    elif dto_type == "profile":
-        return (
-            f"Portrait of {obj.name}, who enjoys {', '.join(obj.hobbies)}. "
-            f"Bio: {obj.bio}"
-        )
-    else:
-        return f"Prompt data: {obj.dict()}"
-
-
-MODEL_MAP = {
-    "recipe": Recipe,
-    "profile": Profile,
-}
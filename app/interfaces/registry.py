@@ -0,0 +1,103 @@
+import string
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence, Type, get_args, get_origin
+
+from pydantic import BaseModel
+
+LIST_SEPARATOR = ", "
+_SEQUENCE_TYPES = (list, tuple, set, frozenset)
+
+
+def _join_str(values) -> str:
+    return LIST_SEPARATOR.join(map(str, values))
+
+
+def _field_converter(model: Type[BaseModel], field: str) -> Callable[[Any], str]:
+    """How to render `field` of the validated values, picked from its annotation."""
+    annotation = model.model_fields[field].annotation
+    if get_origin(annotation) in _SEQUENCE_TYPES:
+        return LIST_SEPARATOR.join if get_args(annotation)[:1] == (str,) else _join_str
+    return str
+
+
+def compile_template(template: str, model: Type[BaseModel]) -> Callable[[Dict[str, Any]], str]:
+    """
+    Turn a "{field}" template into a function of the model's field values, once, at
+    registration: the template is parsed here into its literal pieces plus one slot per
+    field, each with a converter chosen from the field's annotation (list fields are joined
+    with ", "). Rendering fills the slots and joins the pieces. Unknown fields, format specs
+    and conversions are rejected up front.
+    """
+    pieces: list[str] = []
+    slots: list[tuple[int, str, Callable[[Any], str]]] = []  # (index in pieces, field, converter)
+    for literal, field, format_spec, conversion in string.Formatter().parse(template):
+        if literal:
+            pieces.append(literal)
+        if field is None:
+            continue
+        if field not in model.model_fields:
+            raise ValueError(f"Template field '{field}' is not a field of {model.__name__}")
+        if format_spec or conversion:
+            raise ValueError(f"Template field '{field}' can't have a format spec or conversion")
+        slots.append((len(pieces), field, _field_converter(model, field)))
+        pieces.append("")
+
+    def render(values: Dict[str, Any]) -> str:
+        rendered = pieces.copy()
+        for index, field, convert in slots:
+            rendered[index] = convert(values[field])
+        return "".join(rendered)
+    return render
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """A DTO type: its Pydantic model, its compiled prompt template and a reusable validator."""
+    name: str
+    model: Type[BaseModel]
+    template: str
+    render_values: Callable[[Dict[str, Any]], str]
+    # The model's prebuilt core validator, bound once: no kwargs unpacking or wrapper per request
+    validate: Callable[[Mapping[str, Any]], BaseModel]
+
+    def render(self, obj: BaseModel) -> str:
+        return self.render_values(obj.__dict__)
+
+    def build_prompt(self, payload: Mapping[str, Any]) -> str:
+        """Raises pydantic.ValidationError if `payload` doesn't fit the model."""
+        return self.render_values(self.validate(payload).__dict__)
+
+
+class TemplateRegistry:
+    """DTO type name -> PromptTemplate. Types register themselves next to their model (see models.py)."""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, model: Type[BaseModel], template: str) -> PromptTemplate:
+        if name in self._templates:
+            raise ValueError(f"DTO type '{name}' is already registered")
+        entry = PromptTemplate(
+            name, model, template, compile_template(template, model), model.__pydantic_validator__.validate_python
+        )
+        self._templates[name] = entry
+        return entry
+
+    def template(self, name: str, template: str) -> Callable[[Type[BaseModel]], Type[BaseModel]]:
+        """Class decorator: register the model under `name` with its prompt template."""
+        def decorator(model: Type[BaseModel]) -> Type[BaseModel]:
+            self.register(name, model, template)
+            return model
+        return decorator
+
+    def get(self, name: str) -> Optional[PromptTemplate]:
+        return self._templates.get(name)
+
+    def names(self) -> Sequence[str]:
+        return list(self._templates)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+
+PROMPT_TEMPLATES = TemplateRegistry()
@@ -2,6 +2,7 @@ import pika
 import json
 import time
 from datetime import datetime
+from app.utils.envelopeCodec import decode_envelope
 from app.utils.rabbitmq import wait_for_rabbitmq
 
 QUEUE_NAME = "logger"
@@ -9,7 +10,7 @@ ROUTING_KEY_PREFIX = "ai-tools"
 EXCHANGE_NAME = "ai-tools"
 
 def callback(ch, method, properties, body):
-    msg = json.loads(body)
+    msg = decode_envelope(body, properties)
     log_entry = {
         "timestamp": datetime.utcnow().isoformat(),
         "routing_key": method.routing_key,
@@ -1,11 +1,11 @@
 # main.py
 from fastapi import FastAPI, Request, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import List, Dict, Any
 import pika
 import json
 from contextlib import asynccontextmanager
-from app.models import MODEL_MAP
+from app.interfaces.models import PROMPT_TEMPLATES
 from app.utils.rabbitmq import wait_for_rabbitmq
 
 # Global reference
@@ -33,36 +33,20 @@ app = FastAPI(lifespan=lifespan)
 
 @app.post("/generate")
 async def generate_image(model_type: str, payload: Dict[str, Any], request: Request):
-    if model_type not in MODEL_MAP:
+    template = PROMPT_TEMPLATES.get(model_type)
+    if template is None:
         raise HTTPException(status_code=400, detail=f"Unsupported type '{model_type}'")
-    model_class = MODEL_MAP[model_type]
     try:
-        model_instance = model_class(**payload)
-    except Exception as e:
+        prompt = template.build_prompt(payload)
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=str(e))
 
     try:
-        prompt = create_prompt(model_type, model_instance)
         publish_prompt(prompt, request, model_type)
     except RuntimeError:
         raise HTTPException(status_code=503, detail="Message queue unavailable")
     return {"status": "queued"}
 
-def create_prompt(type: str, obj: Any) -> str:
-    if type == "recipe":
-        return (
-            f"A professional food photography shot of {obj.title}, "
-            f"made with {', '.join(obj.ingredients)}. "
-            "Served in a beautiful setting. High resolution."
-        )
-    elif type == "profile":
-        return (
-            f"Portrait of {obj.name}, who enjoys {', '.join(obj.hobbies)}. "
-            f"Bio: {obj.bio}"
-        )
-    else:
-        return f"Prompt data: {obj.dict()}"
-
 def declare_exchanges():
     channel = app.state.rabbitmq_channel
     channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="topic", durable=True)
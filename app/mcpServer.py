@@ -1,76 +1,339 @@
+import asyncio
 import os
+import uuid
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Optional
 
-import numpy as np
-import psycopg2
 from fastmcp import FastMCP
+from fastmcp.exceptions import ResourceError, ToolError
+from psycopg.types.json import Jsonb
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import Response
 
-from app.utils.rabbitMQPublisher import RabbitMQPublisher
-from interfaces.modelTypes import MODEL_TYPES
-from interfaces.models import MODEL_MAP, create_prompt
+from app.interfaces.modelTypes import MODEL_TYPES
+from app.interfaces.models import PROMPT_TEMPLATES
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
 
-mcp = FastMCP(name="mcp-ai-tools")
-publisher = RabbitMQPublisher()
+from app.utils.database import create_pool
+from app.utils.embeddingStorage import (
+    EMBEDDING_STORAGE, embedding_columns, embedding_copy_types, embedding_values, nearest_query, shortlist_size,
+    unsearchable_rows_query
+)
+from app.utils.jobEvents import publish_job_event
+from app.utils.mcpUtils import Context, ImageMetadata, Priority
+from app.utils.metrics import METRICS_ENABLED, ToolMetricsMiddleware, render_metrics, trace_id_var
+from app.utils.singleFlight import claim_job, coalesce_key, release_job
+from app.utils.vectorCodec import EmbeddingInput, decode_embedding
+
+db_pool = create_pool()
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    await db_pool.open(wait=True)
+    print(f"✅ Postgres pool opened ({db_pool.min_size}-{db_pool.max_size} connections), "
+          f"embedding storage '{EMBEDDING_STORAGE}'.")
+    await check_embedding_backfill()
+    yield
+    await publisher.close()
+    await db_pool.close()
+    print("❌ Postgres pool closed.")
+
+
+async def check_embedding_backfill():
+    """Warn when rows stored under another EMBEDDING_STORAGE mode are missing from this mode's search."""
+    sql = unsearchable_rows_query()
+    if sql is None:
+        return
+    try:
+        async with db_pool.connection() as conn:
+            cur = await conn.execute(sql)
+            missing = (await cur.fetchone())[0]
+    except Exception as e:
+        print(f"⚠️ Could not check the embedding_half backfill: {e}")
+        return
+    if missing:
+        print("⚠️ Some images have no embedding_half and are left out of similarity search; backfill them with "
+              "psql -U postgres -d ai-tools -f db-migrations/embedding_half.sql")
+
+
+mcp = FastMCP(name="mcp-ai-tools", lifespan=lifespan)
+if METRICS_ENABLED:
+    mcp.add_middleware(ToolMetricsMiddleware())
+publisher = AsyncRabbitMQPublisher(pool_size=1)
+_publisher_lock = asyncio.Lock()
 
 USER_AGENT = "ai-tools/0.1.0"
 SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8080")
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "http://localhost:8000")  # FastAPI app serving GET /images/{id}
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))  # search-time recall vs latency knob
+# How a `since`-filtered search keeps walking the HNSW graph until k rows pass the filter:
+# strict_order | relaxed_order (pgvector >= 0.8), or off for older pgvector
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "strict_order")
+EMBEDDING_COLUMNS = ", ".join(embedding_columns())
+EMBEDDING_PLACEHOLDERS = ", ".join(["%s"] * len(embedding_columns()))
+PUBLISHER_CONNECT_TIMEOUT = 10.0  # seconds generate_image waits for RabbitMQ before failing
+
+
+async def get_publisher() -> AsyncRabbitMQPublisher:
+    """Connected on first use, so the server starts (and serves every other tool) without RabbitMQ."""
+    async with _publisher_lock:
+        if publisher.connection is None:
+            try:
+                await asyncio.wait_for(publisher.connect(), PUBLISHER_CONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                await publisher.close()
+                raise ToolError("❌ Message queue unavailable")
+    return publisher
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> Response:
+    if not METRICS_ENABLED:
+        return Response(status_code=404)
+    body, content_type = render_metrics(request.headers.get("accept"))
+    return Response(body, media_type=content_type)
 
 
 @mcp.resource("image://{image_id}")
-def get_image(image_id: str) -> dict[str, str]:
+async def get_image(image_id: str) -> dict[str, Any]:
     """
     Get a previously generated image by ID.
     Args:
         image_id (str): The ID of the image to retrieve.
     Returns:
-        str: The URL of the image.
+        dict: The image's prompt, creation time and the URL it is served from.
     """
-    # For demonstration purposes, we'll just return a mock URL
-    return {"image_url": f"{SERVER_URL}/images/{image_id}"}
+    try:
+        async with db_pool.connection() as conn:
+            cur = await conn.execute(
+                "SELECT prompt, created_at FROM images WHERE id = %s::uuid", (image_id,)
+            )
+            row = await cur.fetchone()
+    except Exception as e:
+        raise ResourceError(f"Failed to look up image {image_id}: {e}") from e
+    if row is None:
+        raise ResourceError(f"Image {image_id} not found")
+    return {
+        "image_url": f"{IMAGE_BASE_URL}/images/{image_id}",
+        "prompt": row[0],
+        "created_at": row[1].isoformat(),
+    }
 
 
 @mcp.tool()
-def store_image_metadata(prompt: str, image_url: str, embedding: list[float]) -> str:
-    """Store image generation metadata including prompt, image URL, and vector embedding in the database."""
-    conn = None
+async def store_image_metadata(
+        prompt: str,
+        image_url: str,
+        embedding: EmbeddingInput,
+        image_id: Optional[str] = None
+) -> str:
+    """
+    Store image generation metadata including prompt, image URL, and vector embedding in the database.
+    The embedding is either base64 little-endian bytes with dtype/dim declared, or a plain float list.
+    `image_id` sets the row's id, for callers that report it before hearing back; one is generated if omitted.
+    """
     print(f"Storing metadata for image: {image_url}")
 
     try:
-        conn = psycopg2.connect(
-            host="db",
-            port=5432,
-            dbname="ai-tools",
-            user="postgres",
-            password="postgres"
-        )
-
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO images (prompt, image_url, embedding)
-                VALUES (%s, %s, %s)
-            """, (prompt, image_url, np.array(embedding, dtype=np.float32).tolist()))
-            conn.commit()
+        async with db_pool.connection() as conn:
+            await conn.execute(f"""
+                INSERT INTO images (id, prompt, image_url, {EMBEDDING_COLUMNS})
+                VALUES (%s, %s, %s, {EMBEDDING_PLACEHOLDERS})
+            """, (
+                uuid.UUID(image_id) if image_id else uuid.uuid4(),
+                prompt,
+                image_url,
+                *embedding_values(decode_embedding(embedding))
+            ))
 
         return f"✅ Metadata stored for: {image_url}"
 
     except Exception as e:
-        return f"❌ Error storing metadata: {e}"
+        # Surface as a tool error so callers can retry instead of treating it as stored
+        raise ToolError(f"❌ Error storing metadata: {e}")
 
-    finally:
-        if conn:
-            conn.close()
+
+@mcp.tool()
+async def store_image_metadata_batch(rows: list[ImageMetadata]) -> str:
+    """
+    Store many image metadata rows (prompt, image URL, vector embedding, optional id) in one transaction.
+    Rows are streamed with a binary COPY, so thousands of rows cost a single round-trip.
+    """
+    print(f"Storing metadata for {len(rows)} images")
+
+    try:
+        async with db_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                async with cur.copy(
+                        f"COPY images (id, prompt, image_url, {EMBEDDING_COLUMNS}) FROM STDIN WITH (FORMAT BINARY)"
+                ) as copy:
+                    copy.set_types(["uuid", "text", "text", *embedding_copy_types()])
+                    for row in rows:
+                        await copy.write_row((
+                            uuid.UUID(row.image_id) if row.image_id else uuid.uuid4(),
+                            row.prompt,
+                            row.image_url,
+                            *embedding_values(decode_embedding(row.embedding))
+                        ))
+
+        return f"✅ Metadata stored for {len(rows)} images"
+
+    except Exception as e:
+        raise ToolError(f"❌ Error storing metadata batch: {e}")
 
 
 @mcp.tool()
-def generate_image(model_type: str, dto_model: str, dto_data: Dict[str, Any]) -> dict[str, str]:
+async def store_image_variants(image_url: str, variants: dict[str, str]) -> str:
+    """
+    Record resized/re-encoded copies of an image, e.g. {"256.webp": "store://ab/<sha>.256.webp"}.
+    Merged into images.variants of every row with this image_url (reused images share one).
+    """
+    try:
+        async with db_pool.connection() as conn:
+            cur = await conn.execute("""
+                UPDATE images SET variants = COALESCE(variants, '{}'::jsonb) || %s
+                WHERE image_url = %s
+            """, (Jsonb(variants), image_url))
+    except Exception as e:
+        raise ToolError(f"❌ Error storing variants: {e}")
+
+    if cur.rowcount == 0:
+        raise ToolError(f"❌ No image stored for: {image_url}")
+    return f"✅ {len(variants)} variants stored for: {image_url}"
+
+
+@mcp.tool()
+async def reserve_rate_limit(backend: str, rate: float, burst: float) -> dict[str, float]:
+    """
+    Take one token from the cluster-wide bucket for an upstream API (refilled at `rate` per
+    second up to `burst`). Always succeeds; returns how many seconds the caller must wait
+    before using the token, so waiters are served in order without polling.
+    """
+    if rate <= 0 or burst < 1:
+        raise ToolError("rate must be positive and burst at least 1")
+
+    try:
+        async with db_pool.connection() as conn:
+            # One atomic upsert: refill for the time elapsed, then take a token
+            cur = await conn.execute("""
+                INSERT INTO rate_limits AS bucket (backend, tokens, rate, burst)
+                VALUES (%(backend)s, %(burst)s - 1, %(rate)s, %(burst)s)
+                ON CONFLICT (backend) DO UPDATE SET
+                    tokens = LEAST(
+                        EXCLUDED.burst,
+                        bucket.tokens
+                        + EXTRACT(EPOCH FROM clock_timestamp() - bucket.updated_at)::float8 * EXCLUDED.rate
+                    ) - 1,
+                    rate = EXCLUDED.rate,
+                    burst = EXCLUDED.burst,
+                    updated_at = clock_timestamp()
+                RETURNING tokens
+            """, {"backend": backend, "rate": rate, "burst": burst})
+            tokens = (await cur.fetchone())[0]
+    except Exception as e:
+        raise ToolError(f"❌ Error reserving rate limit: {e}")
+
+    return {"wait": max(0.0, -tokens / rate)}
+
+
+@mcp.tool()
+async def release_inflight_job(job_key: str, job_id: str) -> dict[str, bool]:
+    """
+    Mark a coalesced generation job as finished, so the next identical /generate request
+    starts a new job instead of joining this one. Returns whether the claim was still held.
+    """
+    try:
+        async with db_pool.connection() as conn:
+            released = await release_job(conn, job_key, job_id)
+    except Exception as e:
+        raise ToolError(f"❌ Error releasing job {job_id}: {e}")
+    return {"released": released}
+
+
+async def _nearest_images(query, k: int, since: Optional[datetime] = None) -> list[dict[str, Any]]:
+    """
+    Top-k rows by cosine similarity, served by the HNSW index of the EMBEDDING_STORAGE mode.
+    `since` is applied to the rows the index returns, so it runs as an iterative scan that
+    goes on until k rows pass (up to pgvector's hnsw.max_scan_tuples). With
+    HNSW_ITERATIVE_SCAN=off, a filter that rejects most of the nearest rows returns fewer than k.
+    """
+    sql, params = nearest_query(query, k, since)
+
+    async with db_pool.connection() as conn:
+        # ef_search must cover the rows requested from the index or the scan returns fewer
+        ef_search = max(HNSW_EF_SEARCH, shortlist_size(k))
+        await conn.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+        if since is not None and HNSW_ITERATIVE_SCAN != "off":
+            await conn.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (HNSW_ITERATIVE_SCAN,))
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+
+    return [
+        {
+            "id": str(row[0]),
+            "prompt": row[1],
+            "image_url": row[2],
+            "created_at": row[3].isoformat(),
+            "similarity": float(row[4])
+        }
+        for row in rows
+    ]
+
+
+@mcp.tool()
+async def find_similar_image(embedding: EmbeddingInput, min_similarity: float = 0.95) -> dict[str, Any]:
+    """
+    Find the stored image whose embedding is nearest (cosine) to the given one.
+    Returns its id, prompt, image_url and similarity, or an empty object when the
+    nearest image is less similar than `min_similarity`.
+    """
+    nearest = await _nearest_images(decode_embedding(embedding), k=1)
+    if not nearest or nearest[0]["similarity"] < min_similarity:
+        return {}
+    return nearest[0]
+
+
+@mcp.tool()
+async def search_similar_images(
+        embedding: EmbeddingInput,
+        k: int = 10,
+        since: Optional[datetime] = None
+) -> list[dict[str, Any]]:
+    """
+    Return the top-k stored images most similar (cosine) to the given embedding,
+    optionally limited to images created at or after `since`. Fewer than k come back only
+    if fewer match, or if `since` is so narrow that the nearest ~20000 images
+    (hnsw.max_scan_tuples) hold fewer than k of them.
+    Args:
+        embedding: Query vector, base64-encoded or a plain float list.
+        k (int): Number of images to return.
+        since (datetime): Only consider images created at or after this time.
+    Returns:
+        list: id, prompt, image_url, created_at and similarity per image, best first.
+    """
+    if not 1 <= k <= 1000:
+        raise ToolError("k must be between 1 and 1000")
+    return await _nearest_images(decode_embedding(embedding), k, since)
+
+
+@mcp.tool()
+async def generate_image(
+        model_type: str,
+        dto_model: str,
+        dto_data: Dict[str, Any],
+        priority: Priority = "interactive",
+        user_id: Optional[str] = None
+) -> dict[str, Any]:
     """
     Generate an image based on the provided prompt and model.
-    supported models are:
+    supported models are the registered DTO types, e.g.:
     - "recipe"
     - "profile"
     supported model_types are:
-    - "stable-diffusion"
+    - "sdxl"
     - "openai-dalle"
     - "mock"
 
@@ -78,28 +341,46 @@ def generate_image(model_type: str, dto_model: str, dto_data: Dict[str, Any]) ->
         model_type (str): The type of model to use for generation.
         dto_model (str): The dto model to use for generation.
         dto_data (Dict[str, Any]): The data to use for generation.
+        priority (str): "interactive" (someone is waiting) or "batch" (bulk work, runs after interactive jobs).
+        user_id (str): The tenant the job is scheduled under; tenants share the workers fairly.
     Returns:
-        str: The URL of the generated image.
+        dict: The job id; follow it with GET /jobs/{job_id} (or /jobs/{job_id}/events) on the API.
+        An identical request already in flight is joined instead ("coalesced": true).
     """
-
-    # check if the model_type is supported
     if model_type not in MODEL_TYPES:
-        raise ValueError(f"Unsupported type '{model_type}'")
-    if dto_model not in MODEL_MAP:
-        raise ValueError(f"Unsupported model '{dto_model}'")
-    model_class = MODEL_MAP[dto_model]
+        raise ToolError(f"Unsupported type '{model_type}'")
+    template = PROMPT_TEMPLATES.get(dto_model)
+    if template is None:
+        raise ToolError(f"Unsupported model '{dto_model}', expected one of {PROMPT_TEMPLATES.names()}")
+    try:
+        prompt = template.build_prompt(dto_data)
+    except ValidationError as e:
+        raise ToolError(f"Invalid {dto_model}: {e}")
 
+    # Same job identity and routing as POST /generate: workers consume ai-tools.<dto type>
+    key = coalesce_key(dto_model, prompt)
     try:
-        model_instance = model_class(**dto_data)
+        async with db_pool.connection() as conn:
+            job_id, claimed = await claim_job(conn, key)
     except Exception as e:
-        raise ValueError(e)
+        raise ToolError(f"❌ Job registry unavailable: {e}")
+    if not claimed:
+        return {"status": "queued", "job_id": job_id, "coalesced": True}
 
+    trace_id_var.set(job_id)  # the rest of this call, and its samples, belong to the new job
     try:
-        prompt = create_prompt(model_type, model_instance)
-        publisher.publish(prompt, model_type)
-    except RuntimeError:
-        raise ValueError("Failed to create and p")
-    return {"status": "queued"}
+        queue = await get_publisher()
+        context = Context(trace_id=job_id, model_type=dto_model, user_id=user_id, priority=priority)
+        await publish_job_event(queue, context, "queued")
+        await queue.publish(
+            prompt, dto_model, user_id=user_id, priority=priority,
+            trace_id=job_id, metadata={"coalesce_key": key}
+        )
+    except (RuntimeError, ToolError) as e:
+        async with db_pool.connection() as conn:
+            await release_job(conn, key, job_id)
+        raise ToolError(f"❌ Failed to queue job: {e}")
+    return {"status": "queued", "job_id": job_id, "coalesced": False}
 
 
 if __name__ == "__main__":
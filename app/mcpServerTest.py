@@ -1,4 +1,5 @@
 import asyncio
+import uuid
 
 import pytest
 import numpy as np
@@ -46,6 +47,45 @@ async def _run_post_image():
         assert any("✅" in t or "stored" in t.lower() for t in texts), f"Expected success message in response, got: {texts}"
 
 
+@pytest.mark.asyncio
+async def test_store_image_metadata_batch():
+    try:
+        await asyncio.wait_for(_run_post_image_batch(), timeout=TIMEOUT)
+    except asyncio.TimeoutError:
+        pytest.fail("❌ Batch tool call timed out")
+
+
+async def _run_post_image_batch():
+    rows = [
+        {
+            "prompt": f"test prompt {i}",
+            "image_url": f"http://example.com/image_{i}.png",
+            "embedding": np.full(768, i / 100, dtype=np.float32).tolist()
+        }
+        for i in range(100)
+    ]
+
+    async with Client(MCP_URL) as client:
+        result = await client.call_tool("store_image_metadata_batch", {"rows": rows})
+
+        texts = [r.text for r in result if hasattr(r, "text")]
+        assert any("100 images" in t for t in texts), f"Expected batch success message, got: {texts}"
+
+
+@pytest.mark.asyncio
+async def test_reserve_rate_limit():
+    backend = f"test-{uuid.uuid4().hex}"
+    async with Client(MCP_URL) as client:
+        # burst 2 at 1 token/s: two immediate tokens, then each reservation waits ~1s longer
+        waits = [
+            (await client.call_tool("reserve_rate_limit", {"backend": backend, "rate": 1, "burst": 2})).data["wait"]
+            for _ in range(4)
+        ]
+
+    assert waits[0] == 0 and waits[1] == 0, f"Burst should be free, got {waits}"
+    assert 0.5 < waits[2] <= 1.0 and 1.5 < waits[3] <= 2.0, f"Expected queued reservations, got {waits}"
+
+
 @pytest.mark.asyncio
 async def test_list_tools():
     async with Client(MCP_URL) as client:
@@ -56,4 +96,8 @@ async def test_list_tools():
         assert isinstance(tools, list)
         assert len(tools) > 0, "No tools returned from MCP server"
         assert "store_image_metadata" in tool_names, "Expected tool not found"
+        assert "store_image_metadata_batch" in tool_names, "Expected tool not found"
+        assert "store_image_variants" in tool_names, "Expected tool not found"
+        assert "reserve_rate_limit" in tool_names, "Expected tool not found"
+        assert "release_inflight_job" in tool_names, "Expected tool not found"
         assert "generate_image" in tool_names, "Expected tool not found"
\ No newline at end of file
@@ -0,0 +1,120 @@
+import asyncio
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+# Smallest valid webp/png payloads aren't needed by the workers; any bytes will do
+STUB_IMAGE = b"RIFF\x00\x00\x00\x00WEBPVP8 stub-image"
+
+
+class StubQuota:
+    """Token bucket like the real APIs' quotas: over it, generation calls get a 429 with Retry-After."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float | None:
+        """None if the call is allowed, else the seconds until it would be."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+def create_stub_app(
+        latency: float = 0.0,
+        image_bytes: bytes = STUB_IMAGE,
+        quota: StubQuota | None = None
+) -> FastAPI:
+    """
+    Local stand-in for the Stability and OpenAI image endpoints used by imageGenWorker.
+    `latency` seconds are added to every generation call. The client ports seen are
+    recorded in `app.state.client_ports` so tests can check connection reuse. With a
+    `quota`, generation calls over it are rejected with 429 and counted in
+    `app.state.rejected`. The next `app.state.failures` generation calls fail with a 500.
+    """
+    stub = FastAPI()
+    stub.state.latency = latency
+    stub.state.client_ports = []
+    stub.state.requests = 0
+    stub.state.quota = quota
+    stub.state.rejected = 0
+    stub.state.failures = 0
+
+    def rejection() -> Response | None:
+        if stub.state.failures > 0:
+            stub.state.failures -= 1
+            return Response(
+                content='{"error": {"message": "Internal error", "type": "server_error"}}',
+                status_code=500,
+                media_type="application/json"
+            )
+        retry_after = stub.state.quota.take() if stub.state.quota else None
+        if retry_after is None:
+            return None
+        stub.state.rejected += 1
+        return Response(
+            content='{"error": {"message": "Rate limit exceeded", "type": "rate_limit_exceeded"}}',
+            status_code=429,
+            media_type="application/json",
+            headers={"retry-after": f"{retry_after:.3f}"}
+        )
+
+    @stub.middleware("http")
+    async def track_connections(request: Request, call_next):
+        stub.state.client_ports.append(request.client.port)
+        stub.state.requests += 1
+        return await call_next(request)
+
+    @stub.post("/v2beta/stable-image/generate/core")
+    async def stability_generate():
+        if response := rejection():
+            return response
+        await asyncio.sleep(stub.state.latency)
+        return Response(content=image_bytes, media_type="image/webp")
+
+    @stub.post("/v1/images/generations")
+    async def openai_generate(request: Request):
+        if response := rejection():
+            return response
+        await asyncio.sleep(stub.state.latency)
+        return {
+            "created": int(time.time()),
+            "data": [{"url": f"{request.base_url}files/{uuid.uuid4().hex}.png"}]
+        }
+
+    @stub.get("/files/{name}")
+    async def download(name: str):
+        return Response(content=image_bytes, media_type="image/png")
+
+    return stub
+
+
+@contextmanager
+def run_stub_server(app: FastAPI):
+    """Serve `app` with uvicorn on a free localhost port in a background thread; yields its base URL."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
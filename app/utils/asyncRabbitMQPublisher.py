@@ -0,0 +1,117 @@
+import asyncio
+import itertools
+from typing import Any, Dict, Optional
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractRobustConnection
+
+from app.utils.envelopeCodec import encode_envelope
+from app.utils.mcpUtils import MESSAGE_PRIORITIES, MCPMessageWrapper, Priority, generation_message
+from app.utils.metrics import track, trace_headers
+
+
+class AsyncRabbitMQPublisher:
+    """
+    asyncio-native counterpart of RabbitMQPublisher.
+
+    Publishes are spread round-robin over a pool of confirm-mode channels on one
+    robust connection. Several publishes can be in flight on the same channel; each
+    caller awaits only its own broker confirm, so the event loop is never blocked
+    and throughput scales with the number of concurrent requests. The robust
+    connection reconnects and reopens the pooled channels on its own.
+    """
+
+    def __init__(
+            self,
+            host: str = "rabbitmq",
+            exchange_name: str = "ai-tools",
+            routing_key_prefix: str = "ai-tools",
+            retry_delay: int = 2,
+            pool_size: int = 4,
+            confirm_timeout: float = 5.0
+    ):
+        self.host = host
+        self.exchange_name = exchange_name
+        self.routing_key_prefix = routing_key_prefix
+        self.retry_delay = retry_delay  # seconds
+        self.pool_size = pool_size
+        self.confirm_timeout = confirm_timeout  # seconds
+        self.connection: AbstractRobustConnection | None = None
+        self.channels: list[AbstractChannel] = []
+        self.exchanges: list[AbstractExchange] = []
+        self._next_exchange = None
+
+    async def connect(self):
+        """Attempt to connect to RabbitMQ with retry logic and open the channel pool."""
+        while True:
+            try:
+                self.connection = await aio_pika.connect_robust(host=self.host)
+                break
+            except (aio_pika.exceptions.AMQPConnectionError, OSError):
+                print(f"❌ RabbitMQ not ready, retrying in {self.retry_delay}s...")
+                await asyncio.sleep(self.retry_delay)
+
+        for _ in range(self.pool_size):
+            channel = await self.connection.channel(publisher_confirms=True)
+            exchange = await channel.declare_exchange(
+                self.exchange_name, aio_pika.ExchangeType.TOPIC, durable=True
+            )
+            self.channels.append(channel)
+            self.exchanges.append(exchange)
+        self._next_exchange = itertools.cycle(self.exchanges)
+        print(f"✅ Connected to RabbitMQ with {self.pool_size} publisher channels!")
+
+    async def declare_queue(self, queue_name: str, routing_key: str, arguments: Optional[dict] = None):
+        """Declare and bind a durable queue so messages published before its consumer starts are kept."""
+        if not self.channels:
+            raise RuntimeError("RabbitMQ channel pool not initialized. Call connect() first.")
+        queue = await self.channels[0].declare_queue(queue_name, durable=True, arguments=arguments)
+        await queue.bind(self.exchanges[0], routing_key=routing_key)
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
+            self.channels = []
+            self.exchanges = []
+            self._next_exchange = None
+
+    async def publish(
+            self,
+            prompt: str,
+            model_type: str,
+            task: str = "generate.image",
+            user_id: Optional[str] = None,
+            priority: Priority = "interactive",
+            trace_id: Optional[str] = None,
+            metadata: Optional[Dict[str, Any]] = None
+    ) -> str:
+        routing_key = f"{self.routing_key_prefix}.{model_type}"
+
+        message = generation_message(prompt, model_type, task, user_id, priority, trace_id, metadata)
+        await self.publish_message(message, routing_key)
+        return message.context.trace_id
+
+    async def publish_message(self, message: MCPMessageWrapper, routing_key: str):
+        """Publish an already-built envelope and wait for the broker confirm."""
+        if not self._next_exchange:
+            raise RuntimeError("RabbitMQ channel pool not initialized. Call connect() first.")
+
+        exchange = next(self._next_exchange)
+        body, content_type, headers = encode_envelope(message)
+        headers.update(trace_headers(message.context.trace_id))
+        try:
+            with track("publish"):
+                await exchange.publish(
+                    aio_pika.Message(
+                        body=body,
+                        content_type=content_type,
+                        headers=headers,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        priority=MESSAGE_PRIORITIES[message.context.priority]
+                    ),
+                    routing_key=routing_key,
+                    timeout=self.confirm_timeout
+                )
+        except (aio_pika.exceptions.AMQPError, asyncio.TimeoutError) as e:
+            raise RuntimeError(f"Failed to publish message: {e}") from e
@@ -0,0 +1,44 @@
+import os
+
+from pgvector.psycopg import register_vector_async
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+POSTGRES_URL = os.getenv(
+    "POSTGRES_URL",
+    os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/ai-tools")
+)
+POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+POOL_MAX_IDLE = float(os.getenv("POSTGRES_POOL_MAX_IDLE", "300"))  # seconds before idle extras are closed
+
+
+async def _configure_connection(conn: AsyncConnection):
+    # Let numpy arrays go to/from pgvector columns in binary form
+    await register_vector_async(conn)
+    # register_vector_async runs queries; don't leave the connection in a transaction
+    await conn.commit()
+
+
+def create_pool(
+        conninfo: str = POSTGRES_URL,
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE
+) -> AsyncConnectionPool:
+    """
+    Build an async Postgres pool. It is created closed; call `await pool.open()` once the
+    event loop is running (e.g. in a lifespan) and `await pool.close()` on shutdown.
+    Connections are health-checked before being handed out.
+    """
+    return AsyncConnectionPool(
+        conninfo,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=POOL_TIMEOUT,
+        max_idle=POOL_MAX_IDLE,
+        configure=_configure_connection,
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+        name="ai-tools"
+    )
@@ -0,0 +1,101 @@
+import os
+from datetime import datetime
+from typing import Any, Optional
+
+import numpy as np
+from pgvector import HalfVector
+
+# How images.embedding is stored and searched (see db-init/migration_002 and the opt-in db-migrations/):
+#   full         float32 vector only; exact-precision HNSW search
+#   full+half    float32 + halfvec copy; search the halfvec index, re-rank shortlist with float32
+#   full+binary  float32 + binary-quantized expression index; hamming shortlist, re-rank with float32
+#   half         halfvec only (no float32 copy); search and score in half precision
+# Each mode writes only its own columns. Rows stored under "full" or "full+binary" have no halfvec
+# copy, so before switching to "full+half" or "half" run db-migrations/embedding_half.sql, which backfills
+# them and builds the halfvec index; "full+binary" needs db-migrations/embedding_binary.sql.
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "full")
+EMBEDDING_RERANK_FACTOR = int(os.getenv("EMBEDDING_RERANK_FACTOR", "4"))  # shortlist = k * factor
+STORAGE_MODES = ("full", "full+half", "full+binary", "half")
+
+if EMBEDDING_STORAGE not in STORAGE_MODES:
+    raise ValueError(f"Unsupported EMBEDDING_STORAGE '{EMBEDDING_STORAGE}', expected one of {STORAGE_MODES}")
+
+_COLUMNS = {
+    "full": (["embedding"], ["vector"]),
+    "full+half": (["embedding", "embedding_half"], ["vector", "halfvec"]),
+    "full+binary": (["embedding"], ["vector"]),
+    "half": (["embedding_half"], ["halfvec"]),
+}
+_SELECT = "SELECT id, prompt, image_url, created_at"
+
+
+def embedding_columns(mode: str = EMBEDDING_STORAGE) -> list[str]:
+    return _COLUMNS[mode][0]
+
+
+def embedding_copy_types(mode: str = EMBEDDING_STORAGE) -> list[str]:
+    return _COLUMNS[mode][1]
+
+
+def embedding_values(vector: np.ndarray, mode: str = EMBEDDING_STORAGE) -> tuple:
+    """Parameters for `embedding_columns(mode)`, in order."""
+    return tuple(
+        vector if column == "embedding" else HalfVector(vector)
+        for column in embedding_columns(mode)
+    )
+
+
+def unsearchable_rows_query(mode: str = EMBEDDING_STORAGE) -> Optional[str]:
+    """
+    SQL returning whether some stored embeddings are invisible to this mode's search (stored
+    under a mode without embedding_half), or None if the mode searches every stored row.
+    """
+    if mode in ("full+half", "half"):
+        return "SELECT EXISTS (SELECT 1 FROM images WHERE embedding IS NOT NULL AND embedding_half IS NULL)"
+    return None
+
+
+def shortlist_size(k: int, mode: str = EMBEDDING_STORAGE) -> int:
+    return k * EMBEDDING_RERANK_FACTOR if mode in ("full+half", "full+binary") else k
+
+
+def nearest_query(
+        query: np.ndarray,
+        k: int,
+        since: Optional[datetime] = None,
+        mode: str = EMBEDDING_STORAGE
+) -> tuple[str, list[Any]]:
+    """
+    SQL and parameters returning (id, prompt, image_url, created_at, similarity) for the
+    top-k rows by cosine similarity. Quantized modes scan their compact index for a
+    shortlist of k * EMBEDDING_RERANK_FACTOR rows and re-score only those in float32.
+    """
+    since_filter = " AND created_at >= %s" if since is not None else ""
+    since_params = [since] if since is not None else []
+
+    if mode == "full":
+        sql = (f"{_SELECT}, 1 - (embedding <=> %s) AS similarity FROM images"
+               f" WHERE embedding IS NOT NULL{since_filter}"
+               " ORDER BY embedding <=> %s LIMIT %s")
+        return sql, [query, *since_params, query, k]
+
+    if mode == "half":
+        half = HalfVector(query)
+        sql = (f"{_SELECT}, 1 - (embedding_half <=> %s) AS similarity FROM images"
+               f" WHERE embedding_half IS NOT NULL{since_filter}"
+               " ORDER BY embedding_half <=> %s LIMIT %s")
+        return sql, [half, *since_params, half, k]
+
+    if mode == "full+half":
+        compact_column, compact_order, compact_query = "embedding_half", "embedding_half <=> %s", HalfVector(query)
+    else:  # full+binary
+        compact_column, compact_order, compact_query = (
+            "embedding", "binary_quantize(embedding)::bit(768) <~> binary_quantize(%s)", query
+        )
+
+    sql = (f"{_SELECT}, 1 - (embedding <=> %s) AS similarity FROM ("
+           f"{_SELECT}, embedding FROM images"
+           f" WHERE {compact_column} IS NOT NULL{since_filter}"
+           f" ORDER BY {compact_order} LIMIT %s"
+           ") AS shortlist ORDER BY embedding <=> %s LIMIT %s")
+    return sql, [query, *since_params, compact_query, shortlist_size(k, mode), query, k]
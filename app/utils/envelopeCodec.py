@@ -0,0 +1,54 @@
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import msgpack
+
+from app.utils.mcpUtils import MCPMessageWrapper
+
+# Wire encoding of new messages: "msgpack" (compact, ~2x faster to decode) or "json".
+# Consumers read both, so set "json" only while consumers older than the codec are running.
+MESSAGE_ENCODING = os.getenv("MESSAGE_ENCODING", "msgpack").lower()
+ENVELOPE_VERSION = 1
+ENVELOPE_VERSION_HEADER = "x-envelope-version"
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+
+
+class UnsupportedEnvelope(ValueError):
+    """A message this consumer can't read: unknown content type or a newer envelope version."""
+
+
+def encode_envelope(
+        message: MCPMessageWrapper,
+        encoding: str = MESSAGE_ENCODING
+) -> Tuple[bytes, str, Dict[str, Any]]:
+    """(body, content_type, headers) for publishing `message`. Unset optional fields are left out."""
+    headers = {ENVELOPE_VERSION_HEADER: ENVELOPE_VERSION}
+    if encoding == "msgpack":
+        return msgpack.packb(message.model_dump(mode="json", exclude_none=True)), CONTENT_TYPE_MSGPACK, headers
+    if encoding == "json":
+        return message.model_dump_json(exclude_none=True).encode(), CONTENT_TYPE_JSON, headers
+    raise ValueError(f"Unknown message encoding '{encoding}'")
+
+
+def decode_envelope(body: bytes, properties: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    The envelope as a dict, in whichever encoding `properties` (pika BasicProperties or an
+    aio-pika message: anything with content_type and headers) declares. Messages without
+    a content type predate the codec and are JSON.
+    """
+    content_type = getattr(properties, "content_type", None) or CONTENT_TYPE_JSON
+    version = (getattr(properties, "headers", None) or {}).get(ENVELOPE_VERSION_HEADER, ENVELOPE_VERSION)
+    if version > ENVELOPE_VERSION:
+        raise UnsupportedEnvelope(f"Envelope version {version} is newer than {ENVELOPE_VERSION}")
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return msgpack.unpackb(body)
+    if content_type == CONTENT_TYPE_JSON:
+        return json.loads(body)
+    raise UnsupportedEnvelope(f"Unsupported content type '{content_type}'")
+
+
+def decode_message(body: bytes, properties: Optional[Any] = None) -> MCPMessageWrapper:
+    return MCPMessageWrapper.model_validate(decode_envelope(body, properties))
+
@@ -0,0 +1,108 @@
+import asyncio
+import os
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Relative share of generation slots per user_id, e.g. "tenant-a=3,tenant-b=1"; others get 1
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+DEFAULT_TENANT = "anonymous"
+
+
+def parse_tenant_weights(spec: str = TENANT_WEIGHTS) -> Dict[str, float]:
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tenant, weight = item.split("=", 1)
+        weights[tenant.strip()] = float(weight)
+        if weights[tenant.strip()] <= 0:
+            raise ValueError(f"Tenant weight must be positive: '{item}'")
+    return weights
+
+
+class _TenantQueue:
+    def __init__(self, quantum: float):
+        self.waiters: deque[asyncio.Future] = deque()
+        self.deficit = quantum
+
+
+class FairScheduler:
+    """
+    Hands out `concurrency` slots to waiting jobs: strictly by priority level first
+    (`levels`, highest first), then within a level by weighted deficit round-robin over
+    tenants. A tenant with weight 3 gets three jobs started per round to another tenant's
+    one, however many jobs either has queued, so a bulk upload only ever competes for its
+    own share.
+    """
+
+    def __init__(
+            self,
+            concurrency: int,
+            levels: Sequence[str] = ("interactive", "batch"),
+            weights: Optional[Dict[str, float]] = None
+    ):
+        self.concurrency = concurrency
+        self.levels = list(levels)
+        self.weights = parse_tenant_weights() if weights is None else weights
+        self.in_flight = 0
+        self._tenants: Dict[str, Dict[str, _TenantQueue]] = {level: {} for level in self.levels}
+        self._rotation: Dict[str, deque[str]] = {level: deque() for level in self.levels}
+
+    def waiting(self, level: Optional[str] = None) -> int:
+        levels = [level] if level else self.levels
+        return sum(len(queue.waiters) for lvl in levels for queue in self._tenants[lvl].values())
+
+    async def run(self, level: str, tenant: Optional[str], job: Callable[[], Awaitable[T]]) -> T:
+        """Wait for a slot for `tenant` at priority `level`, then await `job()` in it."""
+        if level not in self._tenants:
+            level = self.levels[-1]
+        tenant = tenant or DEFAULT_TENANT
+
+        if self.in_flight < self.concurrency and not self.waiting():
+            self.in_flight += 1
+        else:
+            started = asyncio.get_running_loop().create_future()
+            queue = self._tenants[level].get(tenant)
+            if queue is None:
+                queue = self._tenants[level][tenant] = _TenantQueue(self.weights.get(tenant, 1.0))
+                self._rotation[level].append(tenant)
+            queue.waiters.append(started)
+            try:
+                await started  # the slot is handed over already counted in in_flight
+            except asyncio.CancelledError:
+                if started.done() and not started.cancelled():
+                    self._release()
+                raise
+        try:
+            return await job()
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        while self.in_flight < self.concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for level in self.levels:
+            rotation, tenants = self._rotation[level], self._tenants[level]
+            while rotation:
+                tenant = rotation[0]
+                queue = tenants[tenant]
+                while queue.waiters and queue.waiters[0].done():
+                    queue.waiters.popleft()  # cancelled while waiting
+                if not queue.waiters:
+                    rotation.popleft()
+                    del tenants[tenant]
+                    continue
+                if queue.deficit >= 1:
+                    queue.deficit -= 1
+                    return queue.waiters.popleft()
+                # Turn over: to the back of the round, with next round's share added
+                queue.deficit += self.weights.get(tenant, 1.0)
+                rotation.rotate(-1)
+        return None
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.utils.lruCache import LRUCache
+from app.utils.vectorCodec import EncodedEmbedding, decode_embedding, encode_embedding
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() == "true"
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", "./output/cache")
+GENERATION_CACHE_MEMORY_SIZE = int(os.getenv("GENERATION_CACHE_MEMORY_SIZE", "1024"))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "100000"))  # records, not bytes
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+GENERATION_CACHE_SWEEP_EVERY = 500  # disk writes between eviction sweeps
+
+CachedGeneration = Tuple[str, Optional[np.ndarray]]  # (image path, embedding if computed inline)
+
+
+def cache_key(backend: str, prompt: str, output_format: str) -> str:
+    """Content address of one generation request."""
+    return hashlib.sha256(f"{backend}\0{output_format}\0{prompt}".encode()).hexdigest()
+
+
+class GenerationCache:
+    """
+    Exact-match cache of generated images, keyed by (backend, contextualized prompt, format).
+
+    Lookups go to a per-process LRU first and then to a directory of small JSON records
+    shared by all replicas (the workers' common output volume). Both layers honour the
+    TTL; the disk layer is swept every few hundred writes to drop expired records and
+    trim it to `max_entries` records (a count, not a byte size), oldest first.
+
+    Disk reads and writes run in worker threads, so a slow volume never blocks the event
+    loop; the sweep walks every record and runs as a background task.
+    """
+
+    def __init__(
+            self,
+            directory: str = GENERATION_CACHE_DIR,
+            memory_size: int = GENERATION_CACHE_MEMORY_SIZE,
+            max_entries: int = GENERATION_CACHE_MAX_ENTRIES,
+            ttl: float = GENERATION_CACHE_TTL
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=memory_size, ttl=ttl)
+        self._writes = 0
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    async def get(self, key: str) -> Optional[CachedGeneration]:
+        cached = self.memory.get(key)
+        if cached is None:
+            cached = await asyncio.to_thread(self._read_disk, key)
+            if cached is None:
+                return None
+            self.memory.set(key, cached)
+        if not await asyncio.to_thread(os.path.exists, cached[0]):
+            # The image was removed underneath us; treat as a miss
+            self.memory.pop(key)
+            return None
+        return cached
+
+    async def put(self, key: str, image_path: str, embedding: Optional[np.ndarray] = None):
+        self.memory.set(key, (image_path, embedding))
+        record = {
+            "image_path": image_path,
+            "embedding": encode_embedding(embedding).model_dump() if embedding is not None else None
+        }
+        await asyncio.to_thread(self._write_disk, key, record)
+
+        self._writes += 1
+        if self._writes % GENERATION_CACHE_SWEEP_EVERY == 0 and not self.sweeping:
+            self._sweep_task = asyncio.create_task(asyncio.to_thread(self.sweep))
+            self._sweep_task.add_done_callback(self._sweep_done)
+
+    @property
+    def sweeping(self) -> bool:
+        return self._sweep_task is not None and not self._sweep_task.done()
+
+    @staticmethod
+    def _sweep_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"⚠️ Generation cache sweep failed: {task.exception()}")
+
+    def _write_disk(self, key: str, record: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)  # atomic, so other replicas never read a partial record
+
+    def _read_disk(self, key: str) -> Optional[CachedGeneration]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        embedding = record.get("embedding")
+        return record["image_path"], decode_embedding(EncodedEmbedding(**embedding)) if embedding else None
+
+    def sweep(self):
+        """Drop expired disk records, then the oldest ones beyond `max_entries`. Blocking; see `put`."""
+        now = time.time()
+        records = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                    if now - mtime > self.ttl:
+                        os.remove(path)
+                    else:
+                        records.append((mtime, path))
+                except OSError:
+                    continue  # removed concurrently by another replica
+
+        excess = len(records) - self.max_entries
+        if excess > 0:
+            records.sort()
+            for _, path in records[:excess]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+from typing import AsyncIterable, Optional
+
+from app.utils.metrics import observe
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "./output/images")
+IMAGE_CHUNK_SIZE = 64 * 1024
+# images.image_url for stored images: store://<sha[:2]>/<sha256>.<ext>, relative to IMAGE_STORE_DIR
+IMAGE_URL_SCHEME = "store://"
+LEGACY_URL_SCHEME = "mock://"  # rows written before the store: mock://<path relative to the worker's cwd>
+# Where those legacy paths are resolved (the old worker's cwd, as mounted here); unset, they aren't served
+LEGACY_IMAGE_DIR = os.getenv("LEGACY_IMAGE_DIR")
+_CONTENT_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def image_path(digest: str, extension: str, directory: str = IMAGE_STORE_DIR) -> str:
+    return os.path.join(directory, digest[:2], f"{digest}.{extension}")
+
+
+def _open_temp(tmp_dir: str, tmp_path: str):
+    os.makedirs(tmp_dir, exist_ok=True)
+    return open(tmp_path, "wb")
+
+
+def _write_chunk(f, digest, chunk: bytes):
+    digest.update(chunk)
+    f.write(chunk)
+
+
+def _place(tmp_path: str, path: str):
+    """Rename a finished temp file to its content address, unless an identical image is already there."""
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+
+def _discard(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def save_image_stream(
+        chunks: AsyncIterable[bytes],
+        extension: str,
+        directory: str = IMAGE_STORE_DIR
+) -> str:
+    """
+    Write an image to its content address `<directory>/<sha[:2]>/<sha256>.<extension>`.
+
+    Chunks are hashed as they are written to a temp file on the same volume, which is then
+    renamed into place atomically, so memory use does not grow with the image and readers
+    never see a partial file. Identical images from any job or replica land on the same
+    path; the later writer just drops its temp file. Every file operation runs in a worker
+    thread, so a slow volume doesn't stall the other jobs on the event loop. Time spent
+    waiting for chunks and writing them is reported separately, as "image_download" and
+    "image_write".
+    """
+    tmp_dir = os.path.join(directory, ".tmp")
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    f = await asyncio.to_thread(_open_temp, tmp_dir, tmp_path)
+    writing = 0.0
+    try:
+        try:
+            async for chunk in chunks:
+                chunk_start = time.perf_counter()
+                await asyncio.to_thread(_write_chunk, f, digest, chunk)
+                writing += time.perf_counter() - chunk_start
+            received = time.perf_counter()
+        finally:
+            await asyncio.to_thread(f.close)
+        path = image_path(digest.hexdigest(), extension, directory)
+        await asyncio.to_thread(_place, tmp_path, path)
+        observe("image_download", received - start - writing)
+        observe("image_write", writing + time.perf_counter() - received)
+        return path
+    except BaseException:
+        await asyncio.to_thread(_discard, tmp_path)
+        raise
+
+
+async def save_image_bytes(data: bytes, extension: str, directory: str = IMAGE_STORE_DIR) -> str:
+    """`save_image_stream` for images that are already in memory."""
+    async def single_chunk():
+        yield data
+    return await save_image_stream(single_chunk(), extension, directory)
+
+
+def placeholder_image(prompt: str) -> bytes:
+    """Stand-in image bytes for mock generation, unique per call so mock jobs don't share one content address."""
+    return f"mock image {uuid.uuid4()}: {prompt}".encode()
+
+
+def to_image_url(path: str, directory: str = IMAGE_STORE_DIR) -> str:
+    return IMAGE_URL_SCHEME + os.path.relpath(path, directory).replace(os.sep, "/")
+
+
+def _contained(directory: str, relative: str) -> Optional[str]:
+    """`relative` resolved under `directory`, or None if it is absolute or escapes it (e.g. via "..")."""
+    root = os.path.abspath(directory)
+    path = os.path.abspath(os.path.join(root, relative))
+    return path if path.startswith(root + os.sep) else None
+
+
+def resolve_image_url(
+        url: str,
+        directory: str = IMAGE_STORE_DIR,
+        legacy_directory: Optional[str] = LEGACY_IMAGE_DIR
+) -> Optional[str]:
+    """
+    Local path of a stored image_url, or None if it does not point into the store (or, for
+    legacy mock:// rows, into `legacy_directory`). image_url comes from MCP clients, so it is
+    never trusted to name a file outside those directories.
+    """
+    if url.startswith(IMAGE_URL_SCHEME):
+        return _contained(directory, url[len(IMAGE_URL_SCHEME):])
+    if url.startswith(LEGACY_URL_SCHEME) and legacy_directory:
+        return _contained(legacy_directory, url[len(LEGACY_URL_SCHEME):])
+    return None
+
+
+def content_hash(path: str) -> Optional[str]:
+    """The sha256 a content-addressed path is named after, if it is one."""
+    digest = os.path.basename(path).split(".", 1)[0]
+    return digest if _CONTENT_HASH_RE.match(digest) else None
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from typing import Dict, Sequence
+
+from PIL import Image
+
+from app.utils.imageStore import IMAGE_CHUNK_SIZE, IMAGE_STORE_DIR, content_hash, image_path, to_image_url
+from app.utils.mcpUtils import Context, MCPMessageWrapper
+
+IMAGE_VARIANTS_ENABLED = os.getenv("IMAGE_VARIANTS_ENABLED", "false").lower() == "true"
+IMAGE_VARIANT_SIZES = [int(size) for size in os.getenv("IMAGE_VARIANT_SIZES", "512,256,128").split(",")]
+IMAGE_VARIANT_FORMATS = os.getenv("IMAGE_VARIANT_FORMATS", "webp,jpeg").split(",")  # webp | jpeg | avif | png
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_STORED_ROUTING_KEY = "ai-tools.image.stored"
+IMAGE_VARIANT_QUEUE = "image-variants"
+
+_SAVE_OPTIONS = {
+    "webp": {"method": 4},
+    "jpeg": {"optimize": True, "progressive": True},
+    "avif": {"speed": 8},
+    "png": {"optimize": True},
+}
+
+
+def variant_name(size: int, image_format: str) -> str:
+    return f"{size}.{image_format}"
+
+
+def image_stored_message(image_url: str, context: Context) -> MCPMessageWrapper:
+    """Event published once an images row exists for `image_url`; it triggers variantWorker."""
+    return MCPMessageWrapper(
+        task="image.stored",
+        input={"image_url": image_url},
+        input_type="image",
+        output_type="image",
+        context=context
+    )
+
+
+async def publish_image_stored(publisher, image_url: str, context: Context):
+    """
+    Best effort: the images row is already stored, so failing the delivery here would only
+    store it again on redelivery. An image without variants is still served in full.
+    """
+    try:
+        await publisher.publish_message(image_stored_message(image_url, context), IMAGE_STORED_ROUTING_KEY)
+    except RuntimeError as e:
+        print(f"⚠️ Could not request variants for {image_url}: {e}")
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(IMAGE_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_variants(
+        source: str,
+        sizes: Sequence[int] = IMAGE_VARIANT_SIZES,
+        formats: Sequence[str] = IMAGE_VARIANT_FORMATS,
+        quality: int = IMAGE_VARIANT_QUALITY,
+        directory: str = IMAGE_STORE_DIR
+) -> Dict[str, str]:
+    """
+    Resize `source` to fit each of `sizes` (longest side, never upscaled) and encode every
+    size in every format. Returns {"<size>.<format>": store:// URL}.
+
+    Runs in a worker process. Variants are written next to the original as
+    `<sha256 of the original>.<size>.<format>` via a temp file and an atomic rename, so
+    re-running for an image that already has them (a reused image, a redelivery) only
+    checks that the files exist. Sizes are produced largest first, each downscaled from
+    the previous one rather than from the full original.
+    """
+    digest = content_hash(source) or _file_digest(source)
+    pending = {
+        (size, image_format): image_path(digest, variant_name(size, image_format), directory)
+        for size in sizes for image_format in formats
+    }
+    variants = {variant_name(size, fmt): to_image_url(path, directory) for (size, fmt), path in pending.items()}
+    pending = {key: path for key, path in pending.items() if not os.path.exists(path)}
+    if not pending:
+        return variants
+
+    with Image.open(source) as original:
+        # Let JPEG sources decode at a reduced scale when even the largest variant is much smaller
+        original.draft("RGB", (max(sizes), max(sizes)))
+        image = original.convert("RGBA" if original.mode in ("RGBA", "LA", "P") else "RGB")
+
+    os.makedirs(os.path.join(directory, digest[:2]), exist_ok=True)
+    for size in sorted(set(sizes), reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for image_format in formats:
+            path = pending.get((size, image_format))
+            if path is None:
+                continue
+            # JPEG has no alpha channel
+            encoded = image.convert("RGB") if image_format == "jpeg" and image.mode != "RGB" else image
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            encoded.save(tmp_path, format=image_format.upper(), quality=quality, **_SAVE_OPTIONS.get(image_format, {}))
+            os.replace(tmp_path, path)
+    return variants
@@ -0,0 +1,144 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Literal, Optional
+
+import aio_pika
+from pydantic import BaseModel, Field
+
+from app.utils.envelopeCodec import decode_message
+from app.utils.lruCache import LRUCache
+from app.utils.mcpUtils import Context, MCPMessageWrapper
+
+JOB_EVENTS_ENABLED = os.getenv("JOB_EVENTS_ENABLED", "true").lower() == "true"
+JOB_STATUS_TTL = float(os.getenv("JOB_STATUS_TTL", "3600"))  # seconds a job's status stays queryable
+JOB_STATUS_CACHE_SIZE = int(os.getenv("JOB_STATUS_CACHE_SIZE", "100000"))
+JOB_EVENT_ROUTING_PREFIX = "ai-tools.job"  # ai-tools.job.<state>
+
+JobState = Literal["queued", "started", "completed", "failed"]
+TERMINAL_STATES = ("completed", "failed")
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    state: JobState
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    image_id: Optional[str] = None
+    image_url: Optional[str] = None  # "/images/{image_id}" on the API, once completed
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in TERMINAL_STATES
+
+
+def job_event_message(context: Context, state: JobState, **fields: Any) -> MCPMessageWrapper:
+    """State transition of the job whose id is `context.trace_id`."""
+    status = JobStatus(job_id=context.trace_id, state=state, **fields)
+    return MCPMessageWrapper(
+        task=f"job.{state}",
+        input={"job_id": context.trace_id},
+        input_type="job",
+        output_type="job",
+        context=context,
+        output=status.model_dump(mode="json")
+    )
+
+
+async def publish_job_event(publisher, context: Context, state: JobState, **fields: Any):
+    """
+    Best effort, like publish_image_stored: a lost event only leaves a job's status stale
+    until its TTL, whereas failing the job over it would redo finished work.
+    """
+    if not JOB_EVENTS_ENABLED:
+        return
+    try:
+        await publisher.publish_message(
+            job_event_message(context, state, **fields), f"{JOB_EVENT_ROUTING_PREFIX}.{state}"
+        )
+    except RuntimeError as e:
+        print(f"⚠️ Could not publish job {context.trace_id} {state}: {e}")
+
+
+async def publish_job_completed(publisher, context: Context, image_id: str):
+    await publish_job_event(publisher, context, "completed", image_id=image_id, image_url=f"/images/{image_id}")
+
+
+class JobStatusBoard:
+    """
+    Latest status per job id (an LRU with a TTL) plus the subscribers waiting on each job.
+    Every update is pushed to the job's subscribers, so streams never poll.
+    """
+
+    def __init__(self, maxsize: int = JOB_STATUS_CACHE_SIZE, ttl: float = JOB_STATUS_TTL):
+        self.statuses = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._subscribers: Dict[str, set[asyncio.Queue]] = {}
+
+    def get(self, job_id: str) -> Optional[JobStatus]:
+        return self.statuses.get(job_id)
+
+    def update(self, status: JobStatus):
+        self.statuses.set(status.job_id, status)
+        for queue in self._subscribers.get(status.job_id, ()):
+            queue.put_nowait(status)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[job_id]
+
+
+class JobEventListener:
+    """
+    Receives every job event on a private, server-named queue (exclusive, auto-deleted), so
+    each API replica sees all transitions whichever replica accepted the job. The robust
+    connection re-declares the queue and resumes consuming after a reconnect.
+    """
+
+    def __init__(
+            self,
+            on_status: Callable[[JobStatus], None],
+            host: str = "rabbitmq",
+            exchange_name: str = "ai-tools",
+            retry_delay: int = 2
+    ):
+        self.on_status = on_status
+        self.host = host
+        self.exchange_name = exchange_name
+        self.retry_delay = retry_delay
+        self.connection: aio_pika.abc.AbstractRobustConnection | None = None
+
+    async def start(self):
+        while True:
+            try:
+                self.connection = await aio_pika.connect_robust(host=self.host)
+                break
+            except (aio_pika.exceptions.AMQPConnectionError, OSError):
+                print(f"❌ RabbitMQ not ready, retrying in {self.retry_delay}s...")
+                await asyncio.sleep(self.retry_delay)
+
+        channel = await self.connection.channel()
+        exchange = await channel.declare_exchange(self.exchange_name, aio_pika.ExchangeType.TOPIC, durable=True)
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(exchange, routing_key=f"{JOB_EVENT_ROUTING_PREFIX}.*")
+        await queue.consume(self._on_message, no_ack=True)
+        print("✅ Listening for job events.")
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            envelope = decode_message(message.body, message)
+            self.on_status(JobStatus(**envelope.output))
+        except Exception as e:
+            print(f"❌ Invalid job event: {e}")
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
@@ -0,0 +1,277 @@
+"""
+Sidecar indexes for the logger's JSONL segments, and queries over them.
+
+For every segment `<name>.jsonl` the logger maintains:
+  <name>.jsonl.idx        one fixed-width record per entry, in log order: timestamp, byte
+                          offset, length, routing key id and a 64-bit hash of context.trace_id
+  <name>.jsonl.keys.json  routing key id -> routing key
+  <name>.jsonl.tidx       written when the segment is closed: (trace hash, entry) sorted by hash
+
+Queries memory-map the index files, narrow them down with binary searches (timestamps are
+in log order; closed segments have the sorted trace table) and then read only the matching
+byte ranges of the memory-mapped segment. Nothing else in the segment is parsed. Gzipped
+segments are still searchable through their index, but reading their entries means
+decompressing up to each offset.
+
+    python -m app.utils.logIndex query --trace-id 3fa0b9a... [--routing-key ai-tools.recipe]
+                                       [--since 2025-05-09T18:00:00] [--until ...] [--limit 100]
+    python -m app.utils.logIndex reindex ./output/logs/message_log.jsonl
+"""
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("offset", "<u8"),
+    ("trace", "<u8"),
+    ("length", "<u4"),
+    ("key", "<u2"),
+    ("_pad", "<u2"),
+])
+TRACE_DTYPE = np.dtype([("trace", "<u8"), ("entry", "<u4")])
+NO_TRACE = 0
+
+_SEGMENT_TIME_RE = re.compile(r"\.(\d{8}T\d{12})\.jsonl(\.gz)?$")
+_TRACE_ID_RE = re.compile(rb'"trace_id":\s*"([^"]*)"')
+
+
+def trace_hash(trace_id: Optional[str]) -> int:
+    if not trace_id:
+        return NO_TRACE
+    value = int.from_bytes(hashlib.blake2b(trace_id.encode(), digest_size=8).digest(), "little")
+    return value or 1  # 0 is reserved for "no trace id"
+
+
+def find_trace_id(body: bytes) -> Optional[str]:
+    """Pull context.trace_id out of a raw JSON envelope without parsing it."""
+    match = _TRACE_ID_RE.search(body)
+    return match.group(1).decode() if match else None
+
+
+def to_epoch(moment: datetime) -> float:
+    """Log timestamps are naive UTC; treat naive datetimes the same way."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class SegmentIndexWriter:
+    """Appends index records for one open segment and writes its trace table when finished."""
+
+    def __init__(self, segment_path: str):
+        self.segment_path = segment_path
+        self.keys: Dict[str, int] = {}
+        self._file = open(f"{segment_path}.idx", "ab")
+
+    def key_id(self, routing_key: str) -> int:
+        key_id = self.keys.get(routing_key)
+        if key_id is None:
+            key_id = self.keys[routing_key] = len(self.keys)
+            write_key_table(self.segment_path, self.keys)
+        return key_id
+
+    def write(self, records: np.ndarray):
+        self._file.write(records.tobytes())
+        self._file.flush()
+
+    def finish(self):
+        self._file.close()
+        write_trace_table(self.segment_path)
+
+
+def write_key_table(segment_path: str, keys: Dict[str, int]):
+    tmp_path = f"{segment_path}.keys.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(keys, f)
+    os.replace(tmp_path, f"{segment_path}.keys.json")
+
+
+def write_trace_table(segment_path: str):
+    index = np.fromfile(f"{segment_path}.idx", dtype=INDEX_DTYPE)
+    table = np.empty(len(index), dtype=TRACE_DTYPE)
+    table["trace"] = index["trace"]
+    table["entry"] = np.arange(len(index), dtype=np.uint32)
+    table = table[table["trace"] != NO_TRACE]
+    table.sort(order="trace", kind="stable")
+    table.tofile(f"{segment_path}.tidx")
+
+
+def reindex_segment(segment_path: str):
+    """Build the index files for a segment written without them (e.g. the pre-index log)."""
+    keys: Dict[str, int] = {}
+    records, offset = [], 0
+    with open(segment_path, "rb") as f:
+        for line in f:
+            entry = json.loads(line)
+            ts = to_epoch(datetime.fromisoformat(entry["timestamp"]))
+            trace_id = (entry.get("body") or {}).get("context", {}).get("trace_id")
+            records.append((ts, offset, trace_hash(trace_id), len(line), keys.setdefault(entry["routing_key"], len(keys)), 0))
+            offset += len(line)
+    np.array(records, dtype=INDEX_DTYPE).tofile(f"{segment_path}.idx")
+    write_key_table(segment_path, keys)
+    write_trace_table(segment_path)
+
+
+class LogSegment:
+    def __init__(self, path: str):
+        self.path = path
+        self.base = path[:-3] if path.endswith(".gz") else path
+        self.index = self._memmap(f"{self.base}.idx", INDEX_DTYPE)
+        self.traces = self._memmap(f"{self.base}.tidx", TRACE_DTYPE) if os.path.exists(f"{self.base}.tidx") else None
+        try:
+            with open(f"{self.base}.keys.json") as f:
+                self.keys = json.load(f)
+        except OSError:
+            self.keys = {}
+
+    @staticmethod
+    def _memmap(path: str, dtype: np.dtype) -> np.ndarray:
+        # Ignore a torn trailing record from a crash mid-append
+        count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def select(
+            self,
+            trace: Optional[int] = None,
+            routing_key: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None
+    ) -> np.ndarray:
+        """Entry numbers matching all given filters, in log order."""
+        # bisect rather than np.searchsorted: the fields are strided views of the memmap, which
+        # searchsorted would copy in full, while bisect only touches the log n pages it probes
+        timestamps = self.index["ts"]
+        start = bisect.bisect_left(timestamps, since) if since is not None else 0
+        stop = bisect.bisect_right(timestamps, until) if until is not None else len(timestamps)
+        if start >= stop:
+            return np.empty(0, dtype=np.int64)
+
+        if trace is not None:
+            if self.traces is not None:
+                lo = bisect.bisect_left(self.traces["trace"], trace)
+                hi = bisect.bisect_right(self.traces["trace"], trace, lo)
+                entries = np.sort(self.traces["entry"][lo:hi].astype(np.int64))
+                entries = entries[(entries >= start) & (entries < stop)]
+            else:
+                # Open segment: no sorted table yet, scan the (small, fixed-width) index instead
+                entries = np.flatnonzero(self.index["trace"][start:stop] == trace) + start
+        else:
+            entries = np.arange(start, stop)
+
+        if routing_key is not None:
+            key_id = self.keys.get(routing_key)
+            if key_id is None:
+                return np.empty(0, dtype=np.int64)
+            entries = entries[self.index["key"][entries] == key_id]
+        return entries
+
+    def read(self, entries: np.ndarray) -> Iterator[bytes]:
+        if len(entries) == 0:
+            return
+        if self.path.endswith(".gz"):
+            with gzip.open(self.path, "rb") as f:
+                for record in self.index[entries]:
+                    f.seek(int(record["offset"]))
+                    yield f.read(int(record["length"]))
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for record in self.index[entries]:
+                offset = int(record["offset"])
+                yield data[offset:offset + int(record["length"])]
+
+
+def _segment_start(path: str) -> Optional[float]:
+    match = _SEGMENT_TIME_RE.search(path)
+    if not match:
+        return None
+    return to_epoch(datetime.strptime(match.group(1), "%Y%m%dT%H%M%S%f"))
+
+
+def list_segments(directory: str) -> List[str]:
+    """Indexed segments in chronological order."""
+    segments = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if (name.endswith(".jsonl") or name.endswith(".jsonl.gz"))
+        and os.path.exists(os.path.join(directory, name.removesuffix(".gz") + ".idx"))
+    ]
+    return sorted(segments, key=lambda path: (_segment_start(path) or 0.0, path))
+
+
+def query_logs(
+        directory: str,
+        trace_id: Optional[str] = None,
+        routing_key: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 1000
+) -> List[Dict[str, Any]]:
+    """Log entries matching every given filter, oldest first, parsed only once matched."""
+    since_ts = to_epoch(since) if since else None
+    until_ts = to_epoch(until) if until else None
+    trace = trace_hash(trace_id) if trace_id else None
+
+    segments = list_segments(directory)
+    starts = [_segment_start(path) for path in segments]
+    results: List[Dict[str, Any]] = []
+    for i, path in enumerate(segments):
+        # A segment ends where the next one starts, so most segments are skipped by name alone
+        next_start = starts[i + 1] if i + 1 < len(segments) else None
+        if until_ts is not None and starts[i] is not None and starts[i] > until_ts:
+            break
+        if since_ts is not None and next_start is not None and next_start < since_ts:
+            continue
+
+        segment = LogSegment(path)
+        entries = segment.select(trace, routing_key, since_ts, until_ts)
+        for raw in segment.read(entries[:limit - len(results)] if trace_id is None else entries):
+            entry = json.loads(raw)
+            # Confirm the trace id itself; the index only holds its 64-bit hash
+            if trace_id is not None and (entry.get("body") or {}).get("context", {}).get("trace_id") != trace_id:
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                return results
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="print matching entries as JSONL")
+    query.add_argument("--dir", default=os.getenv("LOG_DIR", "./output/logs"))
+    query.add_argument("--trace-id")
+    query.add_argument("--routing-key")
+    query.add_argument("--since", type=datetime.fromisoformat)
+    query.add_argument("--until", type=datetime.fromisoformat)
+    query.add_argument("--limit", type=int, default=1000)
+
+    reindex = commands.add_parser("reindex", help="build index files for an unindexed segment")
+    reindex.add_argument("segments", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "reindex":
+        for segment in args.segments:
+            reindex_segment(segment)
+            print(f"✅ Indexed {segment}", file=sys.stderr)
+        return
+
+    for entry in query_logs(args.dir, args.trace_id, args.routing_key, args.since, args.until, args.limit):
+        print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
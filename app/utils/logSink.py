@@ -0,0 +1,127 @@
+import gzip
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from app.utils.logIndex import INDEX_DTYPE, SegmentIndexWriter, trace_hash
+
+LOG_DIR = os.getenv("LOG_DIR", "./output/logs")
+LOG_FLUSH_ENTRIES = int(os.getenv("LOG_FLUSH_ENTRIES", "1000"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))  # seconds
+LOG_SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+LOG_SEGMENT_MAX_AGE = float(os.getenv("LOG_SEGMENT_MAX_AGE", "3600"))  # seconds
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "false").lower() == "true"
+
+
+class RotatingLogSink:
+    """
+    Append-only JSONL sink that buffers entries in memory and writes them in one go.
+
+    `append` only buffers; `flush` writes the buffer, fsyncs, and rotates to a new segment
+    once the current one exceeds `max_segment_bytes` or `max_segment_age`. Segments are
+    named `<basename>.<UTC start time>.jsonl` and, when `compress` is set, gzipped in a
+    background thread after they are closed. Callers decide when to flush (by size via
+    `should_flush` or on a timer) and may treat buffered entries as durable once `flush`
+    returns.
+
+    Each flush also appends the entries' offsets, timestamps, routing keys and trace ids to
+    the segment's sidecar index (see app.utils.logIndex), after the data itself is fsynced.
+    """
+
+    def __init__(
+            self,
+            directory: str = LOG_DIR,
+            basename: str = "message_log",
+            flush_entries: int = LOG_FLUSH_ENTRIES,
+            max_segment_bytes: int = LOG_SEGMENT_MAX_BYTES,
+            max_segment_age: float = LOG_SEGMENT_MAX_AGE,
+            compress: bool = LOG_COMPRESS
+    ):
+        self.directory = directory
+        self.basename = basename
+        self.flush_entries = flush_entries
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.compress = compress
+        self._buffer: list[bytes] = []
+        self._entries: list[tuple[float, str, int]] = []
+        self._file = None
+        self._index = None
+        self.segment_path = None
+        self._segment_opened_at = 0.0
+        self._segment_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, entry: bytes, timestamp: float, routing_key: str, trace_id: Optional[str] = None):
+        """Buffer one serialized entry (including its trailing newline) and what to index it by."""
+        self._buffer.append(entry)
+        self._entries.append((timestamp, routing_key, trace_hash(trace_id)))
+
+    def should_flush(self) -> bool:
+        return len(self._buffer) >= self.flush_entries
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._open_segment()
+        records = np.zeros(len(self._buffer), dtype=INDEX_DTYPE)
+        records["length"] = [len(entry) for entry in self._buffer]
+        records["offset"][1:] = np.cumsum(records["length"][:-1])
+        records["offset"] += self._segment_bytes
+        timestamps, routing_keys, traces = zip(*self._entries)
+        records["ts"], records["trace"] = timestamps, traces
+        records["key"] = [self._index.key_id(key) for key in routing_keys]
+
+        data = b"".join(self._buffer)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # The index trails the data: after a crash it may miss entries, never point past them
+        self._index.write(records)
+        self._segment_bytes += len(data)
+        self._buffer.clear()
+        self._entries.clear()
+
+        if (self._segment_bytes >= self.max_segment_bytes
+                or time.monotonic() - self._segment_opened_at >= self.max_segment_age):
+            self.rotate()
+
+    def rotate(self):
+        """Close the current segment; the next flush opens a new one."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._index.finish()
+        closed_path, self._file, self._index = self.segment_path, None, None
+        print(f"🗂️ Closed log segment {closed_path} ({self._segment_bytes} bytes)")
+        if self.compress:
+            threading.Thread(target=self._compress, args=(closed_path,), daemon=True).start()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._index.finish()
+            self._file, self._index = None, None
+
+    def _open_segment(self):
+        # Named after its first entry, so a segment never holds entries older than its name
+        started = datetime.fromtimestamp(self._entries[0][0], timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.segment_path = os.path.join(self.directory, f"{self.basename}.{started}.jsonl")
+        self._file = open(self.segment_path, "ab")
+        self._index = SegmentIndexWriter(self.segment_path)
+        self._segment_opened_at = time.monotonic()
+        self._segment_bytes = 0
+
+    @staticmethod
+    def _compress(path: str):
+        with open(path, "rb") as src, gzip.open(f"{path}.gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(f"{path}.gz.tmp", f"{path}.gz")
+        os.remove(path)
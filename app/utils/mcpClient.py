@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, Dict
+
+from fastmcp import Client
+from fastmcp.exceptions import ToolError
+
+from app.utils.metrics import track, trace_meta
+
+
+class MCPClientSession:
+    """
+    Long-lived MCP client shared by every coroutine in a worker.
+
+    The streamable-HTTP session and handshake are set up once; concurrent tool calls are
+    multiplexed over that session. If a call fails at the transport level the session is
+    dropped and transparently re-established on the next call. Each call carries the
+    current job's trace id in its _meta, for the server's metrics.
+    """
+
+    def __init__(self, url: str = "http://mcp-server:8000/mcp/", retry_delay: int = 2):
+        self.url = url
+        self.retry_delay = retry_delay  # seconds
+        self.client: Client | None = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Open the MCP session, retrying until the server is reachable."""
+        async with self._lock:
+            if self.client and self.client.is_connected():
+                return
+            while True:
+                client = Client(self.url)
+                try:
+                    await client.__aenter__()
+                    self.client = client
+                    print(f"✅ MCP session established with {self.url}")
+                    return
+                except Exception as e:
+                    print(f"❌ MCP server not ready ({e}), retrying in {self.retry_delay}s...")
+                    await asyncio.sleep(self.retry_delay)
+
+    async def close(self):
+        async with self._lock:
+            await self._drop()
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]):
+        if not (self.client and self.client.is_connected()):
+            await self.connect()
+        client = self.client
+        try:
+            with track(f"mcp.{name}"):
+                return await client.call_tool(name, arguments, meta=trace_meta())
+        except ToolError:
+            # The tool ran and reported an error; the session itself is healthy
+            raise
+        except Exception:
+            async with self._lock:
+                if self.client is client:
+                    await self._drop()
+            raise
+
+    async def _drop(self):
+        if self.client:
+            client, self.client = self.client, None
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception as e:
+                print(f"❌ Error closing MCP session: {e}")
@@ -1,8 +1,15 @@
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Dict, Literal, Optional, Any
 from pydantic import BaseModel, Field
 
+from app.utils.vectorCodec import EmbeddingInput
+
+Priority = Literal["interactive", "batch"]
+# AMQP message priority per level; queues that honour it are declared with x-max-priority
+MESSAGE_PRIORITIES: Dict[str, int] = {"batch": 1, "interactive": 2}
+MAX_MESSAGE_PRIORITY = max(MESSAGE_PRIORITIES.values())
+
 
 class Context(BaseModel):
     trace_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -10,6 +17,7 @@ class Context(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     source: str = "api"
     model_type: str
+    priority: Priority = "interactive"
 
 
 class MCPMessageWrapper(BaseModel):
@@ -20,3 +28,38 @@ class MCPMessageWrapper(BaseModel):
     context: Context
     metadata: Optional[Dict[str, Any]] = {}
     output: Optional[Dict[str, Any]] = None
+
+
+def message_context(context: Optional[Dict[str, Any]], model_type: str) -> Context:
+    """An envelope's context, or a fresh one (new trace id) for messages published without it."""
+    return Context(**context) if context else Context(model_type=model_type)
+
+
+def generation_message(
+        prompt: str,
+        model_type: str,
+        task: str = "generate.image",
+        user_id: Optional[str] = None,
+        priority: Priority = "interactive",
+        trace_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+) -> MCPMessageWrapper:
+    """Envelope for an image generation job; `trace_id` doubles as the job id."""
+    context = {"model_type": model_type, "user_id": user_id, "priority": priority}
+    if trace_id:
+        context["trace_id"] = trace_id
+    return MCPMessageWrapper(
+        context=context,
+        input={"prompt": prompt},
+        input_type="text",
+        output_type="image",
+        task=task,
+        metadata=metadata or {}
+    )
+
+
+class ImageMetadata(BaseModel):
+    prompt: str
+    image_url: str
+    embedding: EmbeddingInput  # encoded bytes or a plain float list for older clients
+    image_id: Optional[str] = None  # images.id chosen by the caller, e.g. to report it; generated if omitted
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from typing import Any, Dict, Optional, Tuple
+
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from prometheus_client.exposition import choose_encoder
+
+# Off: stages are untimed (decorators return the function itself) and /metrics is a 404
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # workers' /metrics listener; the APIs serve their own
+TRACE_ID_HEADER = "x-trace-id"
+PUBLISHED_AT_HEADER = "x-published-at"  # epoch seconds, for queue wait
+TRACE_META_KEY = "trace_id"  # in an MCP request's _meta
+
+# From a Postgres insert to a slow image generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "ai_tools_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_IN_FLIGHT = Gauge("ai_tools_stage_in_flight", "Operations currently in each pipeline stage", ["stage"])
+STAGE_ERRORS = Counter("ai_tools_stage_errors_total", "Failed operations per pipeline stage", ["stage", "error"])
+
+# The job (Context.trace_id) the current task works on; attached to samples as an exemplar
+trace_id_var: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+
+@lru_cache(maxsize=None)
+def _children(stage: str) -> Tuple[Histogram, Gauge]:
+    return STAGE_SECONDS.labels(stage), STAGE_IN_FLIGHT.labels(stage)
+
+
+def _exemplar() -> Optional[Dict[str, str]]:
+    trace_id = trace_id_var.get()
+    return {"trace_id": trace_id} if trace_id else None
+
+
+class _StageTimer:
+    __slots__ = ("stage", "histogram", "in_flight", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.histogram, self.in_flight = _children(stage)
+
+    def __enter__(self):
+        self.in_flight.inc()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, _exemplar())
+        self.in_flight.dec()
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            count_error(self.stage, exc_type.__name__)
+        return False
+
+
+_NOT_TRACKED = nullcontext()
+
+
+def track(stage: str):
+    """`with track("generate"):` times the block, counts it in flight and counts the exception it raises."""
+    return _StageTimer(stage) if METRICS_ENABLED else _NOT_TRACKED
+
+
+def timed(stage: str):
+    """`track` for a whole coroutine function. Disabled, the function is returned as is."""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with _StageTimer(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(stage: str, seconds: float):
+    """A stage timed elsewhere, e.g. an image download interleaved with its write."""
+    if METRICS_ENABLED:
+        _children(stage)[0].observe(seconds, _exemplar())
+
+
+def count_error(stage: str, error: str):
+    """A failure that isn't an exception, e.g. a backend that returned no image."""
+    if METRICS_ENABLED:
+        STAGE_ERRORS.labels(stage, error).inc()
+
+
+def trace_headers(trace_id: str) -> Dict[str, Any]:
+    """AMQP headers for a message of job `trace_id`, so consumers needn't decode the body to trace it."""
+    return {TRACE_ID_HEADER: trace_id, PUBLISHED_AT_HEADER: time.time()}
+
+
+def start_trace(properties: Any, context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Adopt the trace id of a delivered message (header, else the envelope's context) for the
+    rest of this task, and record how long the message waited in the broker as "queue_wait".
+    Queue wait compares the publisher's clock with ours, so it is only as good as their sync.
+    """
+    headers = getattr(properties, "headers", None) or {}
+    trace_id = headers.get(TRACE_ID_HEADER) or (context or {}).get("trace_id")
+    trace_id_var.set(trace_id)
+    published_at = headers.get(PUBLISHED_AT_HEADER)
+    if METRICS_ENABLED and published_at is not None:
+        observe("queue_wait", max(0.0, time.time() - published_at))
+    return trace_id
+
+
+def trace_meta() -> Optional[Dict[str, str]]:
+    """_meta for an MCP request made on behalf of the current job."""
+    trace_id = trace_id_var.get()
+    return {TRACE_META_KEY: trace_id} if trace_id else None
+
+
+class ToolMetricsMiddleware(Middleware):
+    """Times every MCP tool call as stage "mcp.<tool>", under the trace id the caller sent in _meta."""
+
+    @staticmethod
+    def _trace_id(context: MiddlewareContext) -> Optional[str]:
+        try:
+            request = context.fastmcp_context.request_context if context.fastmcp_context else None
+        except (LookupError, ValueError):  # not inside an MCP request
+            request = None
+        meta = request.meta if request else None
+        return getattr(meta, TRACE_META_KEY, None)
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        token = trace_id_var.set(self._trace_id(context))
+        try:
+            with track(f"mcp.{context.message.name}"):
+                return await call_next(context)
+        finally:
+            trace_id_var.reset(token)
+
+
+def render_metrics(accept: Optional[str] = None) -> Tuple[bytes, str]:
+    """(body, content type) for a /metrics request; OpenMetrics, with exemplars, if the scraper asks for it."""
+    encoder, content_type = choose_encoder(accept or "")
+    return encoder(REGISTRY), content_type
+
+
+def serve_metrics(port: int = METRICS_PORT):
+    """Serve /metrics from a background thread, for workers that have no HTTP server of their own."""
+    if METRICS_ENABLED:
+        start_http_server(port)
+        print(f"📈 Metrics on :{port}/metrics")
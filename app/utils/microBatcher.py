@@ -0,0 +1,60 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, List, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Groups items submitted by many concurrent coroutines into batches.
+
+    A batch is handed to `process` as soon as it holds `max_batch_size` items or the oldest
+    item has waited `max_delay` seconds, whichever comes first. `process` returns one result
+    per item, in order; each `submit` call resolves with its own result (or the batch's error).
+    """
+
+    def __init__(
+            self,
+            process: Callable[[List[T]], Awaitable[List[R]]],
+            max_batch_size: int = 64,
+            max_delay: float = 0.05
+    ):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay  # seconds
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running: set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[T, asyncio.Future]]):
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
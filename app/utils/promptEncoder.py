@@ -0,0 +1,127 @@
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from typing import Sequence, Tuple
+
+import numpy as np
+
+EMBEDDING_DIM = 768  # matches images.embedding VECTOR(768)
+EMBEDDING_ENCODER = os.getenv("EMBEDDING_ENCODER", "hashing")  # "hashing" or a path to a .npz model
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class PromptEncoder(ABC):
+    """
+    Turns prompts into L2-normalized float32 vectors of size `dim`. Implementations must be
+    vectorized over the batch: `encode` is called with many prompts at once by the
+    embedding stage, and once per prompt on the inline path.
+    """
+    dim: int
+
+    @abstractmethod
+    def encode(self, prompts: Sequence[str]) -> np.ndarray:
+        """Encode prompts into a (len(prompts), dim) float32 matrix."""
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class HashedNgramFeatures:
+    """
+    Lowercased word tokens plus character n-grams, hashed with crc32 (stable across
+    processes). Prompts share most of their vocabulary, so each token's hashes are
+    computed once and memoized (up to `cache_size` tokens).
+    """
+
+    def __init__(self, char_ngrams: Sequence[int] = (3, 4), cache_size: int = 100_000):
+        self.char_ngrams = tuple(char_ngrams)
+        self.cache_size = cache_size
+        self._token_hashes: dict[str, list[int]] = {}
+
+    def token_features(self, token: str) -> list[str]:
+        padded = f"<{token}>"
+        features = [f"w:{token}"]
+        for n in self.char_ngrams:
+            features.extend(f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+        return features
+
+    def _hashes(self, token: str) -> list[int]:
+        hashes = self._token_hashes.get(token)
+        if hashes is None:
+            hashes = [zlib.crc32(feature.encode()) for feature in self.token_features(token)]
+            if len(self._token_hashes) >= self.cache_size:
+                self._token_hashes.clear()
+            self._token_hashes[token] = hashes
+        return hashes
+
+    def hash_batch(self, prompts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row index, feature hash) pairs for every feature of every prompt."""
+        hashes: list[int] = []
+        counts: list[int] = []
+        for prompt in prompts:
+            before = len(hashes)
+            for token in _TOKEN_RE.findall(prompt.lower()):
+                hashes.extend(self._hashes(token))
+            counts.append(len(hashes) - before)
+        hashed = np.fromiter(hashes, dtype=np.uint32, count=len(hashes))
+        rows = np.repeat(np.arange(len(prompts)), counts)
+        return rows, hashed
+
+
+class HashingNgramEncoder(PromptEncoder):
+    """
+    Deterministic, dependency-free encoder using feature hashing: each feature adds a
+    signed 1 to one of `dim` buckets. Word order and capitalization do not change the
+    vector; small spelling changes only move it slightly.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, char_ngrams: Sequence[int] = (3, 4)):
+        self.dim = dim
+        self.featurizer = HashedNgramFeatures(char_ngrams)
+
+    def encode(self, prompts: Sequence[str]) -> np.ndarray:
+        rows, hashed = self.featurizer.hash_batch(prompts)
+        columns = hashed % self.dim
+        signs = np.where(hashed >> 31, -1.0, 1.0)
+        flat = np.bincount(rows * self.dim + columns, weights=signs, minlength=len(prompts) * self.dim)
+        return self._normalize(flat.reshape(len(prompts), self.dim).astype(np.float32))
+
+
+class ProjectionModelEncoder(PromptEncoder):
+    """
+    Small local model: hashed n-gram features looked up in a learned (buckets, dim)
+    projection matrix and summed, e.g. a distilled word-piece embedding table. Loaded from
+    an .npz file with a `projection` array and an optional `char_ngrams` array.
+    """
+
+    def __init__(self, path: str):
+        model = np.load(path)
+        self.projection = np.ascontiguousarray(model["projection"], dtype=np.float32)
+        self.buckets, self.dim = self.projection.shape
+        char_ngrams = model["char_ngrams"].tolist() if "char_ngrams" in model else (3, 4)
+        self.featurizer = HashedNgramFeatures(char_ngrams)
+
+    def encode(self, prompts: Sequence[str]) -> np.ndarray:
+        rows, hashed = self.featurizer.hash_batch(prompts)
+        vectors = np.zeros((len(prompts), self.dim), dtype=np.float32)
+        if hashed.size:
+            # rows are sorted, so each prompt's features are one contiguous slice to sum
+            counts = np.bincount(rows, minlength=len(prompts))
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            nonempty = counts > 0
+            vectors[nonempty] = np.add.reduceat(self.projection[hashed % self.buckets], starts[nonempty], axis=0)
+        return self._normalize(vectors)
+
+
+def load_encoder(spec: str = EMBEDDING_ENCODER) -> PromptEncoder:
+    """Build the encoder named by EMBEDDING_ENCODER: "hashing" or a path to an .npz model file."""
+    if spec == "hashing":
+        return HashingNgramEncoder()
+    if spec.endswith(".npz"):
+        return ProjectionModelEncoder(spec)
+    raise ValueError(f"Unsupported embedding encoder '{spec}'")
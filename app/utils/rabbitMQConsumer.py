@@ -1,8 +1,29 @@
+import asyncio
+import functools
+import os
+import threading
 import pika
 import json
 import time
 from datetime import datetime
-from typing import Callable
+from typing import Awaitable, Callable, Optional
+
+# Seconds a requeued message is held before going back on the queue, when the handler gives no delay
+REQUEUE_DELAY = float(os.getenv("REQUEUE_DELAY", "5"))
+REQUEUE_MIN_DELAY = 1.0  # even a Retry-After of 0 isn't worth a hot redelivery loop
+
+
+class RequeueMessage(Exception):
+    """
+    Raised by an async handler for a transient failure (e.g. an upstream quota): the message
+    goes back on the queue however often it was delivered, instead of the usual one retry.
+    It goes back only after `delay` seconds (e.g. the backend's Retry-After), so it isn't
+    redelivered straight into the condition that failed it.
+    """
+
+    def __init__(self, message: str = "", delay: Optional[float] = None):
+        super().__init__(message)
+        self.delay = max(REQUEUE_DELAY if delay is None else delay, REQUEUE_MIN_DELAY)
 
 
 class RabbitMQConsumer:
@@ -12,13 +33,16 @@ class RabbitMQConsumer:
             host: str = "rabbitmq",
             exchange_name: str = "ai-tools",
             routing_key: str = "ai-tools.#",
-            retry_delay: int = 2
+            retry_delay: int = 2,
+            queue_arguments: dict | None = None
     ):
         self.host = host
         self.queue_name = queue_name
         self.exchange_name = exchange_name
         self.routing_key = routing_key
         self.retry_delay = retry_delay
+        # e.g. {"x-max-priority": 2}; must match the existing queue's or the declare fails
+        self.queue_arguments = queue_arguments
         self.connection = None
         self.channel = None
 
@@ -28,7 +52,7 @@ class RabbitMQConsumer:
                 self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
                 self.channel = self.connection.channel()
                 self.channel.exchange_declare(exchange=self.exchange_name, exchange_type="topic", durable=True)
-                self.channel.queue_declare(queue=self.queue_name, durable=True)
+                self.channel.queue_declare(queue=self.queue_name, durable=True, arguments=self.queue_arguments)
                 self.channel.queue_bind(
                     exchange=self.exchange_name,
                     queue=self.queue_name,
@@ -48,6 +72,116 @@ class RabbitMQConsumer:
         self.channel.basic_consume(queue=self.queue_name, on_message_callback=callback, auto_ack=True)
         self.channel.start_consuming()
 
+    def start_consuming_async(
+            self,
+            handler: Callable[[pika.spec.BasicProperties, bytes, bool], Awaitable[None]],
+            concurrency: int = 8,
+            on_startup: Callable[[], Awaitable[None]] | None = None
+    ):
+        """
+        Consume with manual acks, running up to `concurrency` handler coroutines at once
+        on a single long-lived event loop. Prefetch equals `concurrency`, so the broker never
+        hands this consumer more work than it can hold; a handler that schedules its own work
+        (see FairScheduler) can ask for more than it runs at once. A message is acked only after
+        its handler returns; if the handler raises, the message is requeued once and dropped
+        on the second failure, unless it raised RequeueMessage. The handler is called as
+        `handler(properties, body, last_attempt)`: `last_attempt` is True when a failure now
+        would drop the message rather than requeue it.
+        """
+        if not self.channel:
+            raise RuntimeError("RabbitMQ channel not initialized. Call connect() first.")
+
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, name="consumer-loop", daemon=True)
+        loop_thread.start()
+        if on_startup:
+            asyncio.run_coroutine_threadsafe(on_startup(), loop).result()
+
+        def on_message(ch, method, properties, body):
+            future = asyncio.run_coroutine_threadsafe(handler(properties, body, method.redelivered), loop)
+            # pika is not thread-safe: settle the delivery back on the connection's thread
+            settle = functools.partial(self._settle_when_due, ch, method)
+            future.add_done_callback(
+                lambda f: self.connection.add_callback_threadsafe(functools.partial(settle, f))
+            )
+
+        self.channel.basic_qos(prefetch_count=concurrency)
+        self.channel.basic_consume(queue=self.queue_name, on_message_callback=on_message, auto_ack=False)
+        print(f"🔎 Listening to events with routing key: {self.routing_key} ({concurrency} in flight)")
+        try:
+            self.channel.start_consuming()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+
+    def start_consuming_batched(
+            self,
+            handler: Callable[[pika.spec.Basic.Deliver, pika.spec.BasicProperties, bytes], None],
+            flush: Callable[[], None],
+            should_flush: Callable[[], bool],
+            prefetch: int,
+            flush_interval: float
+    ):
+        """
+        Consume with manual acks for handlers that buffer messages. After every delivery
+        `should_flush` is checked, and every `flush_interval` seconds a flush happens anyway;
+        once `flush` returns, every delivery so far is acked with a single multiple-ack.
+        If `flush` raises, nothing is acked and the unflushed messages are redelivered.
+        """
+        if not self.channel:
+            raise RuntimeError("RabbitMQ channel not initialized. Call connect() first.")
+
+        last_tag = None
+
+        def flush_and_ack():
+            nonlocal last_tag
+            if last_tag is None:
+                return
+            flush()
+            self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+            last_tag = None
+
+        def on_message(ch, method, properties, body):
+            nonlocal last_tag
+            handler(method, properties, body)
+            last_tag = method.delivery_tag
+            if should_flush():
+                flush_and_ack()
+
+        def on_timer():
+            flush_and_ack()
+            self.connection.call_later(flush_interval, on_timer)
+
+        self.channel.basic_qos(prefetch_count=prefetch)
+        self.channel.basic_consume(queue=self.queue_name, on_message_callback=on_message, auto_ack=False)
+        self.connection.call_later(flush_interval, on_timer)
+        print(f"🔎 Listening to events with routing key: {self.routing_key} (batched, every {flush_interval}s)")
+        self.channel.start_consuming()
+
+    def _settle_when_due(self, ch, method, future):
+        """
+        Settle now, or once a RequeueMessage's delay has passed. Meanwhile the message stays
+        unacked and keeps its prefetch slot, which also slows intake while a quota is exhausted.
+        """
+        error = future.exception()
+        if isinstance(error, RequeueMessage) and error.delay > 0:
+            print(f"⏳ Requeueing in {error.delay:.1f}s: {error}")
+            self.connection.call_later(error.delay, functools.partial(self._settle, ch, method, future))
+        else:
+            self._settle(ch, method, future)
+
+    @staticmethod
+    def _settle(ch, method, future):
+        error = future.exception()
+        if error is None:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        elif isinstance(error, RequeueMessage):
+            print(f"↩️ Requeueing message: {error}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        else:
+            print(f"❌ Error processing message: {error}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+
     def close(self):
         if self.connection:
             self.connection.close()
@@ -1,6 +1,10 @@
 import pika
 import time
-from app.utils.mcpUtils import MCPMessageWrapper
+from typing import Any, Dict, Optional
+
+from app.utils.envelopeCodec import encode_envelope
+from app.utils.mcpUtils import MESSAGE_PRIORITIES, Priority, generation_message
+from app.utils.metrics import trace_headers
 
 
 class RabbitMQPublisher:
@@ -37,26 +41,35 @@ class RabbitMQPublisher:
             self.connection = None
             self.channel = None
 
-    def publish(self, prompt: str, model_type: str, task: str = "generate.image"):
+    def publish(
+            self,
+            prompt: str,
+            model_type: str,
+            task: str = "generate.image",
+            user_id: Optional[str] = None,
+            priority: Priority = "interactive",
+            trace_id: Optional[str] = None,
+            metadata: Optional[Dict[str, Any]] = None
+    ) -> str:
         if not self.channel:
             raise RuntimeError("RabbitMQ channel not initialized. Call connect() first.")
 
         routing_key = f"{self.routing_key_prefix}.{model_type}"
 
-        # Wrap the message in MCPMessage
-        message = MCPMessageWrapper(
-            context={"model_type": model_type},
-            input={"prompt": prompt},
-            input_type="text",
-            output_type="image",
-            task=task,
-            output_format="json"
-        )
+        message = generation_message(prompt, model_type, task, user_id, priority, trace_id, metadata)
+        body, content_type, headers = encode_envelope(message)
+        headers.update(trace_headers(message.context.trace_id))
 
         # Publish the message
         self.channel.basic_publish(
             exchange=self.exchange_name,
             routing_key=routing_key,
-            body=message.json(),
-            properties=pika.BasicProperties(delivery_mode=2)
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                priority=MESSAGE_PRIORITIES[priority],
+                content_type=content_type,
+                headers=headers
+            )
         )
+        return message.context.trace_id
@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.utils.mcpClient import MCPClientSession
+
+# Requests/second and burst per generation backend, e.g. "sdxl=2:10,openai=0.1:5"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "sdxl=2:10,openai=0.1:5")
+# "shared": one bucket per backend for the whole cluster, kept in Postgres via the MCP server
+# "local":  one bucket per process (single replica, tests)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "shared")
+ADAPTIVE_INITIAL_CONCURRENCY = int(os.getenv("ADAPTIVE_INITIAL_CONCURRENCY", "4"))
+ADAPTIVE_MIN_CONCURRENCY = int(os.getenv("ADAPTIVE_MIN_CONCURRENCY", "1"))
+ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("ADAPTIVE_MAX_CONCURRENCY", "16"))
+ADAPTIVE_LATENCY_SPIKE = float(os.getenv("ADAPTIVE_LATENCY_SPIKE", "2.0"))  # x the moving average
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))  # 429 retries before requeueing
+RATE_LIMIT_MAX_BACKOFF = 30.0  # seconds, when the backend gives no Retry-After
+# Retries of transient failures (connection errors, timeouts, 408/409/5xx), as the OpenAI SDK did by default
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_DELAY = 0.5  # seconds before the first such retry, doubling up to UPSTREAM_MAX_BACKOFF
+UPSTREAM_MAX_BACKOFF = 8.0
+
+T = TypeVar("T")
+
+
+class UpstreamRateLimited(Exception):
+    """The backend answered 429; `retry_after` is its Retry-After hint in seconds, if any."""
+
+    def __init__(self, backend: str, retry_after: Optional[float] = None):
+        super().__init__(f"{backend} rate limited (retry after {retry_after}s)")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailable(Exception):
+    """A transient backend failure worth retrying: connection error, timeout, 408, 409 or 5xx."""
+
+    def __init__(self, backend: str, detail: str):
+        super().__init__(f"{backend} unavailable: {detail}")
+        self.backend = backend
+
+
+def is_transient_status(status_code: int) -> bool:
+    return status_code in (408, 409) or status_code >= 500
+
+
+def transient_backoff(attempt: int) -> float:
+    return min(UPSTREAM_MAX_BACKOFF, UPSTREAM_RETRY_DELAY * 2 ** attempt)
+
+
+async def retry_unavailable(call: Callable[[], Awaitable[T]], max_retries: int = UPSTREAM_MAX_RETRIES) -> T:
+    """Await `call()`, retrying UpstreamUnavailable with backoff; for backends called without a limiter."""
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except UpstreamUnavailable:
+            if attempt >= max_retries:
+                raise
+        await asyncio.sleep(transient_backoff(attempt))
+        attempt += 1
+
+
+def parse_rate_limits(spec: str = RATE_LIMITS) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        backend, values = item.split("=", 1)
+        rate, burst = values.split(":", 1)
+        limits[backend.strip()] = (float(rate), float(burst))
+    return limits
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None  # HTTP-date form; fall back to our own backoff
+
+
+class LocalTokenBucket:
+    """
+    Token bucket that hands out reservations: every caller takes a token immediately,
+    letting the balance go negative, and is told how long to wait until that token would
+    have been refilled. Waiters are therefore served in arrival order with no polling.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    async def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate) - 1
+        self.updated_at = now
+        return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        wait = await self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class SharedTokenBucket(LocalTokenBucket):
+    """
+    The same reservation bucket, shared by every replica: each reservation is one atomic
+    upsert on the rate_limits table (MCP tool reserve_rate_limit). If the MCP server can't
+    be reached the process falls back to its own local bucket rather than stalling.
+    """
+
+    def __init__(self, session: MCPClientSession, backend: str, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self.session = session
+        self.backend = backend
+
+    async def reserve(self) -> float:
+        try:
+            result = await self.session.call_tool("reserve_rate_limit", {
+                "backend": self.backend, "rate": self.rate, "burst": self.burst
+            })
+            return result.data["wait"]
+        except Exception as e:
+            print(f"⚠️ Shared rate limit unavailable for {self.backend}, using local bucket: {e}")
+            return await super().reserve()
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on calls in flight to one backend. Every healthy response raises the limit
+    by 1/limit (about +1 per limit's worth of calls); a 429 or a latency spike above
+    `latency_spike` x the moving average halves it, at most once per round trip so one
+    burst of rejections counts as a single signal.
+    """
+
+    def __init__(
+            self,
+            initial: int = ADAPTIVE_INITIAL_CONCURRENCY,
+            min_limit: int = ADAPTIVE_MIN_CONCURRENCY,
+            max_limit: int = ADAPTIVE_MAX_CONCURRENCY,
+            latency_spike: float = ADAPTIVE_LATENCY_SPIKE,
+            backoff: float = 0.5
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_spike = latency_spike
+        self.backoff = backoff
+        self.in_flight = 0
+        self.avg_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._slots = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+    def on_success(self, latency: float):
+        if self.avg_latency is not None and latency > self.latency_spike * self.avg_latency:
+            self._decrease(latency)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        # Spikes are folded in slowly so that one slow call doesn't become the new normal
+        self.avg_latency = latency if self.avg_latency is None else 0.9 * self.avg_latency + 0.1 * latency
+
+    def on_overload(self):
+        self._decrease(self.avg_latency or 0.0)
+
+    def _decrease(self, window: float):
+        now = time.monotonic()
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        print(f"📉 Upstream concurrency limit lowered to {int(self.limit)}")
+
+
+class BackendLimiter:
+    """
+    Token bucket, adaptive concurrency and bounded retries around calls to one backend:
+    up to `max_retries` 429s and, separately, up to `transient_retries` transient failures.
+    """
+
+    def __init__(
+            self,
+            backend: str,
+            bucket: LocalTokenBucket,
+            concurrency: AdaptiveConcurrencyLimiter,
+            max_retries: int = RATE_LIMIT_MAX_RETRIES,
+            transient_retries: int = UPSTREAM_MAX_RETRIES
+    ):
+        self.backend = backend
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.transient_retries = transient_retries
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await `call()` within the limits; raises UpstreamRateLimited or UpstreamUnavailable
+        once the retries for that kind of failure run out.
+        """
+        attempt = transient_attempt = 0
+        while True:
+            await self.bucket.acquire()
+            async with self.concurrency:
+                start = time.perf_counter()
+                try:
+                    result = await call()
+                except UpstreamRateLimited as e:
+                    self.concurrency.on_overload()
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = e.retry_after if e.retry_after is not None else min(RATE_LIMIT_MAX_BACKOFF, 2 ** attempt)
+                    attempt += 1
+                except UpstreamUnavailable as e:
+                    if transient_attempt >= self.transient_retries:
+                        raise
+                    print(f"🔁 Retrying: {e}")
+                    delay = transient_backoff(transient_attempt)
+                    transient_attempt += 1
+                else:
+                    self.concurrency.on_success(time.perf_counter() - start)
+                    return result
+            # Back off outside the slot so other calls can use it
+            await asyncio.sleep(delay)
+
+
+def create_backend_limiter(
+        backend: str,
+        session: Optional[MCPClientSession] = None,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None
+) -> Optional[BackendLimiter]:
+    """Limiter for `backend` per RATE_LIMITS / RATE_LIMIT_BACKEND, or None if it has no limit."""
+    rate_burst = (limits if limits is not None else parse_rate_limits()).get(backend)
+    if rate_burst is None:
+        return None
+    if RATE_LIMIT_BACKEND == "shared" and session is not None:
+        bucket = SharedTokenBucket(session, backend, *rate_burst)
+    else:
+        bucket = LocalTokenBucket(*rate_burst)
+    return BackendLimiter(backend, bucket, AdaptiveConcurrencyLimiter())
@@ -0,0 +1,81 @@
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from app.utils.mcpClient import MCPClientSession
+from app.utils.vectorCodec import encode_embedding
+
+SEMANTIC_REUSE_ENABLED = os.getenv("SEMANTIC_REUSE_ENABLED", "false").lower() == "true"
+SEMANTIC_REUSE_THRESHOLD = float(os.getenv("SEMANTIC_REUSE_THRESHOLD", "0.95"))  # cosine similarity
+SEMANTIC_REUSE_REPORT_EVERY = int(os.getenv("SEMANTIC_REUSE_REPORT_EVERY", "100"))  # lookups
+
+
+class SemanticReuseStats:
+    """Hit-rate and latency of near-duplicate lookups over a sliding window of recent calls."""
+
+    def __init__(self, window: int = 1000):
+        self.lookups = 0
+        self.hits = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=window)  # seconds
+
+    def record(self, hit: bool, latency: float):
+        self.lookups += 1
+        self.hits += hit
+        self.latencies.append(latency)
+
+    def summary(self) -> Dict[str, float]:
+        latencies_ms = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "errors": self.errors,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+        }
+
+
+class SemanticReuse:
+    """
+    Pre-generation lookup of the nearest stored image by prompt embedding. Returns the
+    stored row when its cosine similarity reaches `threshold`, so the caller can reuse
+    that image instead of paying for a new generation.
+    """
+
+    def __init__(
+            self,
+            session: MCPClientSession,
+            threshold: float = SEMANTIC_REUSE_THRESHOLD,
+            report_every: int = SEMANTIC_REUSE_REPORT_EVERY
+    ):
+        self.session = session
+        self.threshold = threshold
+        self.report_every = report_every
+        self.stats = SemanticReuseStats()
+
+    async def find(self, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            result = await self.session.call_tool("find_similar_image", {
+                "embedding": encode_embedding(embedding).model_dump(),
+                "min_similarity": self.threshold
+            })
+            match = result.data or None
+        except Exception as e:
+            # A failed lookup only costs us the saving; fall through to generation
+            print(f"❌ Semantic lookup failed: {e}")
+            self.stats.errors += 1
+            match = None
+
+        self.stats.record(match is not None, time.perf_counter() - start)
+        if self.stats.lookups % self.report_every == 0:
+            summary = self.stats.summary()
+            print(
+                f"📊 Semantic reuse: {summary['hits']}/{summary['lookups']} hits "
+                f"({summary['hit_rate']:.1%}), p50 {summary['p50_ms']:.1f} ms, p95 {summary['p95_ms']:.1f} ms"
+            )
+        return match
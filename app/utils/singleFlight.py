@@ -0,0 +1,63 @@
+import hashlib
+import os
+import uuid
+from typing import Optional, Tuple
+
+from psycopg import AsyncConnection
+
+# How long a job can be joined by identical requests before it's assumed lost (seconds);
+# workers release it as soon as they finish, so this only bounds a crashed or dropped job
+INFLIGHT_JOB_TTL = float(os.getenv("INFLIGHT_JOB_TTL", "600"))
+
+
+def coalesce_key(model_type: str, prompt: str) -> str:
+    """Identity of a generation request: its DTO type and the prompt built from it, whitespace-normalized."""
+    return hashlib.sha256(f"{model_type}\0{' '.join(prompt.split())}".encode()).hexdigest()
+
+
+async def claim_job(conn: AsyncConnection, key: str, ttl: float = INFLIGHT_JOB_TTL) -> Tuple[str, bool]:
+    """
+    Single-flight claim on `key` across every API replica. Returns (job_id, True) for the
+    caller that should publish the job, or the id of the identical job already in flight
+    and False. An expired claim is taken over as if it weren't there.
+    """
+    while True:
+        cur = await conn.execute("""
+            INSERT INTO inflight_jobs AS job (job_key, job_id, expires_at)
+            VALUES (%(key)s, %(job_id)s, clock_timestamp() + make_interval(secs => %(ttl)s))
+            ON CONFLICT (job_key) DO UPDATE SET
+                job_id = EXCLUDED.job_id,
+                expires_at = EXCLUDED.expires_at
+            WHERE job.expires_at < clock_timestamp()
+            RETURNING job_id
+        """, {"key": key, "job_id": uuid.uuid4(), "ttl": ttl})
+        row = await cur.fetchone()
+        if row:
+            return str(row[0]), True
+        cur = await conn.execute("SELECT job_id FROM inflight_jobs WHERE job_key = %s", (key,))
+        row = await cur.fetchone()
+        if row:
+            return str(row[0]), False
+        # Released between the two statements: claim again
+
+
+async def release_job(conn: AsyncConnection, key: str, job_id: str) -> bool:
+    """Drop the claim once the job is done, unless it has since been taken over by another job."""
+    cur = await conn.execute(
+        "DELETE FROM inflight_jobs WHERE job_key = %s AND job_id = %s::uuid", (key, job_id)
+    )
+    return cur.rowcount > 0
+
+
+async def release_job_via_mcp(session, key: Optional[str], job_id: str):
+    """
+    Worker side of release_job, through the MCP server's release_inflight_job tool: let identical
+    /generate requests start a new job now job `job_id` is done. No-op for jobs without a key.
+    """
+    if not key:
+        return
+    try:
+        await session.call_tool("release_inflight_job", {"job_key": key, "job_id": job_id})
+    except Exception as e:
+        # The claim expires after INFLIGHT_JOB_TTL anyway
+        print(f"⚠️ Could not release job {job_id}: {e}")
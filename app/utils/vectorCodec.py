@@ -0,0 +1,46 @@
+import base64
+from typing import List, Literal, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+# Wire dtypes are always little-endian, independent of the host byte order
+WIRE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+
+class EncodedEmbedding(BaseModel):
+    """Compact embedding transport: base64 of the raw little-endian vector bytes."""
+    data: str
+    dtype: Literal["float32", "float16"] = "float32"
+    dim: int
+    encoding: Literal["base64"] = "base64"
+
+
+EmbeddingInput = Union[EncodedEmbedding, List[float]]
+
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float32") -> EncodedEmbedding:
+    vector = np.ascontiguousarray(embedding, dtype=WIRE_DTYPES[dtype]).ravel()
+    return EncodedEmbedding(
+        data=base64.b64encode(vector.tobytes()).decode("ascii"),
+        dtype=dtype,
+        dim=vector.shape[0]
+    )
+
+
+def decode_embedding(embedding: EmbeddingInput) -> np.ndarray:
+    """Return a float32 vector from either the encoded form or a plain JSON float list."""
+    if not isinstance(embedding, EncodedEmbedding):
+        return np.asarray(embedding, dtype=np.float32)
+
+    wire_dtype = WIRE_DTYPES[embedding.dtype]
+    raw = base64.b64decode(embedding.data, validate=True)
+    if len(raw) != embedding.dim * wire_dtype.itemsize:
+        raise ValueError(
+            f"Embedding declares {embedding.dim} x {embedding.dtype} but carries {len(raw)} bytes"
+        )
+    # frombuffer is a zero-copy view; astype only copies when widening float16
+    return np.frombuffer(raw, dtype=wire_dtype).astype(np.float32, copy=False)
@@ -1,10 +1,12 @@
 # worker.py
-import json
 import asyncio
 import os
 import httpx
 from dotenv import load_dotenv
-from datetime import datetime
+from app.utils.envelopeCodec import decode_envelope
+from app.utils.imageStore import IMAGE_CHUNK_SIZE, placeholder_image, save_image_bytes, save_image_stream, to_image_url
+from app.utils.mcpUtils import MAX_MESSAGE_PRIORITY
+from app.utils.promptEncoder import load_encoder
 from app.utils.rabbitmq import wait_for_rabbitmq
 import psycopg2
 from psycopg2.extras import execute_values
@@ -18,13 +20,16 @@ QUEUE_NAME = "recipe-image-gen"
 ROUTING_KEY = "ai-tools.recipe"
 EXCHANGE_NAME = "ai-tools"
 
+prompt_encoder = load_encoder()
+
 async def run_sdxl_via_api(prompt: str) -> str:
     print(f"Worker generating image with prompt: {prompt}")
 
     if USE_STABILITY_API_KEY:
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
+                async with client.stream(
+                    "POST",
                     "https://api.stability.ai/v2beta/stable-image/generate/core",
                     headers={
                         "authorization": f"Bearer {API_KEY}",
@@ -35,15 +40,10 @@ async def run_sdxl_via_api(prompt: str) -> str:
                         "prompt": prompt,
                         "output_format": "webp",
                     },
-                )
-
-                if response.status_code == 200:
-                    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                    filename = f"./output/image_{timestamp}.webp"
-                    with open("./output/output.webp", "wb") as file:
-                        file.write(response.content)
-                    return file.name
-                else:
+                ) as response:
+                    if response.status_code == 200:
+                        return await save_image_stream(response.aiter_bytes(IMAGE_CHUNK_SIZE), "webp")
+                    await response.aread()
                     print(f"❌ API Error {response.status_code}: {response.text}")
                     return None
         except httpx.RequestError as e:
@@ -51,10 +51,7 @@ async def run_sdxl_via_api(prompt: str) -> str:
             return None
     else:
         # Mock mode: generate placeholder file
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        filename = f"./output/mock_{timestamp}.webp"
-        with open(filename, "wb") as f:
-            f.write(b"")  # Placeholder for actual image data
+        filename = await save_image_bytes(placeholder_image(prompt), "webp")
         print(f"Mock image saved as {filename}")
 
         return filename
@@ -78,7 +75,7 @@ def insert_image_metadata(prompt: str, image_url: str, embedding: np.ndarray):
     print(f"📦 Metadata stored for: {image_url}")
 
 def callback(ch, method, properties, body):
-    data = json.loads(body)
+    data = decode_envelope(body, properties)
     prompt = data.get("prompt")
     if not prompt:
         print("❌ No prompt found in message.")
@@ -90,11 +87,10 @@ def callback(ch, method, properties, body):
     if image_path:
         print(f"✅ Image generated: {image_path}")
 
-        # TODO: Replace this with actual embedding generation
-        embedding = np.random.rand(768).astype(np.float32)  # Mock embedding
+        embedding = prompt_encoder.encode([prompt])[0]
 
         # Store metadata
-        image_url = f"mock://{image_path}"  # Replace with real URL in prod
+        image_url = to_image_url(image_path)
         insert_image_metadata(prompt, image_url, embedding)
 
     else:
@@ -106,7 +102,8 @@ def main():
     channel = connection.channel()
     # Declare exchange and queue
     channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="topic", durable=True)
-    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    # Same arguments as imageGenWorker, which shares the queue
+    channel.queue_declare(queue=QUEUE_NAME, durable=True, arguments={"x-max-priority": MAX_MESSAGE_PRIORITY})
     # Bind the queue to the exchange with the routing key
     channel.queue_bind(queue=QUEUE_NAME, exchange=EXCHANGE_NAME, routing_key=ROUTING_KEY)
 
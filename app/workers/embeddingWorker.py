@@ -0,0 +1,153 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
+from app.utils.envelopeCodec import decode_envelope
+from app.utils.imageVariants import (
+    IMAGE_STORED_ROUTING_KEY, IMAGE_VARIANT_QUEUE, IMAGE_VARIANTS_ENABLED, publish_image_stored
+)
+from app.utils.jobEvents import JOB_EVENTS_ENABLED, publish_job_completed
+from app.utils.mcpClient import MCPClientSession
+from app.utils.mcpUtils import Context, message_context
+from app.utils.metrics import serve_metrics, start_trace, track
+from app.utils.microBatcher import MicroBatcher
+from app.utils.promptEncoder import load_encoder
+from app.utils.rabbitMQConsumer import RabbitMQConsumer
+from app.utils.singleFlight import release_job_via_mcp
+from app.utils.vectorCodec import encode_embedding
+
+load_dotenv()
+
+QUEUE_NAME = "embedding"
+ROUTING_KEY = "ai-tools.embed"
+EXCHANGE_NAME = "ai-tools"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_DELAY = float(os.getenv("EMBEDDING_BATCH_DELAY", "0.05"))  # seconds
+EMBEDDING_REPORT_EVERY = int(os.getenv("EMBEDDING_REPORT_EVERY", "50"))  # batches
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp-server:8000/mcp/")
+
+encoder = load_encoder()
+mcp_session = MCPClientSession(MCP_SERVER_URL)
+publisher = AsyncRabbitMQPublisher(pool_size=1)
+
+
+class EncoderThroughput:
+    """Prompts encoded per CPU-second of encoder time, i.e. prompts/sec per core."""
+
+    def __init__(self):
+        self.prompts = 0
+        self.batches = 0
+        self.cpu_seconds = 0.0
+
+    def record(self, prompts: int, cpu_seconds: float):
+        self.prompts += prompts
+        self.batches += 1
+        self.cpu_seconds += cpu_seconds
+
+    def report(self):
+        per_core = self.prompts / self.cpu_seconds if self.cpu_seconds else 0.0
+        print(
+            f"📊 Embedded {self.prompts} prompts in {self.batches} batches "
+            f"(avg {self.prompts / self.batches:.1f}/batch): {per_core:,.0f} prompts/sec/core"
+        )
+
+
+throughput = EncoderThroughput()
+
+
+def encode_prompts(prompts: list[str]):
+    start = time.thread_time()
+    vectors = encoder.encode(prompts)
+    return vectors, time.thread_time() - start
+
+
+async def embed_and_store(items: list[tuple[str, str, Context, Optional[str]]]) -> list[None]:
+    """Encode, store and complete a batch of jobs: (prompt, image_url, context, coalesce_key) each."""
+    # Encode off the event loop so deliveries keep flowing into the next batch
+    with track("encode"):
+        vectors, cpu_seconds = await asyncio.to_thread(encode_prompts, [prompt for prompt, _, _, _ in items])
+    image_ids = [str(uuid.uuid4()) for _ in items]
+    await mcp_session.call_tool("store_image_metadata_batch", {
+        "rows": [
+            {
+                "prompt": prompt,
+                "image_url": image_url,
+                "embedding": encode_embedding(vector).model_dump(),
+                "image_id": image_id
+            }
+            for (prompt, image_url, _, _), vector, image_id in zip(items, vectors, image_ids)
+        ]
+    })
+    await asyncio.gather(*[
+        publish_job_completed(publisher, context, image_id) for (_, _, context, _), image_id in zip(items, image_ids)
+    ])
+    # Only now is each job finished, so only now may identical requests start a new one
+    await asyncio.gather(*[
+        release_job_via_mcp(mcp_session, key, context.trace_id) for _, _, context, key in items if key
+    ])
+    if IMAGE_VARIANTS_ENABLED:
+        await asyncio.gather(*[
+            publish_image_stored(publisher, image_url, context) for _, image_url, context, _ in items
+        ])
+
+    throughput.record(len(items), cpu_seconds)
+    if throughput.batches % EMBEDDING_REPORT_EVERY == 0:
+        throughput.report()
+    return [None] * len(items)
+
+
+batcher = MicroBatcher(embed_and_store, max_batch_size=EMBEDDING_BATCH_SIZE, max_delay=EMBEDDING_BATCH_DELAY)
+
+
+async def startup():
+    serve_metrics()
+    await mcp_session.connect()
+    if IMAGE_VARIANTS_ENABLED or JOB_EVENTS_ENABLED:
+        await publisher.connect()
+    if IMAGE_VARIANTS_ENABLED:
+        await publisher.declare_queue(IMAGE_VARIANT_QUEUE, IMAGE_STORED_ROUTING_KEY)
+
+
+async def message_callback(properties, body, last_attempt: bool = True):
+    data = decode_envelope(body, properties)
+    start_trace(properties, data.get("context"))
+    input_data = data.get("input", {})
+    prompt = input_data.get("prompt")
+    image_url = input_data.get("image_url")
+
+    if not prompt or not image_url:
+        print("❌ Embedding request needs both prompt and image_url.")
+        return
+
+    # Resolves once the whole batch is encoded and stored; only then is the message acked
+    await batcher.submit((
+        prompt, image_url, message_context(data.get("context"), "embedding"),
+        (data.get("metadata") or {}).get("coalesce_key")
+    ))
+
+
+def main():
+    consumer = RabbitMQConsumer(
+        host="rabbitmq",
+        queue_name=QUEUE_NAME,
+        exchange_name=EXCHANGE_NAME,
+        routing_key=ROUTING_KEY,
+        retry_delay=2
+    )
+    consumer.connect()
+    print(f" [*] embeddingWorker batching up to {EMBEDDING_BATCH_SIZE} prompts per {EMBEDDING_BATCH_DELAY}s...")
+    # Two batches of prefetch: the next batch fills while the previous one is being stored
+    consumer.start_consuming_async(
+        message_callback,
+        concurrency=EMBEDDING_BATCH_SIZE * 2,
+        on_startup=startup
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,84 @@
-import json
-import asyncio
 import os
+import uuid
 from dotenv import load_dotenv
-from datetime import datetime
 import httpx
 import openai
 import numpy as np
 import psycopg2
 
-from fastmcp import Client
-from app.utils.rabbitMQConsumer import RabbitMQConsumer
+from app.utils.asyncRabbitMQPublisher import AsyncRabbitMQPublisher
+from app.utils.envelopeCodec import decode_envelope
+from app.utils.fairScheduler import FairScheduler
+from app.utils.generationCache import GENERATION_CACHE_ENABLED, GenerationCache, cache_key
+from app.utils.httpClients import get_client
+from app.utils.imageStore import (
+    IMAGE_CHUNK_SIZE, placeholder_image, save_image_bytes, save_image_stream, to_image_url
+)
+from app.utils.imageVariants import (
+    IMAGE_STORED_ROUTING_KEY, IMAGE_VARIANT_QUEUE, IMAGE_VARIANTS_ENABLED, publish_image_stored
+)
+from app.utils.jobEvents import JOB_EVENTS_ENABLED, publish_job_completed, publish_job_event
+from app.utils.mcpClient import MCPClientSession
+from app.utils.mcpUtils import MAX_MESSAGE_PRIORITY, Context, MCPMessageWrapper, message_context
+from app.utils.metrics import count_error, serve_metrics, start_trace, timed, track
+from app.utils.promptEncoder import load_encoder
+from app.utils.rabbitMQConsumer import RabbitMQConsumer, RequeueMessage
+from app.utils.rateLimiter import (
+    BackendLimiter, UpstreamRateLimited, UpstreamUnavailable, create_backend_limiter, is_transient_status,
+    parse_retry_after, retry_unavailable
+)
+from app.utils.semanticReuse import SEMANTIC_REUSE_ENABLED, SemanticReuse
+from app.utils.singleFlight import release_job_via_mcp
+from app.utils.vectorCodec import encode_embedding
 
 load_dotenv()
 STABILITY_API_KEY = os.getenv("STABILITY_API_KEY")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 API_TO_USE = os.getenv("API_TO_USE", "mock").lower()
+STABILITY_BASE_URL = os.getenv("STABILITY_BASE_URL", "https://api.stability.ai")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
 QUEUE_NAME = "recipe-image-gen"
 ROUTING_KEY = "ai-tools.recipe"
 EXCHANGE_NAME = "ai-tools"
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+# Jobs held per replica for the fair scheduler to choose from; only WORKER_CONCURRENCY generate at once
+WORKER_PREFETCH = int(os.getenv("WORKER_PREFETCH", str(WORKER_CONCURRENCY * 4)))
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp-server:8000/mcp/")
+# Hand embedding + metadata storage to embeddingWorker (micro-batched) instead of doing it inline
+EMBEDDING_STAGE_ENABLED = os.getenv("EMBEDDING_STAGE_ENABLED", "false").lower() == "true"
+EMBED_QUEUE_NAME = "embedding"
+EMBED_ROUTING_KEY = "ai-tools.embed"
+
+OUTPUT_FORMATS = {"sdxl": "webp", "openai": "png", "mock": "webp"}
+
+mcp_session = MCPClientSession(MCP_SERVER_URL)
+generation_cache = GenerationCache() if GENERATION_CACHE_ENABLED else None
+prompt_encoder = load_encoder()
+publisher = AsyncRabbitMQPublisher(pool_size=1)
+semantic_reuse = SemanticReuse(mcp_session) if SEMANTIC_REUSE_ENABLED else None
+limiters: dict[str, BackendLimiter | None] = {}  # per generation backend, created on first use
+scheduler = FairScheduler(WORKER_CONCURRENCY)
+_openai_client: openai.AsyncOpenAI | None = None
+
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    """OpenAI SDK client riding on the shared, pooled "openai" HTTP client."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            http_client=get_client("openai"),
+            # 429s and transient failures are retried by the backend limiter, which also paces other calls
+            max_retries=0
+        )
+    return _openai_client
 
 
 async def run_mock(prompt: str) -> str:
     print(f"imageGenWorker generating image with prompt: {prompt}")
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    filename = f"./output/mock_{timestamp}.webp"
-    with open(filename, "wb") as f:
-        f.write(b"")
+    filename = await save_image_bytes(placeholder_image(prompt), "webp")
     print(f"Mock image saved as {filename}")
     return filename
 
@@ -34,34 +86,34 @@ async def run_mock(prompt: str) -> str:
 async def run_sdxl_via_api(prompt: str) -> str:
     print(f"imageGenWorker generating sdxl image with prompt: {prompt}")
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://api.stability.ai/v2beta/stable-image/generate/core",
-                headers={
-                    "authorization": f"Bearer {STABILITY_API_KEY}",
-                    "Accept": "image/*",
-                },
-                files={"none": ''},
-                data={"prompt": prompt, "output_format": "webp"},
-            )
+        client = get_client("stability", STABILITY_BASE_URL)
+        async with client.stream(
+            "POST",
+            "/v2beta/stable-image/generate/core",
+            headers={
+                "authorization": f"Bearer {STABILITY_API_KEY}",
+                "Accept": "image/*",
+            },
+            files={"none": ''},
+            data={"prompt": prompt, "output_format": "webp"},
+        ) as response:
             if response.status_code == 200:
-                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                filename = f"./output/image_{timestamp}.webp"
-                with open(filename, "wb") as file:
-                    file.write(response.content)
-                return filename
-            else:
-                print(f"❌ API Error {response.status_code}: {response.text}")
-                return None
+                return await save_image_stream(response.aiter_bytes(IMAGE_CHUNK_SIZE), "webp")
+            if response.status_code == 429:
+                raise UpstreamRateLimited("sdxl", parse_retry_after(response.headers.get("retry-after")))
+            await response.aread()
+            if is_transient_status(response.status_code):
+                raise UpstreamUnavailable("sdxl", f"HTTP {response.status_code}")
+            print(f"❌ API Error {response.status_code}: {response.text}")
+            return None
     except httpx.RequestError as e:
-        print(f"❌ HTTPX Error: {e}")
-        return None
+        raise UpstreamUnavailable("sdxl", repr(e)) from e
 
 
 async def run_openai_dalle_image(prompt: str) -> str:
     print(f"imageGenWorker generating OpenAI image with prompt: {prompt}")
     try:
-        response = await openai.images.generate(
+        response = await get_openai_client().images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -72,30 +124,55 @@ async def run_openai_dalle_image(prompt: str) -> str:
         image_url = response.data[0].url
         if image_url:
             print(f"✅ OpenAI image URL: {image_url}")
-            async with httpx.AsyncClient() as client:
-                img_response = await client.get(image_url)
+            async with get_client("openai").stream("GET", image_url) as img_response:
                 if img_response.status_code == 200:
-                    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                    filename = f"./output/openai_{timestamp}.png"
-                    with open(filename, "wb") as f:
-                        f.write(img_response.content)
-                    return filename
+                    return await save_image_stream(img_response.aiter_bytes(IMAGE_CHUNK_SIZE), "png")
+                if is_transient_status(img_response.status_code):
+                    raise UpstreamUnavailable("openai", f"image download HTTP {img_response.status_code}")
         print("❌ No image URL returned")
         return None
+    except UpstreamUnavailable:
+        raise
+    except openai.RateLimitError as e:
+        raise UpstreamRateLimited("openai", parse_retry_after(e.response.headers.get("retry-after"))) from e
+    except (openai.APIConnectionError, httpx.RequestError) as e:  # including timeouts
+        raise UpstreamUnavailable("openai", repr(e)) from e
+    except openai.APIStatusError as e:
+        if is_transient_status(e.status_code):
+            raise UpstreamUnavailable("openai", f"HTTP {e.status_code}") from e
+        print(f"❌ OpenAI Error: {e}")
+        return None
     except Exception as e:
         print(f"❌ OpenAI Error: {e}")
         return None
 
 
-async def insert_image_metadata_via_mcp(prompt: str, image_url: str, embedding: np.ndarray):
+async def insert_image_metadata_via_mcp(prompt: str, image_url: str, embedding: np.ndarray, image_id: str):
     print(f"imageGenWorker sending metadata to MCP for: {image_url}")
-    async with Client("http://mcp-server:8000/mcp/") as client:
-        await client.call_tool("store_image_metadata", {
-            "prompt": prompt,
-            "image_url": image_url,
-            "embedding": embedding.tolist()
-        })
-        print(f"📦 Metadata sent to MCP for: {image_url}")
+    await mcp_session.call_tool("store_image_metadata", {
+        "prompt": prompt,
+        "image_url": image_url,
+        "embedding": encode_embedding(embedding).model_dump(),
+        "image_id": image_id
+    })
+    print(f"📦 Metadata sent to MCP for: {image_url}")
+
+
+async def request_embedding(prompt: str, image_url: str, context: dict, metadata: dict | None = None):
+    """
+    Queue the prompt for embeddingWorker, which encodes in batches, stores the metadata and
+    completes the job. `metadata` carries the job's coalesce_key, so it releases the claim too.
+    """
+    message = MCPMessageWrapper(
+        task="embed.vector",
+        input={"prompt": prompt, "image_url": image_url},
+        input_type="text",
+        output_type="embedding",
+        context=message_context(context, API_TO_USE),
+        metadata=metadata or {}
+    )
+    await publisher.publish_message(message, EMBED_ROUTING_KEY)
+    print(f"📨 Embedding requested for: {image_url}")
 
 
 def insert_image_metadata(prompt: str, image_url: str, embedding: np.ndarray):
@@ -138,45 +215,138 @@ def get_prompt_context(prompt: str, style: str = "realistic") -> str:
     return STYLE_PRESETS.get(style, "") + prompt
 
 
-def message_callback(ch, method, properties, body):
-    try:
-        data = json.loads(body)
-        context = data.get("context", {})
-        input_data = data.get("input", {})
-        prompt = input_data.get("prompt")
+def get_limiter(backend: str) -> BackendLimiter | None:
+    if backend not in limiters:
+        limiters[backend] = create_backend_limiter(backend, mcp_session)
+    return limiters[backend]
 
-        if not prompt:
-            print("❌ No prompt found in message.")
-            return
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+@timed("generate")
+async def generate(contextualized_prompt: str) -> str | None:
+    match API_TO_USE:
+        case "sdxl":
+            run_backend = run_sdxl_via_api
+        case "openai":
+            run_backend = run_openai_dalle_image
+        case _:
+            return await run_mock(contextualized_prompt)
 
-        contextualized_prompt = get_prompt_context(prompt, style="realistic")
+    limiter = get_limiter(API_TO_USE)
+    if limiter is None:
+        return await retry_unavailable(lambda: run_backend(contextualized_prompt))
+    return await limiter.run(lambda: run_backend(contextualized_prompt))
 
-        match API_TO_USE:
-            case "sdxl":
-                image_path = loop.run_until_complete(run_sdxl_via_api(contextualized_prompt))
-            case "openai":
-                image_path = loop.run_until_complete(run_openai_dalle_image(contextualized_prompt))
-            case _:
-                image_path = loop.run_until_complete(run_mock(contextualized_prompt))
 
-        if image_path:
-            print(f"✅ Image generated: {image_path}")
-            embedding = np.random.rand(768).astype(np.float32)  # Replace with real embedding
-            image_url = f"mock://{image_path}"  # Replace with real URL in prod
+async def release_job(data: dict):
+    """Let identical /generate requests start a new job now this one is done (see singleFlight)."""
+    await release_job_via_mcp(
+        mcp_session, (data.get("metadata") or {}).get("coalesce_key"), data.get("context", {}).get("trace_id")
+    )
 
-            # Store metadata in PostgreSQL directly
-            #insert_image_metadata(prompt, image_url, embedding)
 
-            # or send to MCP
-            loop.run_until_complete(insert_image_metadata_via_mcp(prompt, image_url, embedding))
+async def message_callback(properties, body, last_attempt: bool = True):
+    data = decode_envelope(body, properties)
+    start_trace(properties, data.get("context"))
+    job_context = message_context(data.get("context"), API_TO_USE)
+    with track("job"):
+        try:
+            finished = await handle_job(data, job_context)
+        except RequeueMessage:
+            # Still in flight: identical requests keep joining it
+            await publish_job_event(publisher, job_context, "queued")
+            raise
+        except Exception as e:
+            if last_attempt:
+                await publish_job_event(publisher, job_context, "failed", error=str(e))
+                await release_job(data)
+            else:
+                # Delivered again (see RabbitMQConsumer._settle), so the job may still complete
+                await publish_job_event(publisher, job_context, "queued")
+            raise
+        if finished:
+            await release_job(data)
+
+
+async def handle_job(data: dict, job_context: Context) -> bool:
+    """
+    Generate (or reuse) the job's image and store its metadata. Returns False when the job was
+    handed to the embedding stage, which finishes it and releases its claim; True otherwise.
+    """
+    context = data.get("context", {})
+    input_data = data.get("input", {})
+    prompt = input_data.get("prompt")
+
+    if not prompt:
+        print("❌ No prompt found in message.")
+        await publish_job_event(publisher, job_context, "failed", error="No prompt in message")
+        return True
+
+    async def generate_in_slot():
+        await publish_job_event(publisher, job_context, "started")
+        return await generate(contextualized_prompt)
+
+    contextualized_prompt = get_prompt_context(prompt, style="realistic")
+    key = cache_key(API_TO_USE, contextualized_prompt, OUTPUT_FORMATS.get(API_TO_USE, "webp"))
+    cached = await generation_cache.get(key) if generation_cache else None
+
+    if cached:
+        image_path, embedding = cached
+        image_url = to_image_url(image_path)
+        print(f"♻️ Reusing cached image: {image_path}")
+    else:
+        embedding = prompt_encoder.encode([prompt])[0] if semantic_reuse else None
+        match = await semantic_reuse.find(embedding) if semantic_reuse else None
+        if match:
+            image_url = match["image_url"]
+            print(f"♻️ Reusing similar image ({match['similarity']:.3f}): {image_url}")
         else:
-            print("❌ Image generation failed")
+            try:
+                image_path = await scheduler.run(
+                    context.get("priority", "interactive"),
+                    context.get("user_id"),
+                    generate_in_slot
+                )
+            except UpstreamRateLimited as e:
+                # Over quota even after backing off: hand the job back rather than dropping it
+                raise RequeueMessage(str(e), delay=e.retry_after) from e
+            if not image_path:
+                print("❌ Image generation failed")
+                count_error("generate", "no_image")
+                await publish_job_event(publisher, job_context, "failed", error="Image generation failed")
+                return True
+            print(f"✅ Image generated: {image_path}")
+            image_url = to_image_url(image_path)
+            if generation_cache:
+                await generation_cache.put(key, image_path, embedding)
 
-    except Exception as e:
-        print(f"❌ Error processing message: {e}")
+    # The message is acked only once the metadata is stored, or handed to the embedding stage
+    if embedding is None and EMBEDDING_STAGE_ENABLED:
+        await request_embedding(prompt, image_url, context, data.get("metadata"))
+        return False
+    if embedding is None:
+        embedding = prompt_encoder.encode([prompt])[0]
+
+    # Store metadata in PostgreSQL directly
+    #insert_image_metadata(prompt, image_url, embedding)
+
+    # or send to MCP
+    image_id = str(uuid.uuid4())
+    await insert_image_metadata_via_mcp(prompt, image_url, embedding, image_id)
+    await publish_job_completed(publisher, job_context, image_id)
+    if IMAGE_VARIANTS_ENABLED:
+        await publish_image_stored(publisher, image_url, job_context)
+    return True
+
+
+async def startup():
+    serve_metrics()
+    await mcp_session.connect()
+    if EMBEDDING_STAGE_ENABLED or IMAGE_VARIANTS_ENABLED or JOB_EVENTS_ENABLED:
+        await publisher.connect()
+    if EMBEDDING_STAGE_ENABLED:
+        await publisher.declare_queue(EMBED_QUEUE_NAME, EMBED_ROUTING_KEY)
+    if IMAGE_VARIANTS_ENABLED:
+        await publisher.declare_queue(IMAGE_VARIANT_QUEUE, IMAGE_STORED_ROUTING_KEY)
 
 
 def main():
@@ -185,11 +355,17 @@ def main():
         queue_name=QUEUE_NAME,
         exchange_name=EXCHANGE_NAME,
         routing_key=ROUTING_KEY,
-        retry_delay=2
+        retry_delay=2,
+        # Interactive jobs overtake a batch backlog in the broker too, not just in the scheduler
+        queue_arguments={"x-max-priority": MAX_MESSAGE_PRIORITY}
     )
     consumer.connect()
     print(" [*] imageGenWorker listening for prompts...")
-    consumer.start_consuming(message_callback)
+    consumer.start_consuming_async(
+        message_callback,
+        concurrency=WORKER_PREFETCH,
+        on_startup=startup
+    )
 
 
 if __name__ == "__main__":
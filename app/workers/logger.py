@@ -1,18 +1,40 @@
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from app.utils.envelopeCodec import CONTENT_TYPE_JSON, decode_envelope
+from app.utils.logIndex import find_trace_id
+from app.utils.logSink import LOG_FLUSH_ENTRIES, LOG_FLUSH_INTERVAL, RotatingLogSink
+from app.utils.metrics import serve_metrics
 from app.utils.rabbitMQConsumer import RabbitMQConsumer
 
+sink = RotatingLogSink()
+EPOCH = datetime(1970, 1, 1)
 
-def log_callback(ch, method, properties, body):
-    msg = json.loads(body)
-    log_entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "routing_key": method.routing_key,
-        "body": msg
-    }
-    print(f"🔍 Logged: {log_entry}")
-    with open("./output/logs/message_log.jsonl", "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+
+def log_callback(method, properties, body):
+    if (properties.content_type or CONTENT_TYPE_JSON) == CONTENT_TYPE_JSON:
+        # The body is already JSON; splice it in as-is instead of parsing and re-serializing it
+        trace_id = find_trace_id(body)
+    else:
+        # Binary envelopes are transcoded so the log stays greppable, indexable JSON lines
+        try:
+            envelope = decode_envelope(body, properties)
+        except Exception as e:
+            # Still log that it passed through; a bad message mustn't stall the log
+            envelope = {"undecodable": properties.content_type, "error": str(e)}
+        trace_id = (envelope.get("context") or {}).get("trace_id")
+        body = json.dumps(envelope, ensure_ascii=False).encode()
+    # Whole microseconds, so the indexed float and the ISO string name the same instant
+    micros = time.time_ns() // 1000
+    timestamp = (EPOCH + timedelta(microseconds=micros)).isoformat()
+    sink.append(
+        b'{"timestamp": "' + timestamp.encode()
+        + b'", "routing_key": ' + json.dumps(method.routing_key).encode()
+        + b', "body": ' + body + b'}\n',
+        timestamp=micros / 1e6,
+        routing_key=method.routing_key,
+        trace_id=trace_id
+    )
 
 
 if __name__ == "__main__":
@@ -23,5 +45,15 @@ if __name__ == "__main__":
         routing_key="ai-tools.#",
     )
     consumer.connect()
-    consumer.start_consuming(log_callback)
-
+    serve_metrics()
+    try:
+        # Acks go out only after a flush has fsynced the entries to disk
+        consumer.start_consuming_batched(
+            log_callback,
+            flush=sink.flush,
+            should_flush=sink.should_flush,
+            prefetch=LOG_FLUSH_ENTRIES * 2,
+            flush_interval=LOG_FLUSH_INTERVAL
+        )
+    finally:
+        sink.close()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+from PIL import UnidentifiedImageError
+
+from app.utils.envelopeCodec import decode_envelope
+from app.utils.imageStore import resolve_image_url
+from app.utils.imageVariants import (
+    IMAGE_STORED_ROUTING_KEY, IMAGE_VARIANT_FORMATS, IMAGE_VARIANT_QUEUE, IMAGE_VARIANT_SIZES, render_variants
+)
+from app.utils.mcpClient import MCPClientSession
+from app.utils.metrics import serve_metrics, start_trace, track
+from app.utils.rabbitMQConsumer import RabbitMQConsumer
+
+load_dotenv()
+
+QUEUE_NAME = IMAGE_VARIANT_QUEUE
+ROUTING_KEY = IMAGE_STORED_ROUTING_KEY
+EXCHANGE_NAME = "ai-tools"
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp-server:8000/mcp/")
+# Default to the cores this container may actually run on, not the host's core count
+VARIANT_PROCESSES = int(os.getenv("VARIANT_PROCESSES", str(len(os.sched_getaffinity(0)))))
+
+mcp_session = MCPClientSession(MCP_SERVER_URL)
+pool: ProcessPoolExecutor | None = None
+
+
+async def message_callback(properties, body, last_attempt: bool = True):
+    data = decode_envelope(body, properties)
+    start_trace(properties, data.get("context"))
+    image_url = data.get("input", {}).get("image_url")
+    source = resolve_image_url(image_url) if image_url else None
+
+    if not source or not os.path.exists(source):
+        print(f"❌ No stored image for: {image_url}")
+        return
+
+    start = time.perf_counter()
+    try:
+        with track("render_variants"):
+            variants = await asyncio.get_running_loop().run_in_executor(
+                pool, render_variants, source, IMAGE_VARIANT_SIZES, IMAGE_VARIANT_FORMATS
+            )
+    except UnidentifiedImageError:
+        # e.g. the mock backend's placeholder files; nothing to resize
+        print(f"⚠️ Not a decodable image, skipping variants: {image_url}")
+        return
+
+    await mcp_session.call_tool("store_image_variants", {"image_url": image_url, "variants": variants})
+    print(f"🖼️ {len(variants)} variants for {image_url} in {time.perf_counter() - start:.2f}s")
+
+
+async def startup():
+    global pool
+    serve_metrics()
+    # Start the processes up front so the first images don't pay for their spawn
+    pool = ProcessPoolExecutor(max_workers=VARIANT_PROCESSES)
+    for _ in range(VARIANT_PROCESSES):
+        pool.submit(int)
+    await mcp_session.connect()
+
+
+def main():
+    consumer = RabbitMQConsumer(
+        host="rabbitmq",
+        queue_name=QUEUE_NAME,
+        exchange_name=EXCHANGE_NAME,
+        routing_key=ROUTING_KEY,
+        retry_delay=2
+    )
+    consumer.connect()
+    print(f" [*] variantWorker rendering {IMAGE_VARIANT_SIZES} as {IMAGE_VARIANT_FORMATS} "
+          f"on {VARIANT_PROCESSES} processes...")
+    try:
+        # One image per process plus one queued behind each, so no process waits on the broker
+        consumer.start_consuming_async(
+            message_callback,
+            concurrency=VARIANT_PROCESSES * 2,
+            on_startup=startup
+        )
+    finally:
+        if pool:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
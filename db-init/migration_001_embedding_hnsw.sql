@@ -0,0 +1,19 @@
+-- Approximate nearest-neighbour index for similarity search on images.embedding.
+-- Runs after init.sql on a fresh volume; safe to apply by hand to an existing database:
+--   psql -U postgres -d ai-tools -f db-init/migration_001_embedding_hnsw.sql
+--
+-- Build parameters (see app/benchmarks/annBenchmark.py for their recall/latency trade-off):
+--   m               graph degree; higher = better recall, bigger index, slower build
+--   ef_construction candidate list while building; higher = better graph, slower build
+-- Search-time recall is tuned per query with hnsw.ef_search (HNSW_EF_SEARCH in the MCP server).
+-- Filters such as `since` apply to the rows the index returns. pgvector >= 0.8 keeps scanning until
+-- enough rows pass (hnsw.iterative_scan, HNSW_ITERATIVE_SCAN in the MCP server). Older versions return
+-- at most ef_search candidates before filtering, so set HNSW_ITERATIVE_SCAN=off there.
+-- IVFFlat alternative for very large, rarely-updated tables:
+--   CREATE INDEX ... USING ivfflat (embedding vector_cosine_ops) WITH (lists = <rows / 1000>);
+CREATE INDEX IF NOT EXISTS images_embedding_hnsw_idx
+    ON images USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- Supports the `since` filter of search_similar_images
+CREATE INDEX IF NOT EXISTS images_created_at_idx ON images (created_at);
@@ -0,0 +1,10 @@
+-- Column for the half-precision search modes (EMBEDDING_STORAGE=full+half or half in the MCP server).
+-- Requires pgvector >= 0.7 (halfvec). Safe to re-run; apply to an existing database with:
+--   psql -U postgres -d ai-tools -f db-init/migration_002_embedding_quantized.sql
+--
+-- Only the column is created here, since every file in db-init runs on each fresh database. It stays NULL,
+-- and costs nothing, under the default EMBEDDING_STORAGE=full. The quantized indexes, which would add insert
+-- and memory cost to every deployment, are opt-in migrations outside db-init, one per mode that uses them:
+--   full+half, half   db-migrations/embedding_half.sql    (backfills embedding_half, builds its HNSW index)
+--   full+binary       db-migrations/embedding_binary.sql  (binary-quantized expression HNSW index)
+ALTER TABLE images ADD COLUMN IF NOT EXISTS embedding_half HALFVEC(768);
@@ -0,0 +1,8 @@
+-- Thumbnails and format variants written by app/workers/variantWorker.py, e.g.
+--   {"512.webp": "store://ab/<sha>.512.webp", "256.jpeg": "store://ab/<sha>.256.jpeg"}
+-- Safe to re-run; apply to an existing database with:
+--   psql -U postgres -d ai-tools -f db-init/migration_003_image_variants.sql
+ALTER TABLE images ADD COLUMN IF NOT EXISTS variants JSONB;
+
+-- store_image_variants updates every row sharing an image_url (reused images)
+CREATE INDEX IF NOT EXISTS images_image_url_idx ON images (image_url);
@@ -0,0 +1,11 @@
+-- Cluster-wide token buckets for the upstream generation APIs (MCP tool reserve_rate_limit).
+-- UNLOGGED: the balances are transient, so skip WAL; they simply reset after a crash.
+-- Apply to an existing database with:
+--   psql -U postgres -d ai-tools -f db-init/migration_004_rate_limits.sql
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limits (
+    backend TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,  -- negative while callers are waiting on reservations
+    rate DOUBLE PRECISION NOT NULL,    -- tokens refilled per second
+    burst DOUBLE PRECISION NOT NULL,   -- bucket capacity
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
@@ -0,0 +1,10 @@
+-- Generation jobs in flight, keyed by request identity, so identical /generate requests on
+-- any API replica join the first one's job instead of publishing their own (app/utils/singleFlight.py).
+-- UNLOGGED: claims are short-lived; after a crash identical requests simply start a new job.
+-- Apply to an existing database with:
+--   psql -U postgres -d ai-tools -f db-init/migration_005_inflight_jobs.sql
+CREATE UNLOGGED TABLE IF NOT EXISTS inflight_jobs (
+    job_key TEXT PRIMARY KEY,          -- sha256 of the DTO type and normalized prompt
+    job_id UUID NOT NULL,              -- the trace_id of the published message
+    expires_at TIMESTAMPTZ NOT NULL    -- claims past this are taken over by the next request
+);
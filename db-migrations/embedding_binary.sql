@@ -0,0 +1,10 @@
+-- Opt-in: binary-quantized shortlist search for EMBEDDING_STORAGE=full+binary (MCP server).
+-- Not in db-init, so fresh databases don't build it; apply before switching to that mode:
+--   psql -U postgres -d ai-tools -f db-migrations/embedding_binary.sql
+-- Requires pgvector >= 0.7 (binary_quantize). Safe to re-run.
+
+-- Sign bits of the full vector, indexed as an expression (no extra column).
+-- Only the index holds the compact form, so existing rows are covered as soon as it is built.
+CREATE INDEX IF NOT EXISTS images_embedding_bit_hnsw_idx
+    ON images USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops)
+    WITH (m = 16, ef_construction = 64);
@@ -0,0 +1,24 @@
+-- Opt-in: half-precision search for EMBEDDING_STORAGE=full+half or half (MCP server).
+-- Not in db-init, so fresh databases don't build it; apply before switching to either mode:
+--   psql -U postgres -d ai-tools -f db-migrations/embedding_half.sql
+-- Requires pgvector >= 0.7 and db-init/migration_002 (the embedding_half column). Safe to re-run.
+-- Size per 768-d vector: vector 3 KB, halfvec 1.5 KB, bit 96 B
+-- (app/benchmarks/quantizationBenchmark.py compares index size, memory and recall).
+
+-- Only full+half and half write embedding_half, so rows stored under full or full+binary lack it and are
+-- invisible to halfvec search. Re-run this file after switching to full+half or half; the UPDATE only
+-- touches rows still missing it. The MCP server warns at startup while any are left.
+UPDATE images
+SET embedding_half = embedding::halfvec(768)
+WHERE embedding IS NOT NULL AND embedding_half IS NULL;
+
+CREATE INDEX IF NOT EXISTS images_embedding_half_hnsw_idx
+    ON images USING hnsw (embedding_half halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- To move to half-only storage (EMBEDDING_STORAGE=half) once the backfill above has run,
+-- drop the full-precision copy and its indexes. Irreversible, so left for an operator:
+--   DROP INDEX IF EXISTS images_embedding_bit_hnsw_idx;
+--   DROP INDEX IF EXISTS images_embedding_hnsw_idx;
+--   UPDATE images SET embedding = NULL;
+--   VACUUM FULL images;